@@ -0,0 +1,127 @@
+"""
+End to end extraction throughput against a local stand-in api.
+
+    python benchmarks/bench_extract.py --accounts 2000 --latency 0.01 --workers 8
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from recurly_data.recurly_data import RecurlyData
+from tests.fake_api import FakeApi
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(args) -> dict:
+    with FakeApi(
+            accounts=args.accounts,
+            seed=args.seed,
+            latency=args.latency,
+            rate_limit=args.rate_limit,
+    ) as fake, tempfile.TemporaryDirectory() as tmp_dir:
+        rcd = RecurlyData(
+            api=fake.api,
+            v3_api=fake.v3_api,
+            stripe_api=fake.stripe_api,
+            api_key="bench",
+            stripe_key="bench",
+            filename=os.path.join(tmp_dir, "bench.csv"),
+            silence=True,
+            progress="none",
+            workers=args.workers,
+            subscription_join=args.subscription_join,
+            stripe_prefetch=args.stripe_prefetch,
+            page_size=args.page_size,
+            prefetch_pages=args.prefetch_pages,
+        )
+
+        # Time every build_row call, whichever worker thread makes it.
+        latencies = []
+        build_row = rcd.build_row
+
+        def timed_build_row(account):
+            started = time.perf_counter()
+            try:
+                return build_row(account)
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+        rcd.build_row = timed_build_row
+
+        started = time.perf_counter()
+        rcd.make_csv()
+        elapsed = time.perf_counter() - started
+        requests = dict(fake.requests)
+
+    return {
+        "accounts": args.accounts,
+        "workers": args.workers,
+        "latency": args.latency,
+        "subscription_join": args.subscription_join,
+        "stripe_prefetch": args.stripe_prefetch,
+        "page_size": args.page_size,
+        "prefetch_pages": args.prefetch_pages,
+        "seconds": round(elapsed, 3),
+        "accounts_per_second": round(args.accounts / elapsed, 1),
+        "requests": requests,
+        "requests_per_account": round(sum(requests.values()) / args.accounts, 2),
+        "build_row_p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "build_row_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        # ru_maxrss is in KiB on linux.
+        "peak_rss_mib": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--rate-limit", type=int, default=10 ** 6,
+        help="Requests per 5 minutes the fake api allows.",
+    )
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--prefetch-pages", type=int, default=2)
+    parser.add_argument("--subscription-join", action="store_true")
+    parser.add_argument("--stripe-prefetch", action="store_true")
+    parser.add_argument("--json", action="store_true", help="Print json.")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(
+        f"{result['accounts']} accounts in {result['seconds']:.2f}s "
+        f"({result['accounts_per_second']:.1f}/s) with {args.workers} workers"
+    )
+    print(
+        f"{result['requests_per_account']:.2f} requests/account  "
+        f"{result['requests']}"
+    )
+    print(
+        f"build_row p50 {result['build_row_p50_ms']:.2f} ms  "
+        f"p99 {result['build_row_p99_ms']:.2f} ms  "
+        f"peak rss {result['peak_rss_mib']:.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
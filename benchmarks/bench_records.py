@@ -0,0 +1,63 @@
+"""
+Compare export rows kept as dicts against Records.
+
+    python benchmarks/bench_records.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from recurly_data.record import COLUMNS, Record
+
+
+def dict_row(idx: int):
+    row = {column: "" for column in COLUMNS}
+    row["row"] = idx
+    row["email"] = f"customer{idx}@example.com"
+    row["created_at"] = "2020-01-01 00:00:00+00:00"
+    row["frequency"] = "Monthly"
+    row["pricing_amount"] = 599
+    return row
+
+
+def record_row(idx: int):
+    row = Record()
+    row.row = idx
+    row.email = f"customer{idx}@example.com"
+    row.created_at = "2020-01-01 00:00:00+00:00"
+    row.frequency = "Monthly"
+    row.pricing_amount = 599
+    return row
+
+
+def measure(build, rows: int):
+    tracemalloc.start()
+    started = time.perf_counter()
+    kept = [build(idx) for idx in range(rows)]
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    for name, build in (("dict", dict_row), ("Record", record_row)):
+        elapsed, peak = measure(build, args.rows)
+        print(
+            f"{name:>6}: {elapsed:6.2f}s  peak {peak / 2 ** 20:8.1f} MiB  "
+            f"{peak / args.rows:6.0f} B/row"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,164 +1,720 @@
-# pylint: disable=missing-module-docstring,invalid-name
+# pylint: disable=missing-module-docstring,import-outside-toplevel
 import argparse
-import os
-from recurly_data.recurly_data import RecurlyData
+import sys
+from typing import List, Optional
 from colorama import Fore
-from recurly_data.config import (
-    RECURLY_API, RECURLY_KEY, STRIPE_KEY, STRIPE_API, SENTRY
-)
 from . import __version__
 
+# Options defaulting to a setting from the environment or a .env file. They
+# are resolved after parsing, so --help and --version never load settings.
+SETTINGS = {
+    "recurly_key": "RECURLY_KEY",
+    "stripe_key": "STRIPE_KEY",
+    "recurly_api": "RECURLY_API",
+    "recurly_v3_api": "RECURLY_V3_API",
+    "stripe_api": "STRIPE_API",
+    "stripe_cache": "STRIPE_CACHE",
+    "stripe_cache_ttl": "STRIPE_CACHE_TTL",
+    "stripe_cache_negative_ttl": "STRIPE_CACHE_NEGATIVE_TTL",
+    "stripe_cache_max_entries": "STRIPE_CACHE_MAX_ENTRIES",
+    "account_cache": "ACCOUNT_CACHE",
+    "account_cache_ttl": "ACCOUNT_CACHE_TTL",
+    "account_cache_max_entries": "ACCOUNT_CACHE_MAX_ENTRIES",
+    "pool_size": "HTTP_POOL_SIZE",
+    "keep_alive": "HTTP_KEEP_ALIVE",
+    "metrics_file": "METRICS_FILE",
+    "prometheus_file": "PROMETHEUS_TEXTFILE",
+    "sentry": "SENTRY",
+}
 
-description = (
-    "Recurly Data Generator, generates customer data onto a csv file. Please "
-    "use a .env file to set RECURLY_KEY and STRIPE_KEY, or simply export the "
-    "environment variables before running this script. You can also set these "
-    "keys using --recurly-key and --stripe-key flags."
-)
-prog = f"recurly_data {__version__}"
-parser = argparse.ArgumentParser(
-    description=description,
-    prog=prog,
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-)
-group = parser.add_mutually_exclusive_group()
-group.add_argument(
-    "-q",
-    "--quiet",
-    default=False,
-    action="store_true",
-    help="Silent output."
-)
-group.add_argument(
-    "-v",
-    "--verbose",
-    default=False,
-    action="count",
-    help="Increase output verbosity.",
-)
-
-parser.add_argument(
-    "--version",
-    action='version',
-    version=__version__,
-    help="Get the package version."
-)
-
-parser.add_argument(
-    "-l",
-    "--limit",
-    type=int,
-    help="Set a limit for the number of records."
-)
-
-parser.add_argument(
-    "-f",
-    "--file",
-    type=str,
-    default="recurly_data.csv",
-    help=(
-        "The filename where records should be stored. "
-        "A file will be created if it doesn't already exist."
-    )
-)
-
-parser.add_argument(
-    "--begin-time",
-    type=str,
-    help=(
-        "Filters records to only include those with datetimes greater than or "
-        "equal to the supplied datetime. Accepts an ISO 8601 date or date and "
-        "time."
-    )
-)
-
-parser.add_argument(
-    "--end-time",
-    type=str,
-    help=(
-        "Filters records to only include those with datetimes less than or "
-        "equal to the supplied datetime. Accepts an ISO 8601 date or date and "
-        "time."
-    )
-)
-
-parser.add_argument(
-    "--order",
-    type=str,
-    default="asc",
-    choices=["asc", "desc"],
-    help=(
-        "The order in which products will be returned: asc for ascending "
-        "order, desc for descending order."
-    )
-)
-
-parser.add_argument(
-    "--subscription-state",
-    type=str,
-    default="live",
-    choices=[
-        "active", "paused", "canceled", "expired",
-        "future", "in_trial", "live", "past_due"
-    ],
-    help="The state of subscriptions to return."
-)
-
-parser.add_argument(
-    "--recurly-key",
-    type=str,
-    default=RECURLY_KEY,
-    help=(
-        "The Recurly API Key. "
-        "This option overrides the environment variable 'RECURLY_KEY'."
-    )
-)
-
-parser.add_argument(
-    "--stripe-key",
-    type=str,
-    default=STRIPE_KEY,
-    help=(
-        "The Stripe API Key. "
-        "This option overrides the environment variable 'STRIPE_KEY'."
-    )
-)
-
-parser.add_argument(
-    "--recurly-api",
-    type=str,
-    default=RECURLY_API,
-    help=(
-        "The Recurly API base url. "
-        "This option overrides the environment variable 'RECURLY_API'."
-    )
-)
-
-parser.add_argument(
-    "--stripe-api",
-    type=str,
-    default=STRIPE_API,
-    help=(
-        "The Stripe API base url. "
-        "This option overrides the environment variable 'STRIPE_API'."
-    )
-)
-
-parser.add_argument(
-    "--sentry",
-    type=str,
-    default=SENTRY,
-    help=(
-        "Supply the custom sentry url. "
-        "Connect with your team/personal sentry account. "
-        "This option overrides the environment variable 'SENTRY'."
-    )
-)
-
-args = parser.parse_args()
-
-if args.recurly_key:
-    rcd = RecurlyData(
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command line parser."""
+    description = (
+        "Recurly Data Generator, generates customer data onto a csv file. Please "
+        "use a .env file to set RECURLY_KEY and STRIPE_KEY, or simply export the "
+        "environment variables before running this script. You can also set these "
+        "keys using --recurly-key and --stripe-key flags. Run 'recurly_data "
+        "merge --help' to merge exports."
+    )
+    prog = f"recurly_data {__version__}"
+    parser = argparse.ArgumentParser(
+        description=description,
+        prog=prog,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "-q",
+        "--quiet",
+        default=False,
+        action="store_true",
+        help="Silent output."
+    )
+    group.add_argument(
+        "-v",
+        "--verbose",
+        default=False,
+        action="count",
+        help="Increase output verbosity.",
+    )
+
+    parser.add_argument(
+        "--progress",
+        type=str,
+        default="bar",
+        choices=["bar", "log", "none"],
+        help=(
+            "How to show progress: a progress bar when writing to a terminal, "
+            "a plain periodic log line, or nothing."
+        )
+    )
+
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=0.2,
+        help="Seconds between progress bar redraws."
+    )
+
+    parser.add_argument(
+        "--log-interval",
+        type=float,
+        default=30.0,
+        help="Seconds between progress log lines."
+    )
+
+    parser.add_argument(
+        "--version",
+        action='version',
+        version=__version__,
+        help="Get the package version."
+    )
+
+    parser.add_argument(
+        "-l",
+        "--limit",
+        type=int,
+        help="Set a limit for the number of records."
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help=(
+            "The number of accounts to enrich concurrently. Rows are still "
+            "written in the same order the accounts are listed."
+        )
+    )
+
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=200,
+        help=(
+            "How many accounts to list per request, up to the api maximum "
+            "of 200."
+        )
+    )
+
+    parser.add_argument(
+        "--prefetch-pages",
+        type=int,
+        default=2,
+        help=(
+            "List accounts on a background thread up to this many pages "
+            "ahead of the ones being enriched. 0 lists them inline."
+        )
+    )
+
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help=(
+            "Split the account range into this many time windows of about the "
+            "same number of accounts, extract each in its own process and merge "
+            "them into one file."
+        )
+    )
+
+    parser.add_argument(
+        "--site",
+        nargs=2,
+        action="append",
+        metavar=("API", "KEY"),
+        help=(
+            "Extract a recurly site given by its v2 api url and api key. "
+            "Repeat to extract several sites concurrently in one process, "
+            "sharing http connections and the stripe cache. Each site is "
+            "written to the --file name with the site added, e.g. "
+            "recurly_data.dropout.csv."
+        )
+    )
+
+    parser.add_argument(
+        "--site-column",
+        default=False,
+        action="store_true",
+        help=(
+            "With several --site options, write all sites to --file with a "
+            "site column instead of a file per site."
+        )
+    )
+
+    parser.add_argument(
+        "-f",
+        "--file",
+        type=str,
+        default="recurly_data.csv",
+        help=(
+            "The filename where records should be stored. "
+            "A file will be created if it doesn't already exist."
+        )
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="csv",
+        choices=["csv", "csv.gz", "csv.zst", "jsonl", "jsonl.gz", "jsonl.zst", "sqlite"],
+        help=(
+            "The output format. JSON Lines keeps pending_change as a nested "
+            "object and sqlite writes a recurly_data table indexed on email. "
+            "The zst formats need the zstandard package."
+        )
+    )
+
+    parser.add_argument(
+        "--flush-every",
+        type=int,
+        default=1000,
+        help="Flush rows to the file after this many rows."
+    )
+
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=5.0,
+        help="Flush rows to the file after this many seconds."
+    )
+
+    parser.add_argument(
+        "--fsync",
+        default=False,
+        action="store_true",
+        help="Force every flush to disk."
+    )
+
+    parser.add_argument(
+        "--resume",
+        default=False,
+        action="store_true",
+        help=(
+            "Resume an interrupted extraction into --file from its last "
+            "checkpoint, with the order and filters it was started with."
+        )
+    )
+
+    parser.add_argument(
+        "--since-last-run",
+        default=False,
+        action="store_true",
+        help=(
+            "Only extract accounts updated since the last successful "
+            "--since-last-run and upsert them into --file by email. Accounts "
+            "that are no longer subscribers are removed from it."
+        )
+    )
+
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=1000,
+        help="Save a resume checkpoint after this many rows."
+    )
+
+    parser.add_argument(
+        "--begin-time",
+        type=str,
+        help=(
+            "Filters records to only include those with datetimes greater than or "
+            "equal to the supplied datetime. Accepts an ISO 8601 date or date and "
+            "time."
+        )
+    )
+
+    parser.add_argument(
+        "--end-time",
+        type=str,
+        help=(
+            "Filters records to only include those with datetimes less than or "
+            "equal to the supplied datetime. Accepts an ISO 8601 date or date and "
+            "time."
+        )
+    )
+
+    parser.add_argument(
+        "--order",
+        type=str,
+        default="asc",
+        choices=["asc", "desc"],
+        help=(
+            "The order in which products will be returned: asc for ascending "
+            "order, desc for descending order."
+        )
+    )
+
+    parser.add_argument(
+        "--subscription-state",
+        type=str,
+        default="live",
+        choices=[
+            "active", "paused", "canceled", "expired",
+            "future", "in_trial", "live", "past_due"
+        ],
+        help="The state of subscriptions to return."
+    )
+
+    parser.add_argument(
+        "--subscription-join",
+        default=False,
+        action="store_true",
+        help=(
+            "List the site's subscriptions once and join them to accounts, "
+            "instead of listing the subscriptions of every account."
+        )
+    )
+
+    parser.add_argument(
+        "--spill-subscriptions",
+        default=False,
+        action="store_true",
+        help=(
+            "Keep the --subscription-join index in a temporary file instead of "
+            "memory."
+        )
+    )
+
+    parser.add_argument(
+        "--recurly-key",
+        type=str,
+        default=None,
+        help=(
+            "The Recurly API Key. "
+            "This option overrides the environment variable 'RECURLY_KEY'."
+        )
+    )
+
+    parser.add_argument(
+        "--stripe-key",
+        type=str,
+        default=None,
+        help=(
+            "The Stripe API Key. "
+            "This option overrides the environment variable 'STRIPE_KEY'."
+        )
+    )
+
+    parser.add_argument(
+        "--recurly-api",
+        type=str,
+        default=None,
+        help=(
+            "The Recurly API base url. "
+            "This option overrides the environment variable 'RECURLY_API'."
+        )
+    )
+
+    parser.add_argument(
+        "--recurly-v3-api",
+        type=str,
+        default=None,
+        help=(
+            "The Recurly v3 API base url used to list accounts, subscriptions "
+            "and redemptions. "
+            "This option overrides the environment variable 'RECURLY_V3_API'."
+        )
+    )
+
+    parser.add_argument(
+        "--stripe-api",
+        type=str,
+        default=None,
+        help=(
+            "The Stripe API base url. "
+            "This option overrides the environment variable 'STRIPE_API'."
+        )
+    )
+
+    parser.add_argument(
+        "--stripe-prefetch",
+        default=False,
+        action="store_true",
+        help=(
+            "Load every stripe customer up front and look up stripe ids by email "
+            "in memory. Emails missing from the index are still looked up one "
+            "by one."
+        )
+    )
+
+    parser.add_argument(
+        "--stripe-cache",
+        type=str,
+        default=None,
+        help=(
+            "Path of a sqlite file used to cache stripe ids between runs. "
+            "This option overrides the environment variable 'STRIPE_CACHE'."
+        )
+    )
+
+    parser.add_argument(
+        "--stripe-cache-ttl",
+        type=int,
+        default=None,
+        help="Seconds a cached stripe id stays valid."
+    )
+
+    parser.add_argument(
+        "--stripe-cache-negative-ttl",
+        type=int,
+        default=None,
+        help="Seconds an email without a stripe customer stays cached."
+    )
+
+    parser.add_argument(
+        "--stripe-cache-max-entries",
+        type=int,
+        default=None,
+        help="Evict the least recently used stripe ids beyond this many entries."
+    )
+
+    parser.add_argument(
+        "--account-cache",
+        type=str,
+        default=None,
+        help=(
+            "Path of a sqlite file used to cache the subscription and "
+            "redemption fields of accounts between runs. Accounts whose "
+            "updated_at has not changed skip both listings. "
+            "This option overrides the environment variable 'ACCOUNT_CACHE'."
+        )
+    )
+
+    parser.add_argument(
+        "--account-cache-ttl",
+        type=int,
+        default=None,
+        help=(
+            "Seconds cached account fields stay valid. They also expire at "
+            "the next billing date."
+        )
+    )
+
+    parser.add_argument(
+        "--account-cache-max-entries",
+        type=int,
+        default=None,
+        help="Evict the least recently used accounts beyond this many entries."
+    )
+
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=None,
+        help=(
+            "The number of pooled http connections shared by the recurly and "
+            "stripe requests. Raised to the number of workers if lower. "
+            "This option overrides the environment variable 'HTTP_POOL_SIZE'."
+        )
+    )
+
+    parser.add_argument(
+        "--no-keep-alive",
+        dest="keep_alive",
+        default=None,
+        action="store_false",
+        help="Close http connections after every request."
+    )
+
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=5,
+        help=(
+            "How many times to retry a request that failed with a network "
+            "error, a 429 or a 5xx. Listings carry on from the page that failed."
+        )
+    )
+
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=0.5,
+        help=(
+            "Seconds of the first retry backoff, doubled on every retry and "
+            "jittered. A longer Retry-After from the server is honored."
+        )
+    )
+
+    parser.add_argument(
+        "--retry-max-backoff",
+        type=float,
+        default=60.0,
+        help="The longest backoff between retries in seconds."
+    )
+
+    parser.add_argument(
+        "--breaker-threshold",
+        type=int,
+        default=5,
+        help=(
+            "Pause all workers after this many failed requests in a row to the "
+            "same api."
+        )
+    )
+
+    parser.add_argument(
+        "--breaker-cooldown",
+        type=float,
+        default=30.0,
+        help="Seconds to pause all workers for once the breaker opens."
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        help=(
+            "Where to write the json summary of the run's per endpoint http "
+            "metrics. Defaults to the --file name with a .metrics.json suffix. "
+            "This option overrides the environment variable 'METRICS_FILE'."
+        )
+    )
+
+    parser.add_argument(
+        "--prometheus-file",
+        type=str,
+        default=None,
+        help=(
+            "Also write the run's metrics to this file for the prometheus node "
+            "exporter textfile collector. "
+            "This option overrides the environment variable 'PROMETHEUS_TEXTFILE'."
+        )
+    )
+
+    parser.add_argument(
+        "--plan",
+        default=False,
+        action="store_true",
+        help=(
+            "Dry run: sample a few accounts, estimate the requests, rate limit "
+            "budget and time the extraction needs, recommend workers, page "
+            "size, shards and --subscription-join, and exit."
+        )
+    )
+
+    parser.add_argument(
+        "--auto-tune",
+        default=False,
+        action="store_true",
+        help="Plan the extraction like --plan, then run it with the recommendations."
+    )
+
+    parser.add_argument(
+        "--plan-sample",
+        type=int,
+        default=20,
+        help="How many accounts --plan and --auto-tune sample."
+    )
+
+    parser.add_argument(
+        "--profile",
+        default=False,
+        action="store_true",
+        help=(
+            "Time every stage of the extraction and report its wall and cpu "
+            "time along with the slowest accounts."
+        )
+    )
+
+    parser.add_argument(
+        "--profile-file",
+        type=str,
+        default=None,
+        help=(
+            "Profile the run with cProfile and dump the stats to this file, "
+            "for pstats, snakeviz or flame graph tools. Implies --profile. "
+            "Only the main thread is profiled, so use one worker to see the "
+            "enrichment."
+        )
+    )
+
+    parser.add_argument(
+        "--sentry",
+        type=str,
+        default=None,
+        help=(
+            "Supply the custom sentry url. "
+            "Connect with your team/personal sentry account. "
+            "This option overrides the environment variable 'SENTRY'."
+        )
+    )
+    return parser
+
+
+def build_merge_parser() -> argparse.ArgumentParser:
+    """Build the command line parser of the merge command."""
+    parser = argparse.ArgumentParser(
+        description=(
+            "Merge exports into one file, keeping only the newest row of every "
+            "account. Rows in later files, and later in a file, are newer. Rows "
+            "keep the order they were read in and are renumbered."
+        ),
+        prog=f"recurly_data {__version__} merge",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        metavar="FILE",
+        help=(
+            "The exports to merge, oldest first, in any of the csv or JSON "
+            "Lines formats."
+        )
+    )
+
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        default=False,
+        action="store_true",
+        help="Silent output."
+    )
+
+    parser.add_argument(
+        "-f",
+        "--file",
+        type=str,
+        default="recurly_data.csv",
+        help=(
+            "The filename to write the merged export to. It may be one of "
+            "the exports being merged."
+        )
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="csv",
+        choices=["csv", "csv.gz", "csv.zst", "jsonl", "jsonl.gz", "jsonl.zst", "sqlite"],
+        help="The output format."
+    )
+
+    parser.add_argument(
+        "--key",
+        type=str,
+        default="email",
+        help=(
+            "The column identifying an account. Exports with a site column "
+            "are deduplicated per site."
+        )
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100000,
+        help=(
+            "How many rows to sort in memory at a time. Larger chunks are "
+            "faster and use more memory."
+        )
+    )
+
+    parser.add_argument(
+        "--tmp-dir",
+        type=str,
+        default=None,
+        help="Where to write the sorted chunks. Defaults to the system temp directory."
+    )
+    return parser
+
+
+def merge(argv: List[str]) -> int:
+    """Run the merge command."""
+    args = build_merge_parser().parse_args(argv)
+
+    from recurly_data.merge import merge_exports
+    from recurly_data.runtime import init_colors
+
+    init_colors()
+    rows = merge_exports(
+        args.files,
+        args.file,
+        output_format=args.format,
+        key=args.key,
+        chunk_size=args.chunk_size,
+        tmp_dir=args.tmp_dir,
+    )
+    if not args.quiet:
+        print(f"Merged {Fore.GREEN}{rows}{Fore.RESET} rows into {args.file}")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the command line interface."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["merge"]:
+        return merge(argv[1:])
+    args = build_parser().parse_args(argv)
+
+    from recurly_data import config
+    from recurly_data.runtime import init_colors
+
+    init_colors()
+    for dest, setting in SETTINGS.items():
+        if getattr(args, dest) is None:
+            setattr(args, dest, getattr(config, setting))
+
+    if not args.recurly_key and not args.site:
+        print(Fore.RED + "Missing reculry api key.")
+        return 1
+    if args.site and args.shards > 1:
+        print(Fore.RED + "Sharding is not supported with --site.")
+        return 1
+    if args.since_last_run and args.shards > 1:
+        print(Fore.RED + "Sharding is not supported with --since-last-run.")
+        return 1
+    if args.resume and args.shards > 1:
+        print(Fore.RED + "Sharding is not supported with --resume.")
+        return 1
+    if (args.profile or args.profile_file) and (args.site or args.shards > 1):
+        print(Fore.RED + "Profiling is not supported with --site or --shards.")
+        return 1
+    if (args.plan or args.auto_tune) and args.site:
+        print(Fore.RED + "Planning is not supported with --site.")
+        return 1
+
+    stripe_cache_options = None
+    if args.stripe_cache:
+        stripe_cache_options = {
+            "path": args.stripe_cache,
+            "ttl": args.stripe_cache_ttl,
+            "negative_ttl": args.stripe_cache_negative_ttl,
+            "max_entries": args.stripe_cache_max_entries,
+        }
+
+    account_cache_options = None
+    if args.account_cache:
+        account_cache_options = {
+            "path": args.account_cache,
+            "ttl": args.account_cache_ttl,
+            "max_entries": args.account_cache_max_entries,
+        }
+
+    options = dict(
         limit=args.limit,
         silence=args.quiet,
         verbose=args.verbose,
@@ -168,26 +724,108 @@ if args.recurly_key:
         order=args.order,
         subscription_state=args.subscription_state,
         api=args.recurly_api,
+        v3_api=args.recurly_v3_api,
         api_key=args.recurly_key,
         stripe_api=args.stripe_api,
         stripe_key=args.stripe_key,
+        workers=args.workers,
+        stripe_prefetch=args.stripe_prefetch,
+        pool_size=args.pool_size,
+        keep_alive=args.keep_alive,
+        flush_every=args.flush_every,
+        flush_interval=args.flush_interval,
+        fsync=args.fsync,
+        resume=args.resume,
+        checkpoint_every=args.checkpoint_every,
+        subscription_join=args.subscription_join,
+        spill_subscriptions=args.spill_subscriptions,
+        progress=args.progress,
+        progress_interval=args.progress_interval,
+        log_interval=args.log_interval,
+        since_last_run=args.since_last_run,
+        output_format=args.format,
+        metrics_file=args.metrics_file or f"{args.file}.metrics.json",
+        prometheus_file=args.prometheus_file,
+        retries=args.retries,
+        retry_backoff=args.retry_backoff,
+        retry_max_backoff=args.retry_max_backoff,
+        breaker_threshold=args.breaker_threshold,
+        breaker_cooldown=args.breaker_cooldown,
+        sentry=args.sentry,
+        page_size=args.page_size,
+        prefetch_pages=args.prefetch_pages,
     )
+    if args.profile or args.profile_file:
+        options.update(profile=True, profile_file=args.profile_file)
 
+    shards = args.shards
+    if args.plan or args.auto_tune:
+        from recurly_data.planner import format_plan, plan_extraction
+        from recurly_data.recurly_data import RecurlyData
 
+        rcd = RecurlyData(**dict(
+            options, silence=True, resume=False, prefetch_catalog=False
+        ))
+        plan = plan_extraction(
+            rcd, shards=shards, sample=args.plan_sample, resume=args.resume
+        )
+        if args.plan or not args.quiet:
+            print(format_plan(plan))
+        if args.plan:
+            return 0
+        recommended = plan["recommended"]
+        options.update(
+            workers=recommended["workers"],
+            page_size=recommended["page_size"],
+            subscription_join=recommended["subscription_join"],
+        )
+        if not args.profile and not args.profile_file:
+            shards = recommended["shards"]
 
+    if args.site:
+        from recurly_data.cache import AccountCache, StripeCache
+        from recurly_data.sites import extract_sites
 
+        stripe_cache = None
+        if stripe_cache_options:
+            stripe_cache = StripeCache(**stripe_cache_options)
+        account_cache = None
+        if account_cache_options:
+            account_cache = AccountCache(**account_cache_options)
+        for name in ("api", "api_key"):
+            options.pop(name)
+        extract_sites(
+            args.site,
+            combined=args.site_column,
+            stripe_cache=stripe_cache,
+            account_cache=account_cache,
+            **options,
+        )
+    elif shards > 1:
+        from recurly_data.shards import extract_sharded
 
+        extract_sharded(
+            shards,
+            stripe_cache_options=stripe_cache_options,
+            account_cache_options=account_cache_options,
+            **options
+        )
+    else:
+        from recurly_data.cache import AccountCache, StripeCache
+        from recurly_data.recurly_data import RecurlyData
 
+        stripe_cache = None
+        if stripe_cache_options:
+            stripe_cache = StripeCache(**stripe_cache_options)
+        account_cache = None
+        if account_cache_options:
+            account_cache = AccountCache(**account_cache_options)
+        rcd = RecurlyData(
+            stripe_cache=stripe_cache, account_cache=account_cache, **options
+        )
+        rcd.make_csv()
+    return 0
 
 
-
-    # print(rcd.get_first_account_datetime())
-    # print(rcd.get_accounts())
-    # print(rcd.total_accounts)
-    # print(rcd.api_limit)
-    # print(rcd.api_limit_remaining)
-    # print(rcd.api_limit_reset_time)
-    #rcd.extract_data()
-    rcd.make_csv()
-else:
-    print(Fore.RED + "Missing reculry api key.")
+if __name__ == "__main__":
+    sys.exit(main())
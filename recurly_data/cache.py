@@ -0,0 +1,234 @@
+"""Persistent caches."""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from colorama import Fore
+
+
+class SqliteCache:
+    """Base class of the sqlite file caches, evicting least recently used entries."""
+
+    name = "Cache"
+    table = ""
+    schema = ""
+    key: Tuple[str, ...] = ()
+
+    def __init__(
+            self,
+            path: str,
+            max_entries: int = 1000000,
+            busy_timeout: float = 30.0,
+    ):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__where = " AND ".join(f"{column} = ?" for column in self.key)
+        # Every statement is its own transaction, so processes sharing the
+        # file only hold its write lock for a single write.
+        self.__conn = sqlite3.connect(
+            self.path,
+            timeout=busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ({self.schema})"
+        )
+        self.__conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_used_at "
+            f"ON {self.table} (used_at)"
+        )
+
+    def __len__(self):
+        with self.__lock:
+            return self.__count()
+
+    def __bool__(self):
+        # An empty cache is still a cache, not a missing one.
+        return True
+
+    def _lookup(
+            self,
+            key: tuple,
+            columns: str,
+            fresh: Callable[[tuple], bool],
+    ) -> Optional[tuple]:
+        """Get columns of a key's entry when ``fresh`` of them, or None on a miss."""
+        now = time.time()
+        with self.__lock:
+            found = self.__conn.execute(
+                f"SELECT {columns} FROM {self.table} WHERE {self.__where}", key
+            ).fetchone()
+
+            if found and fresh(found):
+                self.__conn.execute(
+                    f"UPDATE {self.table} SET used_at = ? WHERE {self.__where}",
+                    (now,) + key
+                )
+                self.hits += 1
+                return found
+
+            self.misses += 1
+            return None
+
+    def _store(self, key: tuple, fields: Dict):
+        """Store the fields of a key, evicting old entries if full."""
+        columns = self.key + tuple(fields) + ("used_at",)
+        values = key + tuple(fields.values()) + (time.time(),)
+        with self.__lock:
+            self.__conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})",
+                values
+            )
+            size = self.__count()
+            if size > self.max_entries:
+                self.__evict(size - self.max_entries)
+
+    def __count(self) -> int:
+        return self.__conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def __evict(self, count: int):
+        """Delete the least recently used entries."""
+        self.__conn.execute(
+            f"DELETE FROM {self.table} WHERE rowid IN ("
+            f"SELECT rowid FROM {self.table} ORDER BY used_at LIMIT ?)",
+            (count,)
+        )
+
+    def _delete(self, where: str, params: tuple, vacuum_ratio: float) -> int:
+        """Delete entries matching a where clause, vacuuming once enough pages are free."""
+        with self.__lock:
+            deleted = self.__conn.execute(
+                f"DELETE FROM {self.table} WHERE {where}", params
+            ).rowcount
+            pages = self.__conn.execute("PRAGMA page_count").fetchone()[0]
+            free = self.__conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if pages and free / pages > vacuum_ratio:
+                self.__conn.execute("VACUUM")
+            return deleted
+
+    def report(self) -> str:
+        """The hits and misses of the cache, for the end of a run."""
+        return (
+            f"{self.name}: {Fore.GREEN}{self.hits} hits{Fore.RESET}, "
+            f"{Fore.YELLOW}{self.misses} misses"
+        )
+
+    def close(self):
+        """Close the database."""
+        with self.__lock:
+            self.__conn.close()
+
+
+class StripeCache(SqliteCache):
+    """Email to stripe id cache, kept shorter for emails without a customer."""
+
+    name = "Stripe cache"
+    table = "stripe_ids"
+    schema = (
+        "email TEXT PRIMARY KEY, "
+        "stripe_id TEXT NOT NULL, "
+        "fetched_at REAL NOT NULL, "
+        "used_at REAL NOT NULL"
+    )
+    key = ("email",)
+
+    def __init__(
+            self,
+            path: str = "stripe_cache.sqlite3",
+            ttl: int = 7 * 24 * 60 * 60,
+            negative_ttl: int = 24 * 60 * 60,
+            max_entries: int = 1000000,
+            busy_timeout: float = 30.0,
+    ):
+        super().__init__(path, max_entries, busy_timeout)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def get(self, email: str) -> Optional[str]:
+        """Get the cached stripe id for an email, or None on a miss."""
+        now = time.time()
+
+        def fresh(found: tuple) -> bool:
+            stripe_id, fetched_at = found
+            return now - fetched_at < (self.ttl if stripe_id else self.negative_ttl)
+
+        found = self._lookup((email,), "stripe_id, fetched_at", fresh)
+        return None if found is None else found[0]
+
+    def set(self, email: str, stripe_id: str):
+        """Store the stripe id for an email, empty when it has none."""
+        self._store((email,), {"stripe_id": stripe_id or "", "fetched_at": time.time()})
+
+
+class AccountCache(SqliteCache):
+    """Per account enrichment cache, used while the account's updated_at holds."""
+
+    name = "Account cache"
+    table = "accounts"
+    schema = (
+        "account_id TEXT NOT NULL, "
+        "state TEXT NOT NULL, "
+        "updated_at TEXT NOT NULL, "
+        "fields TEXT NOT NULL, "
+        "expires_at REAL NOT NULL, "
+        "used_at REAL NOT NULL, "
+        "PRIMARY KEY (account_id, state)"
+    )
+    key = ("account_id", "state")
+
+    def __init__(
+            self,
+            path: str = "account_cache.sqlite3",
+            ttl: int = 7 * 24 * 60 * 60,
+            max_entries: int = 1000000,
+            busy_timeout: float = 30.0,
+            compact_on_close: bool = True,
+    ):
+        super().__init__(path, max_entries, busy_timeout)
+        self.ttl = ttl
+        self.compact_on_close = compact_on_close
+
+    def get(self, account_id: str, updated_at: str, state: str) -> Optional[Dict]:
+        """Get the cached fields of an account, or None on a miss."""
+        now = time.time()
+        found = self._lookup(
+            (account_id, state),
+            "updated_at, fields, expires_at",
+            lambda found: found[0] == updated_at and now < found[2],
+        )
+        return None if found is None else json.loads(found[1])
+
+    def set(
+            self,
+            account_id: str,
+            updated_at: str,
+            state: str,
+            fields: Dict,
+            expires_at: Optional[float] = None,
+    ):
+        """Store the fields of an account as of its updated_at."""
+        now = time.time()
+        self._store((account_id, state), {
+            "updated_at": updated_at,
+            "fields": json.dumps(fields),
+            "expires_at": min(now + self.ttl, expires_at or now + self.ttl),
+        })
+
+    def compact(self, vacuum_ratio: float = 0.25) -> int:
+        """Delete expired entries and return how many were deleted."""
+        return self._delete("expires_at <= ?", (time.time(),), vacuum_ratio)
+
+    def close(self):
+        """Compact the cache unless shared and close the database."""
+        if self.compact_on_close:
+            self.compact()
+        super().close()
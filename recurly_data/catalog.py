@@ -0,0 +1,62 @@
+"""Plan and coupon catalog."""
+from typing import Dict, Iterable, Tuple
+
+
+def frequency_name(name: str) -> str:
+    """The billing frequency of a plan, from the first word of its name."""
+    name = name.split(" ")[0]
+    if name == "Annual":
+        name = "Yearly"
+    return name
+
+
+def discounted_price(price: int, discount) -> int:
+    """A price in cents after a coupon discount."""
+    discount_type = discount.type
+    if discount_type == "percent":
+        price = int(
+            price - (price * discount.percent/100)
+        )
+    elif discount_type == "fixed":
+        price = int(
+            price - (discount.currencies[0].amount * 100)
+        )
+    return price
+
+
+class Catalog:
+    """The plans and coupons of a site by code, with memoized frequencies and prices."""
+
+    def __init__(self):
+        self.plans: Dict[str, object] = {}
+        self.coupons: Dict[str, object] = {}
+        self.loaded = False
+        # Results never change, so threads racing to memoize one are harmless.
+        self.__frequencies: Dict[str, str] = {}
+        self.__prices: Dict[Tuple[str, int], int] = {}
+
+    def load(self, plans: Iterable, coupons: Iterable):
+        """Add listed plans and coupons to the catalog."""
+        for plan in plans:
+            self.plans[plan.code] = plan
+        for coupon in coupons:
+            self.coupons[coupon.code] = coupon
+        self.loaded = True
+
+    def frequency(self, plan) -> str:
+        """The frequency of a plan, given the plan or its mini object."""
+        code = plan.code
+        frequency = self.__frequencies.get(code)
+        if frequency is None:
+            name = self.plans[code].name if code in self.plans else plan.name
+            frequency = self.__frequencies[code] = frequency_name(name)
+        return frequency
+
+    def discounted_price(self, coupon, price: int) -> int:
+        """A price in cents after the discount of a coupon."""
+        key = (coupon.code, price)
+        discounted = self.__prices.get(key)
+        if discounted is None:
+            discount = self.coupons.get(coupon.code, coupon).discount
+            discounted = self.__prices[key] = discounted_price(price, discount)
+        return discounted
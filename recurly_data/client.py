@@ -0,0 +1,166 @@
+"""Recurly client."""
+from datetime import timezone
+import http.client
+import time
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+import recurly
+from recurly_data.metrics import Metrics
+from recurly_data.retry import Retry, parse_retry_after
+from recurly_data.scheduler import RateLimiter
+
+
+class Client(recurly.Client):
+    """
+    Recurly client that paces, retries and records every request.
+
+    ``base_url`` points it at another host, such as a local stand-in server.
+    """
+
+    endpoints = {
+        "accounts": "accounts",
+        "accounts/*/subscriptions": "subscriptions",
+        "accounts/*/coupon_redemptions": "redemptions",
+        "subscriptions": "site_subscriptions",
+    }
+
+    def __init__(
+            self,
+            api_key: str,
+            rate_limiter: Optional[RateLimiter] = None,
+            on_response: Optional[Callable[[recurly.Response], None]] = None,
+            base_url: Optional[str] = None,
+            timeout: Optional[int] = None,
+            metrics: Optional[Metrics] = None,
+            retry: Optional[Retry] = None,
+            log=None,
+    ):
+        super().__init__(api_key, timeout=timeout)
+        self.rate_limiter = rate_limiter
+        self.on_response = on_response
+        self.metrics = metrics
+        self.retry = retry or Retry()
+        self.log = log
+        if base_url:
+            url = urlsplit(base_url)
+            if url.hostname != recurly.base_client.HOST or url.scheme != "https":
+                connection = (
+                    http.client.HTTPSConnection if url.scheme == "https"
+                    else http.client.HTTPConnection
+                )
+                # The recurly client always connects to its own api host,
+                # so swap in a connection to the requested one.
+                # pylint: disable=attribute-defined-outside-init
+                self._BaseClient__conn = connection(
+                    url.hostname, url.port, timeout=timeout
+                )
+
+    @classmethod
+    def endpoint(cls, path: str) -> str:
+        """Metrics name of the endpoint of a request path."""
+        parts = path.split("?")[0].strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "accounts":
+            parts[1] = "*"
+        return cls.endpoints.get("/".join(parts), parts[-1] or "other")
+
+    def _make_request(self, method, path, body, params):
+        endpoint = self.endpoint(path)
+        retry = self.retry
+        attempt = 0
+        while True:
+            attempt += 1
+            wait = retry.before_request()
+            if self.rate_limiter:
+                wait += self.rate_limiter.acquire()
+            if self.metrics:
+                self.metrics.observe_wait(endpoint, wait)
+            started = time.perf_counter()
+            try:
+                resource = super()._make_request(method, path, body, params)
+            except recurly.errors.TooManyRequestsError as excpt:
+                self.observe(endpoint, started, excpt.error, 429)
+                self.update_limits(excpt.error)
+                if self.rate_limiter:
+                    self.rate_limiter.exhausted()
+                failure = excpt
+            except recurly.errors.ServerError as excpt:
+                self.observe(endpoint, started, excpt.error, 500)
+                retry.failure()
+                failure = excpt
+            except recurly.ApiError as excpt:
+                self.observe(endpoint, started, excpt.error, 400)
+                if self.log:
+                    self.log.error(f"{method} {path}: {excpt.__class__.__name__}: {excpt}")
+                raise
+            except recurly.NetworkError as excpt:
+                self.observe(endpoint, started, None, None)
+                # The connection may be left mid response, start a new one.
+                self._BaseClient__conn.close()
+                retry.failure()
+                failure = excpt
+            else:
+                self.observe(endpoint, started, resource, 200)
+                self.update_limits(resource)
+                retry.success()
+                return resource
+
+            if not retry.should_retry(attempt):
+                if self.log:
+                    self.log.error(
+                        f"{method} {path}: {failure.__class__.__name__}: "
+                        f"{failure}, giving up after {attempt} attempts"
+                    )
+                raise failure
+            if self.log:
+                self.log.warning(
+                    f"{method} {path}: {failure.__class__.__name__}: "
+                    f"{failure}, retrying"
+                )
+            if self.metrics:
+                self.metrics.observe_retry(endpoint)
+            retry.wait(attempt, self.retry_after(getattr(failure, "error", None)))
+
+    @staticmethod
+    def retry_after(resource) -> Optional[float]:
+        """Seconds from the Retry-After header of an error's response."""
+        try:
+            response = resource.get_response()
+        except AttributeError:
+            return None
+        headers = getattr(response, "_Response__headers", None) or {}
+        return parse_retry_after(headers.get("Retry-After"))
+
+    def observe(self, endpoint: str, started: float, resource, status: Optional[int]):
+        """Record a request in the metrics."""
+        if not self.metrics:
+            return
+        seconds = time.perf_counter() - started
+        size = 0
+        try:
+            response = resource.get_response()
+        except AttributeError:
+            pass
+        else:
+            status = response.status
+            size = len(response.body or b"")
+        self.metrics.observe(endpoint, seconds, status, size)
+
+    def update_limits(self, resource):
+        """Feed the rate limiter from a resource's response headers."""
+        if resource is None:
+            return
+        try:
+            response = resource.get_response()
+        except AttributeError:
+            return
+        if self.on_response:
+            self.on_response(response)
+        if not self.rate_limiter:
+            return
+        reset = response.rate_limit_reset
+        if reset is not None:
+            # The recurly client parses the reset time as a naive utc datetime.
+            reset = reset.replace(tzinfo=timezone.utc).timestamp()
+        self.rate_limiter.update(
+            response.rate_limit, response.rate_limit_remaining, reset
+        )
@@ -1,12 +1,44 @@
+"""Settings read from the environment and a .env file on first use."""
 import os
-from dotenv import load_dotenv, find_dotenv
+from typing import Any, Dict
 
-load_dotenv(find_dotenv())
+__settings: Dict[str, Any] = {}
 
-RECURLY_KEY = os.getenv("RECURLY_KEY")
-RECURLY_API = os.getenv("RECURLY_API", "https://dropout.recurly.com/v2")
-STRIPE_KEY = os.getenv("STRIPE_KEY")
-STRIPE_API = os.getenv("STRIPE_API", "https://api.stripe.com/v1")
-SENTRY = os.getenv("SENTRY")
-PAPERTRAIL_DEST = os.getenv("PAPERTRAIL_DEST")
-PAPERTRAIL_PORT = int(os.getenv("PAPERTRAIL_PORT")) if os.getenv("PAPERTRAIL_PORT") else None
+
+def load() -> Dict[str, Any]:
+    """Load the .env file and read the settings, once."""
+    if __settings:
+        return __settings
+    from dotenv import load_dotenv, find_dotenv  # pylint: disable=import-outside-toplevel
+
+    load_dotenv(find_dotenv())
+
+    __settings.update(
+        RECURLY_KEY=os.getenv("RECURLY_KEY"),
+        RECURLY_API=os.getenv("RECURLY_API", "https://dropout.recurly.com/v2"),
+        RECURLY_V3_API=os.getenv("RECURLY_V3_API", "https://v3.recurly.com"),
+        STRIPE_KEY=os.getenv("STRIPE_KEY"),
+        STRIPE_API=os.getenv("STRIPE_API", "https://api.stripe.com/v1"),
+        SENTRY=os.getenv("SENTRY"),
+        HTTP_POOL_SIZE=int(os.getenv("HTTP_POOL_SIZE", 10)),
+        HTTP_KEEP_ALIVE=os.getenv("HTTP_KEEP_ALIVE", "true").lower() != "false",
+        STRIPE_CACHE=os.getenv("STRIPE_CACHE"),
+        STRIPE_CACHE_TTL=int(os.getenv("STRIPE_CACHE_TTL", 7 * 24 * 60 * 60)),
+        STRIPE_CACHE_NEGATIVE_TTL=int(os.getenv("STRIPE_CACHE_NEGATIVE_TTL", 24 * 60 * 60)),
+        STRIPE_CACHE_MAX_ENTRIES=int(os.getenv("STRIPE_CACHE_MAX_ENTRIES", 1000000)),
+        ACCOUNT_CACHE=os.getenv("ACCOUNT_CACHE"),
+        ACCOUNT_CACHE_TTL=int(os.getenv("ACCOUNT_CACHE_TTL", 7 * 24 * 60 * 60)),
+        ACCOUNT_CACHE_MAX_ENTRIES=int(os.getenv("ACCOUNT_CACHE_MAX_ENTRIES", 1000000)),
+        METRICS_FILE=os.getenv("METRICS_FILE"),
+        PROMETHEUS_TEXTFILE=os.getenv("PROMETHEUS_TEXTFILE"),
+        PAPERTRAIL_DEST=os.getenv("PAPERTRAIL_DEST"),
+        PAPERTRAIL_PORT=int(os.getenv("PAPERTRAIL_PORT")) if os.getenv("PAPERTRAIL_PORT") else None,
+    )
+    return __settings
+
+
+def __getattr__(name: str) -> Any:
+    settings = load()
+    if name not in settings:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return settings[name]
@@ -0,0 +1,21 @@
+"""File helpers."""
+from contextlib import contextmanager
+import os
+from typing import Iterator
+
+
+@contextmanager
+def atomic_write(filename: str, fsync: bool = False) -> Iterator[str]:
+    """Yield a temporary path to write, swapped in for filename on success."""
+    tmp_file = f"{filename}.tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    try:
+        yield tmp_file
+        if fsync:
+            with open(tmp_file, "rb") as written:
+                os.fsync(written.fileno())
+        os.replace(tmp_file, filename)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
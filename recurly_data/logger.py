@@ -1,7 +1,10 @@
+import atexit
 import logging
+import queue
 import socket
-from logging.handlers import SysLogHandler
-from typing import Optional
+import threading
+from logging.handlers import QueueHandler, QueueListener, SysLogHandler
+from typing import List, Optional
 from recurly_data.config import PAPERTRAIL_DEST, PAPERTRAIL_PORT
 
 class ContextFilter(logging.Filter):
@@ -11,8 +14,101 @@ class ContextFilter(logging.Filter):
         record.hostname = ContextFilter.hostname
         return True
 
+class BatchSysLogHandler(SysLogHandler):
+    """Syslog handler that sends a batch of records at a time."""
+
+    def message(self, record: logging.LogRecord) -> bytes:
+        """A record as a syslog message, like SysLogHandler.emit sends it."""
+        msg = self.format(record)
+        if self.ident:
+            msg = self.ident + msg
+        if self.append_nul:
+            msg += "\000"
+        prio = "<%d>" % self.encodePriority(
+            self.facility, self.mapPriority(record.levelname)
+        )
+        return (prio + msg).encode("utf-8")
+
+    def emit_batch(self, records: List[logging.LogRecord]):
+        """Send records, in one write over tcp."""
+        messages = []
+        for record in records:
+            if not self.filter(record):
+                continue
+            try:
+                messages.append(self.message(record))
+            except Exception:  # pylint: disable=broad-except
+                self.handleError(record)
+        if not messages:
+            return
+        try:
+            if not self.socket and hasattr(self, "createSocket"):
+                self.createSocket()
+            if self.unixsocket:
+                for msg in messages:
+                    self.socket.send(msg)
+            elif self.socktype == socket.SOCK_DGRAM:
+                for msg in messages:
+                    self.socket.sendto(msg, self.address)
+            else:
+                self.socket.sendall(b"\n".join(messages) + b"\n")
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(records[-1])
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records rather than block when its queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.__lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.__lock:
+                self.dropped += 1
+
+class BatchQueueListener(QueueListener):
+    """Queue listener that hands its handler the queued records in batches."""
+
+    def __init__(self, log_queue: queue.Queue, handler: logging.Handler, batch_size: int = 100):
+        super().__init__(log_queue, handler)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self):
+        # The queue may be full, and the listener is there to empty it.
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get(block=not batch)
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    self.queue.task_done()
+                    done = True
+                    break
+                batch.append(record)
+            if not batch:
+                continue
+            for handler in self.handlers:
+                emit_batch = getattr(handler, "emit_batch", None)
+                if emit_batch:
+                    emit_batch(batch)
+                else:
+                    for record in batch:
+                        handler.handle(record)
+            for _ in batch:
+                self.queue.task_done()
+
 class Logger():
-    """Logger class."""
+    """Logger class, sending records to papertrail from a bounded queue."""
 
     def __init__(
             self,
@@ -21,8 +117,10 @@ class Logger():
             level: int = logging.DEBUG,
             formatted_string: Optional[str] = None,
             date_format: str = "%b %d %H:%M:%S",
+            queue_size: int = 10000,
+            batch_size: int = 100,
     ):
-        self.syslog = SysLogHandler(address=(dest, port))
+        self.syslog = BatchSysLogHandler(address=(dest, port))
         self.syslog.addFilter(ContextFilter())
 
         if not formatted_string:
@@ -31,9 +129,39 @@ class Logger():
             )
         formatter = logging.Formatter(formatted_string, datefmt=date_format)
         self.syslog.setFormatter(formatter)
-        self.logger = logging.getLogger()
-        self.logger.addHandler(self.syslog)
+
+        log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(log_queue)
+        self.listener = BatchQueueListener(log_queue, self.syslog, batch_size)
+        self.listener.start()
+        # Only our own records, the root logger would also get every
+        # debug line of urllib3 and the recurly client.
+        self.logger = logging.getLogger("recurly_data")
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
         self.logger.setLevel(level)
+        self.__closed = False
+        atexit.register(self.close)
+
+    @property
+    def dropped(self) -> int:
+        """How many records were dropped because the queue was full."""
+        return self.handler.dropped
+
+    def flush(self):
+        """Wait until every queued record is sent."""
+        if not self.__closed:
+            self.handler.queue.join()
+
+    def close(self):
+        """Send the queued records and stop the listener."""
+        if self.__closed:
+            return
+        self.__closed = True
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        self.syslog.close()
+        atexit.unregister(self.close)
 
     def debug(self, msg):
         """Log debug level messages."""
@@ -62,3 +190,4 @@ if __name__ == "__main__":
     log.warning("This is a warning level message.")
     log.error("This is a error level message.")
     log.critical("This is a critical level message.")
+    log.close()
@@ -0,0 +1,167 @@
+"""Merge and deduplicate exports."""
+import csv
+import gzip
+import heapq
+import io
+import itertools
+import json
+import os
+import pickle
+import tempfile
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+from recurly_data.files import atomic_write
+from recurly_data.record import Record, SiteRecord
+from recurly_data.sinks import make_sink
+
+# (sort key, record values) pairs, as written to and read from runs.
+Item = Tuple[tuple, tuple]
+
+
+def open_export(filename: str) -> TextIO:
+    """Open an export for reading, decompressing .gz and .zst files."""
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt", encoding="utf-8", newline="")
+    if filename.endswith(".zst"):
+        try:
+            import zstandard  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            raise Exception(
+                "Reading zstd requires the zstandard package, "
+                "install it with 'pip install zstandard'."
+            )
+        reader = zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"))
+        return io.TextIOWrapper(reader, encoding="utf-8", newline="")
+    return open(filename, encoding="utf-8", newline="")
+
+
+def read_export(filename: str) -> Iterator[dict]:
+    """Read the rows of a csv or JSON Lines export, optionally compressed."""
+    name = filename
+    for suffix in (".gz", ".zst"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    with open_export(filename) as export:
+        if name.endswith(".jsonl"):
+            for line in export:
+                if line.strip():
+                    yield {
+                        column: "" if value is None else value
+                        for column, value in json.loads(line).items()
+                    }
+        else:
+            for row in csv.DictReader(export):
+                record_class = SiteRecord if "site" in row else Record
+                yield record_class.from_csv(row).as_dict()
+
+
+def write_run(items: List[Item], directory: str, batch_size: int = 1000) -> str:
+    """Write sorted items to a temporary run file, in pickled batches."""
+    handle, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(handle, "wb") as run_file:
+        for idx in range(0, len(items), batch_size):
+            pickle.dump(
+                items[idx:idx + batch_size], run_file, pickle.HIGHEST_PROTOCOL
+            )
+    return path
+
+
+def read_run(path: str) -> Iterator[Item]:
+    with open(path, "rb") as run_file:
+        while True:
+            try:
+                yield from pickle.load(run_file)
+            except EOFError:
+                return
+
+
+def external_sort(
+        items: Iterable[Item],
+        directory: str,
+        chunk_size: int = 100000,
+) -> Iterator[Item]:
+    """Sort items by their sort key, in runs of ``chunk_size`` merged lazily."""
+    runs: List[str] = []
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            break
+        chunk.sort(key=lambda item: item[0])
+        runs.append(write_run(chunk, directory))
+    try:
+        yield from heapq.merge(*map(read_run, runs), key=lambda item: item[0])
+    finally:
+        for run in runs:
+            if os.path.exists(run):
+                os.remove(run)
+
+
+def newest(items: Iterable[Item]) -> Iterator[Item]:
+    """Keep the last of the items sharing a dedup key, from items sorted on it."""
+    for _, group in itertools.groupby(items, key=lambda item: item[0][:-1]):
+        last = None
+        for last in group:
+            pass
+        yield last
+
+
+def merge_exports(
+        files: Sequence[str],
+        filename: str,
+        output_format: str = "csv",
+        key: str = "email",
+        chunk_size: int = 100000,
+        tmp_dir: Optional[str] = None,
+        progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Merge exports into one, keeping the newest row of every account.
+
+    Later files, and later rows in a file, are newer.
+    """
+    record_class = Record
+    for path in files:
+        rows = read_export(path)
+        first = next(rows, None)
+        rows.close()
+        if first is not None and "site" in first:
+            record_class = SiteRecord
+            break
+    if key not in record_class.columns:
+        raise Exception(f"Cannot deduplicate on unknown column {key}.")
+    key_columns = ("site", key) if record_class is SiteRecord else (key,)
+    columns = record_class.columns
+
+    def read() -> Iterator[Item]:
+        seq = itertools.count()
+        for path in files:
+            for row in read_export(path):
+                record = record_class(**row)
+                idx = next(seq)
+                dedup_key = tuple(record[column] for column in key_columns)
+                if any(dedup_key):
+                    dedup_key = (1,) + dedup_key
+                else:
+                    # Nothing to deduplicate on, make a key no other row has.
+                    dedup_key = (0, idx)
+                yield dedup_key + (idx,), tuple(record)
+
+    total = 0
+    with atomic_write(filename) as tmp_file, \
+            tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+        kept = newest(external_sort(read(), directory, chunk_size))
+        # Sort the kept rows back on the order they were read in.
+        ordered = external_sort(
+            ((sort_key[-1:], values) for sort_key, values in kept),
+            directory,
+            chunk_size,
+        )
+        with make_sink(output_format, tmp_file, columns) as sink:
+            for _, values in ordered:
+                total += 1
+                record = record_class(**dict(zip(columns, values)))
+                record.row = total
+                sink.write(record)
+                if progress:
+                    progress(total)
+    return total
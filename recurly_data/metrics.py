@@ -0,0 +1,302 @@
+"""Run metrics."""
+from collections import Counter
+from datetime import datetime, timezone
+import json
+import threading
+import time
+from typing import Dict, Optional, Sequence
+from recurly_data.files import atomic_write
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class EndpointStats:
+    """Request counts, bytes and a latency histogram of one endpoint."""
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.requests = 0
+        self.statuses: Counter = Counter()
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.network_errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def observe(self, seconds: float, status: Optional[int], size: int):
+        self.requests += 1
+        self.bytes += size
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        idx = 0
+        while idx < len(self.buckets) and seconds > self.buckets[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        if status is None:
+            self.network_errors += 1
+            self.statuses["network"] += 1
+            return
+        self.statuses[str(status)] += 1
+        if status == 429:
+            self.rate_limited += 1
+        elif status >= 500:
+            self.server_errors += 1
+
+    def merge(self, other: "EndpointStats"):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.requests += other.requests
+        self.statuses.update(other.statuses)
+        self.rate_limited += other.rate_limited
+        self.server_errors += other.server_errors
+        self.network_errors += other.network_errors
+        self.retries += other.retries
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.wait_seconds += other.wait_seconds
+
+    def quantile(self, fraction: float) -> float:
+        """Estimate a latency quantile from the histogram, like histogram_quantile."""
+        if not self.requests:
+            return 0.0
+        rank = fraction * self.requests
+        seen = 0
+        lower = 0.0
+        for idx, count in enumerate(self.counts):
+            upper = self.buckets[idx] if idx < len(self.buckets) else self.max_seconds
+            if count and seen + count >= rank:
+                upper = min(upper, self.max_seconds)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.max_seconds
+
+    def summary(self) -> Dict:
+        cumulative = 0
+        histogram = {}
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            histogram[str(bound) if bound != float("inf") else "+Inf"] = cumulative
+        return {
+            "requests": self.requests,
+            "statuses": dict(self.statuses),
+            "rate_limited": self.rate_limited,
+            "server_errors": self.server_errors,
+            "network_errors": self.network_errors,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 6),
+            "rate_limit_wait_seconds": round(self.wait_seconds, 6),
+            "latency": {
+                "mean": round(self.seconds / self.requests, 6) if self.requests else 0.0,
+                "p50": round(self.quantile(0.5), 6),
+                "p95": round(self.quantile(0.95), 6),
+                "p99": round(self.quantile(0.99), 6),
+                "max": round(self.max_seconds, 6),
+            },
+            "histogram": histogram,
+        }
+
+
+class Metrics:
+    """Per endpoint http metrics of an extraction run, mergeable across shards."""
+
+    namespace = "recurly_data"
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS, clock=time.time):
+        self.buckets = tuple(buckets)
+        self.clock = clock
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.started_at = clock()
+        self.finished_at: Optional[float] = None
+        self.rows = 0
+        self.__lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_Metrics__lock"]
+        del state["clock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.clock = time.time
+        self.__lock = threading.Lock()
+
+    def __stats(self, endpoint: str) -> EndpointStats:
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = EndpointStats(self.buckets)
+        return stats
+
+    def observe(
+            self,
+            endpoint: str,
+            seconds: float,
+            status: Optional[int],
+            size: int = 0,
+    ):
+        """Record a request. A status of None is a network error."""
+        with self.__lock:
+            self.__stats(endpoint).observe(seconds, status, size)
+
+    def observe_wait(self, endpoint: str, seconds: float):
+        """Record time spent waiting on the rate limiter or breaker before a request."""
+        if seconds <= 0:
+            return
+        with self.__lock:
+            self.__stats(endpoint).wait_seconds += seconds
+
+    def observe_retry(self, endpoint: str):
+        """Record that a failed request is retried."""
+        with self.__lock:
+            self.__stats(endpoint).retries += 1
+
+    def merge(self, other: "Metrics"):
+        """Add the metrics of another run, such as a shard."""
+        with self.__lock:
+            for endpoint, stats in other.endpoints.items():
+                self.__stats(endpoint).merge(stats)
+
+    def finish(self, rows: int):
+        """Mark the end of the run."""
+        self.rows = rows
+        self.finished_at = self.clock()
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at or self.clock()) - self.started_at
+
+    def summary(self) -> Dict:
+        """The run summary as a json serializable dict."""
+        with self.__lock:
+            endpoints = {
+                endpoint: stats.summary()
+                for endpoint, stats in sorted(self.endpoints.items())
+            }
+        requests = sum(stats["requests"] for stats in endpoints.values())
+        duration = self.duration
+        return {
+            "started_at": datetime.fromtimestamp(
+                self.started_at, timezone.utc
+            ).isoformat(),
+            "finished_at": datetime.fromtimestamp(
+                self.finished_at or self.clock(), timezone.utc
+            ).isoformat(),
+            "duration_seconds": round(duration, 3),
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / duration, 3) if duration else 0.0,
+            "requests": requests,
+            "requests_per_row": round(requests / self.rows, 3) if self.rows else 0.0,
+            "rate_limited": sum(stats["rate_limited"] for stats in endpoints.values()),
+            "server_errors": sum(stats["server_errors"] for stats in endpoints.values()),
+            "network_errors": sum(stats["network_errors"] for stats in endpoints.values()),
+            "retries": sum(stats["retries"] for stats in endpoints.values()),
+            "rate_limit_wait_seconds": round(sum(
+                stats["rate_limit_wait_seconds"] for stats in endpoints.values()
+            ), 6),
+            "endpoints": endpoints,
+        }
+
+    def report(self) -> str:
+        """A short per endpoint table of the run."""
+        summary = self.summary()
+        lines = [
+            f"{summary['rows']} rows in {summary['duration_seconds']:.1f}s "
+            f"({summary['rows_per_second']:.1f}/s), {summary['requests']} "
+            f"requests ({summary['requests_per_row']:.2f}/row), "
+            f"{summary['rate_limit_wait_seconds']:.1f}s rate limited",
+            f"{'endpoint':<20}{'requests':>9}{'p50 ms':>9}{'p99 ms':>9}"
+            f"{'429':>6}{'5xx':>6}{'net':>6}{'wait s':>9}",
+        ]
+        for endpoint, stats in summary["endpoints"].items():
+            lines.append(
+                f"{endpoint:<20}{stats['requests']:>9}"
+                f"{stats['latency']['p50'] * 1000:>9.1f}"
+                f"{stats['latency']['p99'] * 1000:>9.1f}"
+                f"{stats['rate_limited']:>6}{stats['server_errors']:>6}"
+                f"{stats['network_errors']:>6}"
+                f"{stats['rate_limit_wait_seconds']:>9.1f}"
+            )
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """The metrics in the prometheus text exposition format."""
+        name = self.namespace
+        lines = []
+
+        def metric(metric_name: str, metric_type: str, help_text: str):
+            lines.append(f"# HELP {name}_{metric_name} {help_text}")
+            lines.append(f"# TYPE {name}_{metric_name} {metric_type}")
+
+        with self.__lock:
+            endpoints = sorted(self.endpoints.items())
+
+            metric("http_requests_total", "counter", "HTTP requests by endpoint and status.")
+            for endpoint, stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(
+                        f'{name}_http_requests_total{{endpoint="{endpoint}",'
+                        f'status="{status}"}} {count}'
+                    )
+
+            for metric_name, attr, help_text in (
+                    ("http_rate_limited_total", "rate_limited", "HTTP 429 responses."),
+                    ("http_server_errors_total", "server_errors", "HTTP 5xx responses."),
+                    ("http_network_errors_total", "network_errors", "Requests without a response."),
+                    ("http_retries_total", "retries", "Failed requests retried."),
+                    ("http_response_bytes_total", "bytes", "Response body bytes."),
+                    ("rate_limit_wait_seconds_total", "wait_seconds",
+                     "Seconds spent waiting on the rate limiter."),
+            ):
+                metric(metric_name, "counter", help_text)
+                for endpoint, stats in endpoints:
+                    lines.append(
+                        f'{name}_{metric_name}{{endpoint="{endpoint}"}} '
+                        f"{getattr(stats, attr)}"
+                    )
+
+            metric("http_request_duration_seconds", "histogram", "HTTP request latency.")
+            for endpoint, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(stats.buckets + (float("inf"),), stats.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(
+                        f'{name}_http_request_duration_seconds_bucket'
+                        f'{{endpoint="{endpoint}",le="{le}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'{name}_http_request_duration_seconds_sum'
+                    f'{{endpoint="{endpoint}"}} {stats.seconds}'
+                )
+                lines.append(
+                    f'{name}_http_request_duration_seconds_count'
+                    f'{{endpoint="{endpoint}"}} {stats.requests}'
+                )
+
+        metric("rows", "gauge", "Rows extracted by the last run.")
+        lines.append(f"{name}_rows {self.rows}")
+        metric("run_duration_seconds", "gauge", "Duration of the last run.")
+        lines.append(f"{name}_run_duration_seconds {self.duration}")
+        metric("last_run_timestamp_seconds", "gauge", "When the last run finished.")
+        lines.append(f"{name}_last_run_timestamp_seconds {self.finished_at or self.clock()}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write_file(path: str, content: str):
+        """Write a file atomically."""
+        with atomic_write(path) as tmp_file, open(tmp_file, "w") as out_file:
+            out_file.write(content)
+
+    def write_json(self, path: str):
+        """Write the run summary as json."""
+        self.write_file(path, json.dumps(self.summary(), indent=2) + "\n")
+
+    def write_prometheus(self, path: str):
+        """Write the metrics for the prometheus node exporter textfile collector."""
+        self.write_file(path, self.prometheus())
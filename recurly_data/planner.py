@@ -0,0 +1,179 @@
+"""Extraction planning."""
+import itertools
+import math
+import time
+from typing import Dict
+from recurly_data.recurly_data import RecurlyData
+
+# Per account endpoints, as named in the metrics.
+PER_ACCOUNT = ("subscriptions", "redemptions", "stripe_customers")
+
+
+def plan_extraction(
+        rcd: RecurlyData,
+        shards: int = 1,
+        sample: int = 20,
+        max_workers: int = 16,
+        max_shards: int = 4,
+        window: float = 3600.0,
+        resume: bool = False,
+) -> Dict:
+    """
+    Estimate the cost and time of an extraction and tune its concurrency.
+
+    ``shards`` is the number of shards the run would otherwise use.
+    """
+    total = rcd.count_accounts(rcd.begin_time, rcd.end_time)
+    if total is None:
+        total = rcd.api_total_accounts
+    if rcd.limit:
+        total = min(total, rcd.limit)
+
+    before = {
+        endpoint: (stats.requests, stats.seconds, stats.wait_seconds)
+        for endpoint, stats in rcd.metrics.endpoints.items()
+    }
+    listing = rcd.get_accounts(limit=max(1, min(sample, rcd.max_page_size)))
+    accounts = list(itertools.islice(listing, sample))
+    if hasattr(listing, "close"):
+        listing.close()
+    account_seconds = 0.0
+    for account in accounts:
+        started = time.perf_counter()
+        rcd.build_row(account)
+        account_seconds += time.perf_counter() - started
+    sampled = max(len(accounts), 1)
+
+    per_account = {}
+    latency = {}
+    for endpoint, stats in rcd.metrics.endpoints.items():
+        requests, seconds, wait = before.get(endpoint, (0, 0.0, 0.0))
+        requests = stats.requests - requests
+        if requests:
+            latency[endpoint] = (stats.seconds - seconds) / requests
+        if endpoint in PER_ACCOUNT:
+            per_account[endpoint] = requests / sampled
+            # The rate limiter is accounted for by the budget, not the workers.
+            account_seconds -= stats.wait_seconds - wait
+    account_seconds = max(account_seconds, 0.0) / sampled
+    list_seconds = latency.get("accounts", 0.0)
+
+    subscription_listing = math.ceil(rcd.api_total_accounts / rcd.max_page_size)
+    account_subscriptions = total * per_account.get("subscriptions", 0.0)
+
+    def recurly_requests(page_size: int, subscription_join: bool, shards: int) -> int:
+        # Every shard gets the headers and the catalog.
+        requests = 3 * shards + math.ceil(total / page_size)
+        requests += math.ceil(total * per_account.get("redemptions", 0.0))
+        if subscription_join:
+            # Every shard lists the subscriptions of the whole site.
+            requests += shards * subscription_listing
+        else:
+            requests += math.ceil(account_subscriptions)
+        return requests
+
+    # The rate limiter has the latest headers, less the requests since.
+    limiter = rcd.rate_limiter
+    limit = limiter.limit or 0
+    remaining = limiter.remaining or 0
+    reset_in = max((limiter.reset_at or 0.0) - time.time(), 0.0)
+
+    def budget_seconds(requests: int) -> float:
+        """The least time the rate limiter lets the requests take."""
+        if not limit or not reset_in:
+            return 0.0
+        if requests <= remaining:
+            return requests * reset_in / max(remaining, 1)
+        return reset_in + (requests - remaining) * window / limit
+
+    def wall_seconds(workers: int, page_size: int, requests: int) -> float:
+        listing = math.ceil(total / page_size) * list_seconds
+        return max(total * account_seconds / workers, listing, budget_seconds(requests))
+
+    requests = recurly_requests(rcd.page_size, rcd.subscription_join, shards)
+    join = subscription_listing < account_subscriptions
+    page_size = min(rcd.max_page_size, rcd.limit) if rcd.limit else rcd.max_page_size
+    tuned_requests = recurly_requests(page_size, join, 1)
+    # The fewest workers that keep up with the rate the budget allows.
+    floor = max(budget_seconds(tuned_requests), math.ceil(total / page_size) * list_seconds)
+    if floor:
+        workers = math.ceil(total * account_seconds / floor)
+    else:
+        workers = max_workers * max_shards
+    workers = min(max(workers, 1), max_workers * max_shards)
+    tuned_shards = 1
+    if workers > max_workers and not (rcd.limit or rcd.since_last_run or resume):
+        tuned_shards = math.ceil(workers / max_workers)
+    workers = min(math.ceil(workers / tuned_shards), max_workers)
+    if join and tuned_shards * subscription_listing >= account_subscriptions:
+        join = False
+    tuned_requests = recurly_requests(page_size, join, tuned_shards)
+
+    return {
+        "accounts": total,
+        "sampled": len(accounts),
+        "per_account": {
+            "recurly_requests": round(
+                per_account.get("subscriptions", 0.0) +
+                per_account.get("redemptions", 0.0), 3
+            ),
+            "stripe_requests": round(per_account.get("stripe_customers", 0.0), 3),
+            "seconds": round(account_seconds, 6),
+        },
+        "latency": {endpoint: round(seconds, 6) for endpoint, seconds in sorted(latency.items())},
+        "budget": {
+            "limit": limit,
+            "remaining": remaining,
+            "reset_in_seconds": round(reset_in, 3),
+        },
+        "current": {
+            "workers": rcd.workers,
+            "shards": shards,
+            "page_size": rcd.page_size,
+            "subscription_join": rcd.subscription_join,
+            "recurly_requests": requests,
+            "stripe_requests": math.ceil(total * per_account.get("stripe_customers", 0.0)),
+            "exceeds_budget": bool(limit) and requests > remaining,
+            "seconds": round(
+                wall_seconds(rcd.workers * shards, rcd.page_size, requests), 3
+            ),
+        },
+        "recommended": {
+            "workers": workers,
+            "shards": tuned_shards,
+            "page_size": page_size,
+            "subscription_join": join,
+            "recurly_requests": tuned_requests,
+            "exceeds_budget": bool(limit) and tuned_requests > remaining,
+            "seconds": round(
+                wall_seconds(workers * tuned_shards, page_size, tuned_requests), 3
+            ),
+        },
+    }
+
+
+def format_plan(plan: Dict) -> str:
+    """A short report of an extraction plan."""
+    per_account = plan["per_account"]
+    budget = plan["budget"]
+    lines = [
+        f"{plan['accounts']} accounts, sampled {plan['sampled']}: "
+        f"{per_account['recurly_requests']:.2f} recurly and "
+        f"{per_account['stripe_requests']:.2f} stripe requests, "
+        f"{per_account['seconds'] * 1000:.1f} ms per account",
+        f"Budget: {budget['remaining']} of {budget['limit']} requests left, "
+        f"resetting in {budget['reset_in_seconds']:.0f}s",
+        f"{'':<13}{'workers':>9}{'shards':>8}{'page':>6}{'join':>6}"
+        f"{'requests':>10}{'budget':>8}{'time':>10}",
+    ]
+    for name in ("current", "recommended"):
+        option = plan[name]
+        lines.append(
+            f"{name:<13}{option['workers']:>9}{option['shards']:>8}"
+            f"{option['page_size']:>6}"
+            f"{'yes' if option['subscription_join'] else 'no':>6}"
+            f"{option['recurly_requests']:>10}"
+            f"{'over' if option['exceeds_budget'] else 'ok':>8}"
+            f"{option['seconds']:>9.0f}s"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,50 @@
+"""Background prefetching."""
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+__DONE = object()
+
+
+def prefetch(make_iterable: Callable[[], Iterable[T]], maxsize: int) -> Iterator[T]:
+    """
+    Iterate on a background thread, up to ``maxsize`` items ahead.
+
+    The iterable is made on that thread, so a pager uses its client.
+    """
+    items: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in make_iterable():
+                if not put((item, None)):
+                    return
+        except Exception as excpt:  # pylint: disable=broad-except
+            put((__DONE, excpt))
+            return
+        put((__DONE, None))
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, excpt = items.get()
+            if item is __DONE:
+                if excpt is not None:
+                    raise excpt
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,192 @@
+"""Run profiling."""
+from contextlib import contextmanager, nullcontext
+import heapq
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Stages in report order. account is the total time of building a row,
+# stripe, subscriptions and redemptions are part of it.
+STAGES = (
+    "catalog", "stripe_index", "subscription_index", "accounts", "account",
+    "stripe", "subscriptions", "redemptions", "write", "checkpoint",
+    "progress",
+)
+
+
+class StageStats:
+    """Calls, wall time and cpu time of one stage."""
+
+    __slots__ = ("calls", "wall", "cpu", "max")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.max = 0.0
+
+
+class Profiler:
+    """
+    Wall and cpu time of every stage of an extraction run.
+
+    cProfile only sees the thread that started it, so profile with one worker.
+    """
+
+    enabled = True
+
+    def __init__(self, slowest: int = 10, profile_file: Optional[str] = None):
+        self.slowest = slowest
+        self.profile_file = profile_file
+        self.stages: Dict[str, StageStats] = {}
+        self.accounts: List[Tuple[float, str]] = []
+        self.__lock = threading.Lock()
+        self.__wall = 0.0
+        self.__cpu = 0.0
+        self.__profile = None
+
+    def __record(self, name: str, wall: float, cpu: float):
+        with self.__lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.calls += 1
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.max = max(stats.max, wall)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage."""
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.__record(
+                name, time.perf_counter() - wall, time.thread_time() - cpu
+            )
+
+    @contextmanager
+    def account(self, account_id: str):
+        """Time building the row of an account."""
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - wall
+            self.__record("account", seconds, time.thread_time() - cpu)
+            with self.__lock:
+                if len(self.accounts) < self.slowest:
+                    heapq.heappush(self.accounts, (seconds, account_id))
+                elif self.accounts and seconds > self.accounts[0][0]:
+                    heapq.heapreplace(self.accounts, (seconds, account_id))
+
+    def iterate(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Time every step of an iterator as a stage."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def start(self):
+        """Start timing the run, and cProfile with a profile file."""
+        self.__wall = time.perf_counter()
+        self.__cpu = time.process_time()
+        if self.profile_file:
+            import cProfile  # pylint: disable=import-outside-toplevel
+
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+
+    def stop(self):
+        """Stop timing the run and dump the cProfile stats."""
+        self.__wall = time.perf_counter() - self.__wall
+        self.__cpu = time.process_time() - self.__cpu
+        if self.__profile:
+            self.__profile.disable()
+            self.__profile.dump_stats(self.profile_file)
+            self.__profile = None
+
+    def summary(self) -> Dict:
+        """The profile as a json serializable dict."""
+        with self.__lock:
+            names = sorted(
+                self.stages,
+                key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES)
+            )
+            stages = {
+                name: {
+                    "calls": self.stages[name].calls,
+                    "wall_seconds": round(self.stages[name].wall, 6),
+                    "cpu_seconds": round(self.stages[name].cpu, 6),
+                    "max_seconds": round(self.stages[name].max, 6),
+                }
+                for name in names
+            }
+            slowest = sorted(self.accounts, reverse=True)
+        return {
+            "wall_seconds": round(self.__wall, 6),
+            "cpu_seconds": round(self.__cpu, 6),
+            "stages": stages,
+            "slowest_accounts": [
+                {"account_id": account_id, "seconds": round(seconds, 6)}
+                for seconds, account_id in slowest
+            ],
+        }
+
+    def report(self) -> str:
+        """A per stage table of the run and its slowest accounts."""
+        summary = self.summary()
+        lines = [
+            f"Profile: {summary['wall_seconds']:.2f}s wall, "
+            f"{summary['cpu_seconds']:.2f}s cpu",
+            f"{'stage':<20}{'calls':>9}{'wall s':>10}{'cpu s':>10}"
+            f"{'mean ms':>10}{'max ms':>10}",
+        ]
+        for name, stats in summary["stages"].items():
+            mean = stats["wall_seconds"] / stats["calls"] if stats["calls"] else 0.0
+            lines.append(
+                f"{name:<20}{stats['calls']:>9}{stats['wall_seconds']:>10.3f}"
+                f"{stats['cpu_seconds']:>10.3f}{mean * 1000:>10.2f}"
+                f"{stats['max_seconds'] * 1000:>10.2f}"
+            )
+        if summary["slowest_accounts"]:
+            lines.append("Slowest accounts:")
+            for account in summary["slowest_accounts"]:
+                lines.append(
+                    f"  {account['account_id']:<30}{account['seconds'] * 1000:>10.2f} ms"
+                )
+        if self.profile_file:
+            lines.append(f"cProfile stats written to {self.profile_file}")
+        return "\n".join(lines)
+
+
+class NullProfiler:
+    """A profiler that does nothing, for runs without --profile."""
+
+    enabled = False
+    __stage = nullcontext()
+
+    def stage(self, name: str):  # pylint: disable=unused-argument
+        return self.__stage
+
+    def account(self, account_id: str):  # pylint: disable=unused-argument
+        return self.__stage
+
+    @staticmethod
+    def iterate(name: str, iterable: Iterable[T]) -> Iterable[T]:  # pylint: disable=unused-argument
+        return iterable
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
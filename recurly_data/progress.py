@@ -0,0 +1,110 @@
+"""Progress output."""
+import sys
+import time
+from typing import Optional, TextIO
+from colorama import Fore
+from recurly_data.record import Record
+
+
+class Progress:
+    """Progress output for the extraction loop, as a bar, log lines or nothing."""
+
+    modes = ["bar", "log", "none"]
+
+    def __init__(
+            self,
+            total: Optional[int] = None,
+            mode: str = "bar",
+            verbose: int = 0,
+            interval: float = 0.2,
+            log_interval: float = 30.0,
+            stream: TextIO = sys.stderr,
+    ):
+        if mode not in self.modes:
+            raise Exception(f"Progress modes are {', '.join(self.modes)}.")
+        if mode == "bar" and not stream.isatty():
+            mode = "none"
+        self.total = total
+        self.mode = mode
+        self.verbose = verbose
+        self.interval = interval
+        self.log_interval = log_interval
+        self.stream = stream
+        self.count = 0
+        self.__started_at = time.monotonic()
+        self.__shown_at = self.__started_at
+        self.__bar = None
+        if mode == "bar":
+            self.__bar = self.__make_bar()
+
+    def __make_bar(self):
+        # tqdm is slow to import and only needed on a terminal.
+        from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+
+        pnct_bar = "{percentage:3.0f}% " + Fore.GREEN + "{bar}" + Fore.RESET
+        extr = "Extracted: " + Fore.YELLOW + "{n_fmt}/{total_fmt}" + Fore.RESET
+        elps = "Elapsed: " + Fore.YELLOW + "{elapsed}<{remaining}" + Fore.RESET
+        rate = "Rate: " + Fore.YELLOW + "{rate_fmt}" + Fore.RESET
+
+        if not self.verbose:
+            bar_format = pnct_bar + "|{postfix}"
+        else:
+            bar_format = f"{pnct_bar} | {extr} | {elps} | {rate}{{postfix}}"
+
+        return tqdm(
+            total=self.total,
+            ncols=100 if not self.verbose else 160,
+            bar_format=bar_format,
+            mininterval=self.interval,
+            file=self.stream,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def summary(row: Record) -> str:
+        """One line summary of a row."""
+        return " ".join(
+            str(row[key]) for key in ("row", "email", "frequency", "pricing_amount")
+            if row[key] != ""
+        )
+
+    def update(self, row: Optional[Record] = None):
+        """Count a row, redrawing only when the interval has passed."""
+        self.count += 1
+        if self.mode == "none":
+            return
+
+        now = time.monotonic()
+        if self.mode == "bar":
+            if row is not None and now - self.__shown_at >= self.interval:
+                self.__bar.set_postfix_str(
+                    f" {Fore.CYAN}{self.summary(row)}{Fore.RESET}", refresh=False
+                )
+                self.__shown_at = now
+            self.__bar.update()
+        elif now - self.__shown_at >= self.log_interval:
+            self.log(row)
+            self.__shown_at = now
+
+    def log(self, row: Optional[Record] = None):
+        """Print a plain progress line."""
+        elapsed = time.monotonic() - self.__started_at
+        rate = self.count / elapsed if elapsed else 0.0
+        total = f"/{self.total}" if self.total else ""
+        line = f"Extracted {self.count}{total} rows, {rate:.1f} rows/s"
+        if row is not None:
+            line = f"{line}, last: {self.summary(row)}"
+        print(line, file=self.stream, flush=True)
+
+    def close(self):
+        """Finish the progress output."""
+        if self.__bar is not None:
+            self.__bar.close()
+        elif self.mode == "log":
+            self.log()
+        self.mode = "none"
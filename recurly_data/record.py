@@ -0,0 +1,104 @@
+"""Export record."""
+import ast
+import json
+from typing import Dict, Iterator, Tuple, Union
+
+Value = Union[str, int, dict]
+
+COLUMNS: Tuple[str, ...] = (
+    "row", "email", "name", "stripe_id", "created_at", "frequency",
+    "pricing_amount", "discounted_pricing_amount", "next_billing_date",
+    "cancel_date", "active_promo_code", "pending_change"
+)
+
+# Columns extracted as ints, which csv reads back as strings.
+INT_COLUMNS: Tuple[str, ...] = ("row", "pricing_amount", "discounted_pricing_amount")
+
+
+def parse_pending_change(value: str) -> Value:
+    """Parse the json, or older python repr, pending change of a csv export."""
+    try:
+        return json.loads(value)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+class Record:
+    """A row of exported customer data, iterating over its values in column order."""
+
+    __slots__ = COLUMNS
+    columns = COLUMNS
+
+    def __init__(self, **fields: Value):
+        for column in self.columns:
+            setattr(self, column, fields.get(column, ""))
+
+    @classmethod
+    def from_dict(cls, fields: Dict[str, Value]) -> "Record":
+        """Make a record from a dict such as a csv.DictReader row."""
+        return cls(**fields)
+
+    @classmethod
+    def from_csv(cls, fields: Dict[str, str]) -> "Record":
+        """Make a record from a csv.DictReader row of an export."""
+        record = cls(**fields)
+        for column in INT_COLUMNS:
+            value = record[column]
+            if value:
+                try:
+                    record[column] = int(value)
+                except ValueError:
+                    pass
+        if record.pending_change:
+            record.pending_change = parse_pending_change(record.pending_change)
+        return record
+
+    def __getitem__(self, column: str) -> Value:
+        return getattr(self, column)
+
+    def __setitem__(self, column: str, value: Value):
+        setattr(self, column, value)
+
+    def __iter__(self) -> Iterator[Value]:
+        for column in self.columns:
+            yield getattr(self, column)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Record):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        return f"Record({self.as_dict()!r})"
+
+    def get(self, column: str, default: Value = None) -> Value:
+        """Get a field by column name."""
+        return getattr(self, column, default)
+
+    def update(self, fields: Dict[str, Value]):
+        """Set several fields at once."""
+        for column, value in fields.items():
+            setattr(self, column, value)
+
+    def values(self) -> Tuple[Value, ...]:
+        """The field values in column order."""
+        return tuple(self)
+
+    def items(self) -> Iterator[Tuple[str, Value]]:
+        """Column name and value pairs in column order."""
+        return zip(self.columns, self)
+
+    def as_dict(self) -> Dict[str, Value]:
+        """The record as a dict."""
+        return dict(self.items())
+
+
+class SiteRecord(Record):
+    """A record with the recurly site it was extracted from."""
+
+    __slots__ = ("site",)
+    columns = ("site",) + COLUMNS
@@ -1,24 +1,34 @@
 """Recurly Data."""
 # pylint: disable=import-error,wildcard-import,unused-wildcard-import
-import csv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 import os
-from typing import Dict, List, Optional, Union
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
 import json
-import recurly
-import requests
-from colorama import init, Fore, Back, Style
-from tqdm import tqdm
-import sentry_sdk
-from recurly_data.config import (
-    RECURLY_API, RECURLY_KEY, STRIPE_KEY, STRIPE_API, SENTRY
-)
-import pickle
-#from recurly_data.logger import Logger
-init(autoreset=True)
-
-if SENTRY:
-    sentry_sdk.init(SENTRY)
+from colorama import Fore
+from recurly_data import config
+from recurly_data.cache import AccountCache, StripeCache
+from recurly_data.catalog import Catalog, discounted_price, frequency_name
+from recurly_data.metrics import Metrics
+from recurly_data.prefetch import prefetch
+from recurly_data.profiler import NullProfiler, Profiler
+from recurly_data.scheduler import RateLimiter
+from recurly_data.progress import Progress
+from recurly_data.record import Record
+from recurly_data.retry import Retry, parse_retry_after
+from recurly_data.runtime import init_colors, init_logger, init_sentry
+from recurly_data.script_runner import ScriptRunner
+from recurly_data.sinks import Sink, UpsertCsvSink, make_sink
+from recurly_data.subscriptions import SubscriptionIndex
+
+if TYPE_CHECKING:
+    # Only imported once a client or session is made.
+    import recurly
+    import requests
+    from recurly_data.client import Client
 
 
 # pylint: disable=too-many-instance-attributes
@@ -32,8 +42,12 @@ class RecurlyData:
         status = False
 
         if self.api_key:
-            response = requests.head(
+            self.metrics.observe_wait("headers", self.rate_limiter.acquire())
+            response = self.http(
+                "headers",
+                "HEAD",
                 self.api + "/accounts",
+                retry=self.retry,
                 auth=(self.api_key, "")
             )
 
@@ -49,9 +63,27 @@ class RecurlyData:
                         int(response.headers["X-RateLimit-Reset"])
                     )
                 )
+                self.rate_limiter.update(
+                    self.api_limit,
+                    self.api_limit_remaining,
+                    self.api_limit_reset_time.timestamp(),
+                )
 
         return status
 
+    def __on_response(self, response: "recurly.Response"):
+        """Refresh rate limits from a recurly api response."""
+        if response.rate_limit is not None:
+            self.api_limit = response.rate_limit
+        if response.rate_limit_remaining is not None:
+            self.api_limit_remaining = response.rate_limit_remaining
+        if response.rate_limit_reset is not None:
+            self.api_limit_reset_time = datetime.fromtimestamp(
+                response.rate_limit_reset.replace(
+                    tzinfo=timezone.utc
+                ).timestamp()
+            )
+
     # pylint: disable=too-many-arguments
     def __init__(
             self,
@@ -63,12 +95,70 @@ class RecurlyData:
             end_time: Optional[str] = None,
             order: str = "asc",
             subscription_state: str = "live",
-            api: Optional[str] = RECURLY_API,
-            api_key: Optional[str] = RECURLY_KEY,
-            stripe_key: Optional[str] = STRIPE_KEY,
-            stripe_api: Optional[str] = STRIPE_API,
+            api: Optional[str] = None,
+            api_key: Optional[str] = None,
+            stripe_key: Optional[str] = None,
+            stripe_api: Optional[str] = None,
             total_remaining: Optional[int] = None,
+            workers: int = 1,
+            stripe_prefetch: bool = False,
+            stripe_cache: Optional[StripeCache] = None,
+            close_stripe_cache: bool = True,
+            rate_limiter: Optional[RateLimiter] = None,
+            session: Optional["requests.Session"] = None,
+            pool_size: Optional[int] = None,
+            keep_alive: Optional[bool] = None,
+            keep_data: bool = False,
+            flush_every: int = 1000,
+            flush_interval: float = 5.0,
+            fsync: bool = False,
+            resume: bool = False,
+            checkpoint_every: int = 1000,
+            subscription_join: bool = False,
+            spill_subscriptions: bool = False,
+            progress: str = "bar",
+            progress_interval: float = 0.2,
+            log_interval: float = 30.0,
+            since_last_run: bool = False,
+            output_format: str = "csv",
+            v3_api: Optional[str] = None,
+            metrics: Optional[Metrics] = None,
+            metrics_file: Optional[str] = None,
+            prometheus_file: Optional[str] = None,
+            retries: int = 5,
+            retry_backoff: float = 0.5,
+            retry_max_backoff: float = 60.0,
+            breaker_threshold: int = 5,
+            breaker_cooldown: float = 30.0,
+            sentry: Optional[str] = None,
+            page_size: int = 200,
+            prefetch_pages: int = 2,
+            prefetch_catalog: bool = True,
+            papertrail: Optional[str] = None,
+            papertrail_port: Optional[int] = None,
+            profile: bool = False,
+            profile_file: Optional[str] = None,
+            account_cache: Optional[AccountCache] = None,
+            close_account_cache: bool = True,
     ):
+        # Settings left out are read from the environment, on first use
+        # rather than when this module is imported.
+        api = config.RECURLY_API if api is None else api
+        api_key = config.RECURLY_KEY if api_key is None else api_key
+        v3_api = config.RECURLY_V3_API if v3_api is None else v3_api
+        stripe_key = config.STRIPE_KEY if stripe_key is None else stripe_key
+        stripe_api = config.STRIPE_API if stripe_api is None else stripe_api
+        sentry = config.SENTRY if sentry is None else sentry
+        if papertrail is None:
+            papertrail = config.PAPERTRAIL_DEST
+        if papertrail_port is None:
+            papertrail_port = config.PAPERTRAIL_PORT
+
+        init_colors()
+        if sentry:
+            init_sentry(sentry)
+        self.log = init_logger(papertrail, papertrail_port) if papertrail else None
+
         # Set the keys and values
         self.limit = limit
         self.silence = silence
@@ -80,169 +170,527 @@ class RecurlyData:
                 )
             )
         )
-        self.__pickle = "script_info.pickle"
+        self.script_runner = ScriptRunner(
+            data_file=self.filename if output_format == "csv" else None,
+            info_file=f"{self.filename}.pickle",
+        )
         self.begin_time = begin_time
         self.end_time = end_time
         self.order = order
         self.subscription_state = subscription_state
         self.api = api
+        self.v3_api = v3_api
         self.api_key = api_key
         self.stripe_key = stripe_key
         self.stripe_api = stripe_api
         self.total_remaining = total_remaining
-        self.client = recurly.Client(self.api_key)
-        self.recurly_data: List[Dict[str, Union[str, int]]] = []
+        self.output_format = output_format
+        if since_last_run and output_format != "csv":
+            raise Exception("Syncing since the last run needs the csv format.")
+        self.since_last_run = since_last_run
+        if since_last_run:
+            # Sync windows are on updated_at, not on created_at.
+            self.begin_time = self.end_time = None
+        self.workers = max(1, int(workers or 1))
+        if not 1 <= page_size <= self.max_page_size:
+            raise Exception(f"Page size must be between 1 and {self.max_page_size}.")
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self.prefetch_catalog = prefetch_catalog
+        self.catalog = Catalog()
+        self.stripe_prefetch = stripe_prefetch
+        self.stripe_index: Optional[Dict[str, str]] = None
+        self.stripe_cache = stripe_cache
+        self.close_stripe_cache = close_stripe_cache
+        self.account_cache = account_cache
+        self.close_account_cache = close_account_cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        if session is None:
+            from recurly_data.session import make_session  # pylint: disable=import-outside-toplevel
+
+            if pool_size is None:
+                pool_size = config.HTTP_POOL_SIZE
+            if keep_alive is None:
+                keep_alive = config.HTTP_KEEP_ALIVE
+            session = make_session(
+                pool_size=max(pool_size, self.workers), keep_alive=keep_alive
+            )
+        self.session = session
+        self.__local = threading.local()
+        self.metrics = metrics or Metrics()
+        self.profiler: Union[Profiler, NullProfiler] = (
+            Profiler(profile_file=profile_file) if profile or profile_file
+            else NullProfiler()
+        )
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        # Recurly and stripe fail independently, so each has its own breaker.
+        retry_options = dict(
+            retries=retries,
+            backoff=retry_backoff,
+            max_backoff=retry_max_backoff,
+            breaker_threshold=breaker_threshold,
+            breaker_cooldown=breaker_cooldown,
+        )
+        self.retry = Retry(**retry_options)
+        self.stripe_retry = Retry(**retry_options)
+        self.keep_data = keep_data
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.__sink: Optional[Union[Sink, UpsertCsvSink]] = None
+        self.checkpoint_every = 0 if since_last_run else checkpoint_every
+        self.subscription_join = subscription_join
+        self.spill_subscriptions = spill_subscriptions
+        self.subscription_index: Optional[SubscriptionIndex] = None
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.log_interval = log_interval
+        self.__row = 0
+        self.__cursor: Optional[str] = None
+        self.__boundary: List[str] = []
+        self.__filters = {
+            "order": self.order,
+            "subscription_state": self.subscription_state,
+            "begin_time": self.begin_time,
+            "end_time": self.end_time,
+        }
+        if resume:
+            self.__resume()
+        self.recurly_data: List[Record] = []
         self.api_total_accounts = 0
         self.api_limit_reset_time: Union[int, float, datetime] = 0
         self.api_limit: int = 0
         self.api_limit_remaining: int = 0
         self.call_recurly_api("headers")
-        self.progress_bar: tqdm = self.__progress_bar()
+        self.progress_bar: Progress = self.__progress_bar()
+
+    @property
+    def client(self) -> "Client":
+        """Recurly client for the current thread."""
+        client = getattr(self.__local, "client", None)
+        if client is None:
+            from recurly_data.client import Client  # pylint: disable=import-outside-toplevel
+
+            client = Client(
+                self.api_key,
+                rate_limiter=self.rate_limiter,
+                on_response=self.__on_response,
+                base_url=self.v3_api,
+                metrics=self.metrics,
+                retry=self.retry,
+                log=self.log,
+            )
+            self.__local.client = client
+        return client
 
-    def __progress_bar(self):
-        ncols = 100
+    retry_statuses = (429, 500, 502, 503, 504)
+    max_page_size = 200
+
+    def http(
+            self,
+            endpoint: str,
+            method: str,
+            url: str,
+            retry: Optional[Retry] = None,
+            **kwargs
+    ) -> "requests.Response":
+        """Send a request through the shared session, recording its metrics."""
+        import requests  # pylint: disable=import-outside-toplevel
+
+        attempt = 0
+        while True:
+            attempt += 1
+            if retry:
+                self.metrics.observe_wait(endpoint, retry.before_request())
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.metrics.observe(endpoint, time.perf_counter() - started, None)
+                if not retry:
+                    raise
+                retry.failure()
+                if not retry.should_retry(attempt):
+                    raise
+                retry_after = None
+            else:
+                self.metrics.observe(
+                    endpoint,
+                    time.perf_counter() - started,
+                    response.status_code,
+                    len(response.content),
+                )
+                if not retry or response.status_code not in self.retry_statuses:
+                    if retry and response.status_code < 500:
+                        retry.success()
+                    return response
+                if response.status_code >= 500:
+                    retry.failure()
+                if not retry.should_retry(attempt):
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            self.metrics.observe_retry(endpoint)
+            retry.wait(attempt, retry_after)
+
+    def __resume(self):
+        """Restart from the cursor of the saved checkpoint."""
+        checkpoint = self.script_runner.checkpoint
+        if not checkpoint:
+            return
+
+        self.__filters.update(
+            (key, checkpoint[key]) for key in self.__filters if key in checkpoint
+        )
+        self.order = self.__filters["order"]
+        self.subscription_state = self.__filters["subscription_state"]
+        self.begin_time = self.__filters["begin_time"]
+        self.end_time = self.__filters["end_time"]
+
+        self.__row = checkpoint["row"]
+        self.__cursor = checkpoint["created_at"]
+        self.__boundary = list(checkpoint["boundary"])
+        cursor = datetime.fromisoformat(self.__cursor).isoformat()
+        if self.order == "asc":
+            self.begin_time = cursor
+        else:
+            self.end_time = cursor
+
+    def save_checkpoint(self):
+        """Flush written rows and save where the extraction got to."""
+        if self.__cursor is None:
+            return
+        if self.__sink:
+            self.__sink.flush()
+        checkpoint = dict(self.__filters)
+        checkpoint.update({
+            "row": self.__row,
+            "created_at": self.__cursor,
+            "boundary": self.__boundary,
+        })
+        self.script_runner.checkpoint = checkpoint
+
+    def __skip_boundary(self, accounts):
+        """Skip accounts on the resume cursor that were already extracted."""
+        boundary = set(self.__boundary)
+        for account in accounts:
+            if (
+                    str(account.created_at) == self.__cursor and
+                    account.email in boundary
+            ):
+                continue
+            yield account
+
+    def __drop_lapsed(self, accounts):
+        """Remove accounts that are no longer subscribers from a synced file."""
+        for account in accounts:
+            if (
+                    account.has_active_subscription or
+                    account.has_canceled_subscription or
+                    account.has_future_subscription
+            ):
+                yield account
+            elif self.__sink:
+                self.__sink.delete(account.email)
+
+    def __progress_bar(self) -> Progress:
         total = None
         if self.total_remaining:
             total = self.total_remaining
         elif self.limit:
             total = self.limit
-        elif not self.begin_time and not self.end_time:
+        elif (
+                not self.begin_time and
+                not self.end_time and
+                not self.since_last_run
+        ):
             total = self.api_total_accounts
 
-        pnct_bar = "{percentage:3.0f}% " + Fore.GREEN + "{bar}" + Fore.RESET
-        extr = "Extracted: " + Fore.YELLOW + "{n_fmt}/{total_fmt}" + Fore.RESET
-        elps = "Elapsed: " + Fore.YELLOW + "{elapsed}<{remaining}" + Fore.RESET
-        rate = "Rate: " + Fore.YELLOW + "{rate_fmt}" + Fore.RESET
-
-        if not self.verbose:
-            bar_format = pnct_bar + "|"
-        else:
-            bar_format = f"{pnct_bar} | {extr} | {elps} | {rate}"
-
-        return tqdm(
+        return Progress(
             total=total,
-            ncols=ncols,
-            bar_format=bar_format,
-            disable=self.silence,
+            mode="none" if self.silence else self.progress,
+            verbose=self.verbose,
+            interval=self.progress_interval,
+            log_interval=self.log_interval,
         )
 
     def call_recurly_api(self, endpoint: str, **params):
         """A convenient way to call recurly api with an endpoint."""
         allowed_endpoints = [
-            "headers", "accounts", "subscriptions", "redemptions"
+            "headers", "accounts", "subscriptions", "redemptions",
+            "site_subscriptions", "plans", "coupons"
         ]
 
         if endpoint not in allowed_endpoints:
             msg = f"Allowed endpoints are {', '.join(allowed_endpoints)}."
             raise Exception(msg)
 
-        try:
-            if endpoint == "headers":
-                response = self.__header_response()
-            elif endpoint == "accounts":
-                # refresh counts
-                self.__header_response()
-                response = self.client.list_accounts(**params, subscriber="true").items()
-            elif endpoint == "subscriptions":
-                response = self.client.list_account_subscriptions(
-                    **params
-                ).items()
-            elif endpoint == "redemptions":
-                response = self.client.list_account_coupon_redemptions(
-                    **params
-                ).items()
-        except recurly.errors.ValidationError as excpt:
-            print("here")
-            print(f"ValidationError: {excpt.error.message}")
-            print(excpt.error.params)
-        except recurly.errors.NotFoundError as excpt:
-            print(f"NotFoundError: {excpt}")
-        except recurly.errors.ApiError as excpt:
-            print(f"ApiError: {excpt}")
-        except recurly.NetworkError as excpt:
-            print(f"NetworkError: {excpt}")
-        else:
-            return response
-
-    @staticmethod
-    def compact_pending_change(obj):
+        if endpoint == "headers":
+            response = self.__header_response()
+        elif endpoint == "accounts":
+            # Only subscribers, unless every account is asked for.
+            if params.pop("subscriber", True):
+                params["subscriber"] = "true"
+            response = self.client.list_accounts(**params).items()
+        elif endpoint == "subscriptions":
+            response = self.client.list_account_subscriptions(
+                **params
+            ).items()
+        elif endpoint == "redemptions":
+            response = self.client.list_account_coupon_redemptions(
+                **params
+            ).items()
+        elif endpoint == "site_subscriptions":
+            response = self.client.list_subscriptions(**params).items()
+        elif endpoint == "plans":
+            response = self.client.list_plans(**params).items()
+        elif endpoint == "coupons":
+            response = self.client.list_coupons(**params).items()
+        return response
+
+    def compact_pending_change(self, obj):
         """Dictionary of compact pending change info."""
         return {
             "subject": obj.object,
             "new_plan_code": obj.plan.code,
-            "new_plan_frequency": RecurlyData.get_frequency_name(obj.plan.name),
+            "new_plan_frequency": self.catalog.frequency(obj.plan),
             "new_plan_pricing_amount": int(obj.unit_amount * 100),
             "new_plan_activate_at": str(obj.activate_at),
             "new_plan_activated": obj.activated
         }
 
-    # pylint: disable=too-many-locals,too-many-branches
+    def subscription_fields(self, subscription) -> Dict[str, Union[str, int]]:
+        """Row fields taken from a subscription."""
+        fields = {
+            "frequency": self.catalog.frequency(subscription.plan),
+            "pricing_amount": int(subscription.unit_amount * 100),
+        }
+        nbd = subscription.current_term_ends_at
+        if nbd:
+            fields["next_billing_date"] = str(nbd)
+
+        cncd = subscription.canceled_at
+        if cncd:
+            fields["cancel_date"] = str(cncd)
+        pending_change = subscription.pending_change
+        if pending_change:
+            fields["pending_change"] = self.compact_pending_change(pending_change)
+        return fields
+
+    columns = list(Record.columns)
+
+    def build_row(self, account) -> Record:
+        """Build a customer data row for a single account."""
+        profiler = self.profiler
+        with profiler.account(account.id):
+            row = Record()
+
+            account_id = account.id
+            row.email = account.email
+            if account.first_name:
+                row.name = account.first_name
+            if account.last_name:
+                row.name = f"{row.name} {account.last_name}"
+            with profiler.stage("stripe"):
+                row.stripe_id = self.get_assoc_stripe_id(account.email)
+            row.created_at = str(account.created_at)
+
+            cached = None
+            if self.account_cache is not None:
+                updated_at = str(account.updated_at)
+                cached = self.account_cache.get(
+                    account_id, updated_at, self.subscription_state
+                )
+
+            with profiler.stage("subscriptions"):
+                if self.subscription_index is not None:
+                    subscriptions = self.subscription_index.get(account_id)
+                elif cached is not None:
+                    subscriptions = [cached["subscriptions"]]
+                else:
+                    subscriptions = list(map(
+                        self.subscription_fields,
+                        self.get_account_subscriptions(account_id)
+                    ))
+            subscription_fields: Dict[str, Union[str, int, dict]] = {}
+            for fields in subscriptions:
+                subscription_fields.update(fields)
+            row.update(subscription_fields)
+
+            if (
+                    cached is not None and
+                    cached["subscriptions"].get("pricing_amount", "") ==
+                    subscription_fields.get("pricing_amount", "")
+            ):
+                row.update(cached["redemptions"])
+                return row
+
+            with profiler.stage("redemptions"):
+                redemptions = list(self.get_account_redemptions(account_id))
+            redemption_fields: Dict[str, Union[str, int]] = {}
+            for redemption in redemptions:
+                if redemption.state == "active":
+                    coupon = redemption.coupon
+                    redemption_fields["active_promo_code"] = coupon.code
+                    if row.pricing_amount:
+                        redemption_fields["discounted_pricing_amount"] = (
+                            self.catalog.discounted_price(
+                                coupon, int(row.pricing_amount)
+                            )
+                        )
+            row.update(redemption_fields)
+
+            if self.account_cache is not None:
+                self.account_cache.set(
+                    account_id,
+                    updated_at,
+                    self.subscription_state,
+                    {
+                        "subscriptions": subscription_fields,
+                        "redemptions": redemption_fields,
+                    },
+                    expires_at=self.cache_expiry(subscription_fields),
+                )
+            return row
+
+    @staticmethod
+    def cache_expiry(fields: Dict[str, Union[str, int, dict]]) -> Optional[float]:
+        """When cached subscription fields go stale without the account changing."""
+        now = time.time()
+        times = [fields.get("next_billing_date")]
+        pending_change = fields.get("pending_change")
+        if isinstance(pending_change, dict):
+            times.append(pending_change.get("new_plan_activate_at"))
+        expiry = None
+        for value in times:
+            if not value or value == "None":
+                continue
+            try:
+                parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+            except ValueError:
+                continue
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            timestamp = parsed.timestamp()
+            if now < timestamp and (expiry is None or timestamp < expiry):
+                expiry = timestamp
+        return expiry
+
+    def __build_rows(self, accounts):
+        """Build rows from an accounts iterator, in the iterator's order."""
+        limit = self.limit
+        if self.workers == 1:
+            for count, account in enumerate(accounts, start=1):
+                yield self.build_row(account)
+                if limit and count == limit:
+                    return
+            return
+
+        window = self.workers * 2
+        pending: deque = deque()
+        submitted = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for account in accounts:
+                    pending.append(executor.submit(self.build_row, account))
+                    submitted += 1
+                    if len(pending) >= window:
+                        yield pending.popleft().result()
+                    if limit and submitted == limit:
+                        break
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
     def extract_data(self, **params):
         """Extract customer data."""
+        keep_data = self.keep_data or not self.__sink
+        profiler = self.profiler
 
-        idx, columns = 0, [
-            "row", "email", "name", "stripe_id", "created_at", "frequency",
-            "pricing_amount", "discounted_pricing_amount", "next_billing_date",
-            "cancel_date", "active_promo_code", "pending_change"
-        ]
+        if self.stripe_prefetch and self.stripe_index is None:
+            with profiler.stage("stripe_index"):
+                self.load_stripe_index()
+
+        if self.prefetch_catalog and not self.catalog.loaded:
+            with profiler.stage("catalog"):
+                self.load_catalog()
+
+        if self.subscription_join and self.subscription_index is None:
+            with profiler.stage("subscription_index"):
+                self.load_subscription_index()
 
         with self.progress_bar as pbar:
-            for account in self.get_accounts(**params):
-                row = {column: "" for column in columns}
-
-                # if (
-                #     self.last_row and
-                #     self.last_row["email"] == account.email
-                # ):
-                #     continue
-
-                account_id = account.id
-                row["email"] = account.email
-                if account.first_name:
-                    row["name"] = account.first_name
-                if account.last_name:
-                    row["name"] = f"{row['name']} {account.last_name}"
-                row["stripe_id"] = self.get_assoc_stripe_id(account.email)
-                row["created_at"] = str(account.created_at)
-
-                for subscription in self.get_account_subscriptions(account_id):
-                    row["frequency"] = self.get_frequency_name(subscription.plan.name)
-                    row["pricing_amount"] = int(subscription.unit_amount * 100)
-                    nbd = subscription.current_term_ends_at
-                    if nbd:
-                        row["next_billing_date"] = str(nbd)
-
-                    cncd = subscription.canceled_at
-                    if cncd:
-                        row["cancel_date"] = str(cncd)
-                    pending_change = subscription.pending_change
-                    if pending_change:
-                        row["pending_change"] = (
-                            self.compact_pending_change(pending_change)
-                        )
+            accounts = self.get_accounts(**params)
+            if self.since_last_run:
+                accounts = self.__drop_lapsed(accounts)
+            if self.__boundary:
+                accounts = self.__skip_boundary(accounts)
+            accounts = profiler.iterate("accounts", accounts)
+            for row in self.__build_rows(accounts):
+                self.__row += 1
+                row.row = self.__row
+                if row.created_at == self.__cursor:
+                    self.__boundary.append(row.email)
+                else:
+                    self.__cursor = row.created_at
+                    self.__boundary = [row.email]
+                if self.__sink:
+                    with profiler.stage("write"):
+                        self.__sink.write(row)
+                    if (
+                            self.checkpoint_every and
+                            self.__row % self.checkpoint_every == 0
+                    ):
+                        with profiler.stage("checkpoint"):
+                            self.save_checkpoint()
+                if self.log:
+                    self.log.debug(f"Row {row.row}: account created at {row.created_at}")
+                if keep_data:
+                    self.recurly_data.append(row)
+                with profiler.stage("progress"):
+                    pbar.update(row)
+
+    def load_catalog(self) -> Catalog:
+        """List the site's plans and coupons once, into the catalog."""
+        import recurly  # pylint: disable=import-outside-toplevel
 
-                for redemption in self.get_account_redemptions(account_id):
-                    if redemption.state == "active":
-                        coupon = redemption.coupon
-                        code = coupon.code
-                        row["active_promo_code"] = code
-                        if row["pricing_amount"]:
-                            price = self.get_discounted_price(int(row["pricing_amount"]), coupon.discount)
-                            row["discounted_pricing_amount"] = price
-
-                self.recurly_data.append(row)
-                idx += 1
-                row["row"] = idx
-                item_count = 0
-                for key, item in row.items():
-                    item_count += 1
-                    if key == "pending_change":
-                        item = "yes" if item else ""
-                    pbar.display(msg=f" {key}: {Fore.CYAN}{item}", pos=item_count)
-                    pbar.refresh()
-                pbar.update()
-                if self.limit and idx == self.limit:
-                    break
+        try:
+            self.catalog.load(
+                self.call_recurly_api("plans", limit=self.max_page_size),
+                self.call_recurly_api("coupons", limit=self.max_page_size),
+            )
+        except (recurly.ApiError, recurly.NetworkError) as excpt:
+            msg = f"Could not list plans and coupons, using the embedded ones: {excpt}"
+            if self.log:
+                self.log.warning(msg)
+            if not self.silence:
+                print(f"{Fore.YELLOW}{msg}{Fore.RESET}")
+        return self.catalog
+
+    def load_subscription_index(self) -> SubscriptionIndex:
+        """List the site's subscriptions once and index them by account id."""
+        index = SubscriptionIndex(spill=self.spill_subscriptions)
+        params = dict(
+            endpoint="site_subscriptions",
+            state=self.subscription_state,
+            limit=self.page_size,
+        )
+        if self.prefetch_pages:
+            subscriptions = prefetch(
+                lambda: self.call_recurly_api(**params),
+                self.prefetch_pages * self.page_size,
+            )
+        else:
+            subscriptions = self.call_recurly_api(**params)
+        for subscription in subscriptions:
+            index.add(
+                subscription.account.id, self.subscription_fields(subscription)
+            )
+        index.finish()
+        self.subscription_index = index
+        return index
 
     def get_account_redemptions(self, account_id: str, **params):
         """Get recurly account's redemptions iterator object."""
@@ -263,6 +711,9 @@ class RecurlyData:
         """Get recurly accounts iterator object."""
         params["endpoint"] = "accounts"
 
+        if "limit" not in params:
+            params["limit"] = self.page_size
+
         if "order" not in params:
             params["order"] = self.order
 
@@ -272,16 +723,32 @@ class RecurlyData:
         if "end_time" not in params and self.end_time:
             params["end_time"] = self.end_time
 
+        if self.prefetch_pages:
+            return prefetch(
+                lambda: self.call_recurly_api(**params),
+                self.prefetch_pages * params["limit"],
+            )
         return self.call_recurly_api(**params)
 
     def get_assoc_stripe_id(self, email: str) -> Optional[str]:
         """
         Get the asscociated stripe id.
         """
+        if self.stripe_index and email in self.stripe_index:
+            return self.stripe_index[email]
+
+        if self.stripe_cache is not None:
+            cst_id = self.stripe_cache.get(email)
+            if cst_id is not None:
+                return cst_id
+
         cst_id = ""
         if self.stripe_api:
-            item = requests.get(
+            item = self.http(
+                "stripe_customers",
+                "GET",
                 self.stripe_api + "/customers",
+                retry=self.stripe_retry,
                 auth=(self.stripe_key, ""),
                 params={"email": email}
             )
@@ -290,25 +757,68 @@ class RecurlyData:
                 data = item.json()["data"]
                 if data:
                     cst_id = data[0]["id"]
+                if self.stripe_cache is not None:
+                    self.stripe_cache.set(email, cst_id)
 
         return cst_id
 
+    def load_stripe_index(self) -> Dict[str, str]:
+        """Page through all stripe customers once and index their ids by email."""
+        index: Dict[str, str] = {}
+        params = {"limit": 100}
+        while self.stripe_api:
+            item = self.http(
+                "stripe_index",
+                "GET",
+                self.stripe_api + "/customers",
+                retry=self.stripe_retry,
+                auth=(self.stripe_key, ""),
+                params=params
+            )
+            item.raise_for_status()
+            page = item.json()
+            for customer in page["data"]:
+                if customer.get("email"):
+                    index.setdefault(customer["email"], customer["id"])
+            if not page.get("has_more") or not page["data"]:
+                break
+            params["starting_after"] = page["data"][-1]["id"]
+
+        self.stripe_index = index
+        return index
+
     @staticmethod
     def get_discounted_price(price: int, discount):
-        discount_type = discount.type
-        if discount_type == "percent":
-            price = int(
-                price - (price * discount.percent/100)
-            )
-        elif discount_type == "fixed":
-            price = int(
-                price - (discount.currencies[0].amount * 100)
-            )
-        return price
+        return discounted_price(price, discount)
+
+    def count_accounts(
+            self,
+            begin_time: Optional[str] = None,
+            end_time: Optional[str] = None,
+    ) -> Optional[int]:
+        """Count subscriber accounts created within a time window."""
+        params = {"state": "subscriber"}
+        if begin_time:
+            params["begin_time"] = begin_time
+        if end_time:
+            params["end_time"] = end_time
+
+        self.metrics.observe_wait("headers", self.rate_limiter.acquire())
+        response = self.http(
+            "headers",
+            "HEAD",
+            self.api + "/accounts",
+            retry=self.retry,
+            auth=(self.api_key, ""),
+            params=params
+        )
+        if response.status_code == 200 and "X-Records" in response.headers:
+            return int(response.headers["X-Records"])
+        return None
 
     def get_first_account_datetime(self):
         """Get datetime of the first record."""
-        accounts = self.get_accounts(order="asc")
+        accounts = self.call_recurly_api("accounts", order="asc", limit=1)
         # TODO: Catch exception recurly.ApiError, AttributeError etc
         account = next(accounts)
         return account.created_at
@@ -316,27 +826,84 @@ class RecurlyData:
     @staticmethod
     def get_frequency_name(name: str):
         """Get the frequency name."""
-        name = name.split(' ')[0]
-        if(name == "Annual"):
-            name = "Yearly"
-        return name
+        return frequency_name(name)
 
     def make_csv(self):
-        """Make  a csv file from extracted data."""
+        """Make the output file, streaming rows to it as they are extracted."""
+        params = {}
+        if self.since_last_run:
+            started = datetime.now(timezone.utc).replace(microsecond=0)
+            sink = UpsertCsvSink(self.filename, self.columns, key="email")
+            params.update(sort="updated_at", order="asc", subscriber=False)
+            last_sync = self.script_runner.info.get("last_sync")
+            if last_sync:
+                params["begin_time"] = last_sync
+        else:
+            sink = make_sink(
+                self.output_format,
+                self.filename,
+                self.columns,
+                flush_every=self.flush_every,
+                flush_interval=self.flush_interval,
+                fsync=self.fsync,
+            )
+        completed = False
+        self.profiler.start()
         try:
-            self.extract_data()
+            with sink:
+                self.__sink = sink
+                self.extract_data(**params)
+            completed = not self.limit or sink.rows_written < self.limit
         except KeyboardInterrupt as excpt:
             print(str(excpt))
+            if self.log:
+                self.log.warning(f"Interrupted after {sink.rows_written} rows")
+        except Exception as excpt:
+            if self.log:
+                self.log.error(
+                    f"Failed after {sink.rows_written} rows: "
+                    f"{excpt.__class__.__name__}: {excpt}"
+                )
+            raise
         finally:
-            last_row = False
-            if self.recurly_data:
-                total_rows = len(self.recurly_data) - 1
-                last_row = self.recurly_data[total_rows]
-                mode = "a" if os.path.exists(self.filename) else "w"
-                fieldnames = list(self.recurly_data[0].keys())
-                with open(self.filename, mode=mode) as csv_file:
-                    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-                    if mode == "w":
-                        writer.writeheader()
-                    for row in self.recurly_data:
-                        writer.writerow(row)
+            self.__sink = None
+            if not self.since_last_run:
+                self.save_checkpoint()
+            elif completed:
+                # Accounts updated while this run was listing sort after the
+                # cursor, so the next sync starts from when this one started.
+                self.script_runner.info = {"last_sync": started.isoformat()}
+            if self.subscription_index is not None:
+                self.subscription_index.close()
+                self.subscription_index = None
+            if self.stripe_cache is not None and self.close_stripe_cache:
+                if not self.silence:
+                    print(self.stripe_cache.report())
+                self.stripe_cache.close()
+            if self.account_cache is not None and self.close_account_cache:
+                if not self.silence:
+                    print(self.account_cache.report())
+                self.account_cache.close()
+            self.metrics.finish(sink.rows_written)
+            self.write_metrics()
+            self.profiler.stop()
+            if self.profiler.enabled and not self.silence:
+                print(self.profiler.report())
+            if self.log:
+                self.log.info(
+                    f"{sink.rows_written} rows written to {self.filename} in "
+                    f"{self.metrics.duration:.1f}s"
+                )
+                # Send what is queued now, rather than only at exit.
+                self.log.flush()
+                if self.log.dropped and not self.silence:
+                    print(f"{Fore.YELLOW}{self.log.dropped} log records dropped")
+
+    def write_metrics(self):
+        """Write the metrics files and print the run report."""
+        if self.metrics_file:
+            self.metrics.write_json(self.metrics_file)
+        if self.prometheus_file:
+            self.metrics.write_prometheus(self.prometheus_file)
+        if not self.silence:
+            print(self.metrics.report())
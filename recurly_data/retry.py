@@ -0,0 +1,94 @@
+"""Retry policy."""
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+
+class Retry:
+    """Exponential backoff with full jitter and a circuit breaker."""
+
+    def __init__(
+            self,
+            retries: int = 5,
+            backoff: float = 0.5,
+            max_backoff: float = 60.0,
+            breaker_threshold: int = 5,
+            breaker_cooldown: float = 30.0,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+            jitter: Callable[[], float] = random.random,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.clock = clock
+        self.sleep = sleep
+        self.jitter = jitter
+        self.failures = 0
+        self.open_until = 0.0
+        self.__lock = threading.Lock()
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to sleep before retrying after the given attempt."""
+        delay = self.jitter() * min(
+            self.max_backoff, self.backoff * 2 ** (attempt - 1)
+        )
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def should_retry(self, attempt: int) -> bool:
+        return attempt <= self.retries
+
+    def wait(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Sleep before retrying and return the seconds slept."""
+        delay = self.delay(attempt, retry_after)
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+    def before_request(self) -> float:
+        """Wait while the breaker is open and return the seconds waited."""
+        with self.__lock:
+            wait = self.open_until - self.clock()
+        if wait > 0:
+            self.sleep(wait)
+            return wait
+        return 0.0
+
+    def success(self):
+        """Close the breaker."""
+        with self.__lock:
+            self.failures = 0
+
+    def failure(self):
+        """Count a failure, opening the breaker after too many in a row."""
+        with self.__lock:
+            self.failures += 1
+            if self.failures >= self.breaker_threshold:
+                self.open_until = max(
+                    self.open_until, self.clock() + self.breaker_cooldown
+                )
+
+    @property
+    def is_open(self) -> bool:
+        return self.clock() < self.open_until
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, in seconds or as a date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
@@ -0,0 +1,26 @@
+"""Process wide setup, done on first use."""
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def init_colors():
+    """Reset colored output after every print."""
+    from colorama import init  # pylint: disable=import-outside-toplevel
+
+    init(autoreset=True)
+
+
+@functools.lru_cache(maxsize=None)
+def init_sentry(dsn: str):
+    """Report errors to sentry."""
+    import sentry_sdk  # pylint: disable=import-outside-toplevel
+
+    sentry_sdk.init(dsn)
+
+
+@functools.lru_cache(maxsize=None)
+def init_logger(dest: str, port: int):
+    """Log to papertrail, with one logger per destination."""
+    from recurly_data.logger import Logger  # pylint: disable=import-outside-toplevel
+
+    return Logger(dest, port)
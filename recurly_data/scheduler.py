@@ -0,0 +1,80 @@
+"""Rate limit scheduler."""
+import threading
+import time
+from typing import Callable, Optional
+
+
+class RateLimiter:
+    """Token bucket fed by the X-RateLimit headers of recurly responses."""
+
+    def __init__(
+            self,
+            burst: int = 10,
+            share: float = 1.0,
+            clock: Callable[[], float] = time.time,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.burst = burst
+        self.share = share
+        self.clock = clock
+        self.sleep = sleep
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self.__tat = 0.0
+        self.__lock = threading.Lock()
+
+    def update(
+            self,
+            limit: Optional[int],
+            remaining: Optional[int],
+            reset_at: Optional[float],
+    ):
+        """Feed the limiter with the latest rate limit headers."""
+        if remaining is None or reset_at is None:
+            return
+        with self.__lock:
+            self.limit = limit
+            self.remaining = remaining
+            self.reset_at = reset_at
+
+    def exhausted(self):
+        """Mark the budget as spent, so callers wait for the reset."""
+        with self.__lock:
+            if self.reset_at is not None:
+                self.remaining = 0
+
+    def interval(self, start: float) -> float:
+        """Seconds between requests that spend the budget from start to reset."""
+        if self.remaining is None or self.reset_at is None:
+            return 0.0
+        window = self.reset_at - start
+        if window <= 0:
+            return 0.0
+        return window / max(self.remaining * self.share, 1)
+
+    def acquire(self) -> float:
+        """Wait for a request slot and return the seconds spent waiting."""
+        with self.__lock:
+            now = self.clock()
+            if self.reset_at is not None and now >= self.reset_at:
+                # The window has reset, run freely until the next headers.
+                self.remaining = None
+                self.reset_at = None
+
+            if self.remaining is not None and self.remaining <= 0:
+                wait = self.reset_at - now
+                self.remaining = self.limit
+                self.reset_at = None
+                self.__tat = now + wait
+            else:
+                tat = max(self.__tat, now)
+                interval = self.interval(tat)
+                wait = max(0.0, tat - (self.burst - 1) * interval - now)
+                self.__tat = tat + interval
+                if self.remaining is not None:
+                    self.remaining -= 1
+
+        if wait > 0:
+            self.sleep(wait)
+        return wait
@@ -1,7 +1,10 @@
 """Script Runner."""
+import csv
+from datetime import datetime
 import os
 import pickle
 from typing import Dict, List, Optional, Union
+from recurly_data.files import atomic_write
 
 
 class ScriptRunner:
@@ -9,43 +12,44 @@ class ScriptRunner:
 
     def __init__(
             self,
-            data_obj: dict,
             data_file: Optional[str] = None,
-            info_file: str = "info.pickle",
+            info_file: str = "script_info.pickle",
     ):
         self.info_file = info_file
-        self.data_obj = data_obj
         self.data_file = data_file
 
+    def continue_extraction(self) -> Optional[Dict[str, Union[str, int, List[str]]]]:
+        """Build a checkpoint from the last row of the data file."""
+        if not self.data_file or not os.path.exists(self.data_file):
+            return None
 
-    def continue_extraction(self):
-        if self.data_file and os.path.exists(self.data_file):
-            with open(self.filename, "rb") as f:
-                # Read first line for columns
-                columns = f.readline().decode().strip().split(",")
-                # Read second line as first row
-                first_row = f.readline().decode().strip().split(",")
-                # Jump to the second last byte.
-                f.seek(-2, os.SEEK_END)
-                # Until EOL is found...
-                while f.read(1) != b"\n":
-                    # jump back the read byte plus one more.
-                    f.seek(-2, os.SEEK_CUR)
-                # Read last line.
-                last_row = f.readline().decode().strip().split(",")
-            first = dict(zip(columns, first_row))
-            last = dict(zip(columns, last_row))
-            self.last_row = last
-            frst_ct = float(first["created_at"])
-            lst_ct = float(last["created_at"])
-            self.total_extracted = int(last["row"])
-            last_created_at = datetime.utcfromtimestamp(lst_ct).isoformat()
-            if frst_ct > lst_ct:
-                # Last iteration ran in desc order, so update end_time.
-                self.end_time = last_created_at
-            else:
-                # Last iteration ran in asc order, so update begin_time.
-                self.begin_time = last_created_at
+        with open(self.data_file, "rb") as f:
+            # Read first line for columns
+            columns = next(csv.reader([f.readline().decode()]))
+            # Read second line as first row
+            first_row = next(csv.reader([f.readline().decode()]), None)
+            if not first_row:
+                return None
+            # Jump to the second last byte.
+            f.seek(-2, os.SEEK_END)
+            # Until EOL is found...
+            while f.read(1) != b"\n":
+                # jump back the read byte plus one more.
+                f.seek(-2, os.SEEK_CUR)
+            # Read last line.
+            last_row = next(csv.reader([f.readline().decode()]))
+        first = dict(zip(columns, first_row))
+        last = dict(zip(columns, last_row))
+        frst_ct = datetime.fromisoformat(first["created_at"])
+        lst_ct = datetime.fromisoformat(last["created_at"])
+        return {
+            "row": int(last["row"]),
+            "created_at": last["created_at"],
+            # Other accounts created in the same second are extracted again.
+            "boundary": [last["email"]],
+            # Rows going back in time mean the last run was in desc order.
+            "order": "desc" if frst_ct > lst_ct else "asc",
+        }
 
     @property
     def info(self):
@@ -58,9 +62,20 @@ class ScriptRunner:
 
     @info.setter
     def info(self, data: dict):
-        if self.info:
-            data.update(self.info)
-        with open(self.info_file, "wb") as handle:
+        info = self.info
+        info.update(data)
+        # A crash never leaves a half written info file behind.
+        with atomic_write(self.info_file, fsync=True) as tmp_file, \
+                open(tmp_file, "wb") as handle:
             pickle.dump(
-                data, handle, protocol=pickle.HIGHEST_PROTOCOL
+                info, handle, protocol=pickle.HIGHEST_PROTOCOL
             )
+
+    @property
+    def checkpoint(self) -> Optional[Dict[str, Union[str, int, List[str]]]]:
+        """The last saved checkpoint, or one rebuilt from the data file."""
+        return self.info.get("checkpoint") or self.continue_extraction()
+
+    @checkpoint.setter
+    def checkpoint(self, data: Dict[str, Union[str, int, List[str]]]):
+        self.info = {"checkpoint": data}
@@ -0,0 +1,14 @@
+"""HTTP session."""
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def make_session(pool_size: int = 10, keep_alive: bool = True) -> requests.Session:
+    """Make a long-lived http session with a connection pool."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
@@ -0,0 +1,190 @@
+"""Sharded extraction."""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+from datetime import datetime, timedelta, timezone
+import os
+from typing import Dict, Iterator, List, Optional, Tuple, Type, Union
+from recurly_data.cache import AccountCache, StripeCache
+from recurly_data.metrics import Metrics
+from recurly_data.record import Record
+from recurly_data.recurly_data import RecurlyData
+from recurly_data.scheduler import RateLimiter
+from recurly_data.sinks import make_sink
+
+
+def parse_time(value: str) -> datetime:
+    """Parse an ISO 8601 date or date and time, defaulting to UTC."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def shard_windows(
+        rcd: RecurlyData,
+        shards: int,
+        bisect_steps: int = 40,
+) -> List[Tuple[datetime, Optional[datetime]]]:
+    """Split the account range of rcd into windows of about equal size."""
+    if rcd.begin_time:
+        begin = parse_time(rcd.begin_time)
+    else:
+        begin = rcd.get_first_account_datetime()
+        if begin.tzinfo is None:
+            # Older recurly clients parse timestamps as naive UTC on newer pythons.
+            begin = begin.replace(tzinfo=timezone.utc)
+    end = parse_time(rcd.end_time) if rcd.end_time else datetime.now(timezone.utc)
+    begin = begin.replace(microsecond=0)
+    first = begin.isoformat()
+    total = rcd.count_accounts(first, end.isoformat())
+
+    bounds = [begin]
+    for shard in range(1, shards):
+        low, high = bounds[-1], end
+        if total:
+            # Bisect on the accounts created since the first, to the second.
+            target = total * shard / shards
+            for _ in range(bisect_steps):
+                if high - low <= timedelta(seconds=1):
+                    break
+                mid = low + (high - low) / 2
+                count = rcd.count_accounts(first, mid.isoformat())
+                if count is None:
+                    break
+                if count < target:
+                    low = mid
+                else:
+                    high = mid
+            bound = high
+        else:
+            bound = begin + (end - begin) * shard / shards
+        bound = bound.replace(microsecond=0)
+        if bounds[-1] < bound < end:
+            bounds.append(bound)
+
+    ends: List[Optional[datetime]] = [
+        bound - timedelta(seconds=1) for bound in bounds[1:]
+    ]
+    # Left open without an end time, to pick up accounts created meanwhile.
+    ends.append(end if rcd.end_time else None)
+    return list(zip(bounds, ends))
+
+
+def extract_shard(options: Dict) -> Tuple[str, Metrics]:
+    """Extract one window into its own file, in a worker process."""
+    options = dict(options)
+    stripe_cache_options = options.pop("stripe_cache_options", None)
+    if stripe_cache_options:
+        options["stripe_cache"] = StripeCache(**stripe_cache_options)
+    account_cache_options = options.pop("account_cache_options", None)
+    if account_cache_options:
+        # The other shards may still be writing to the file.
+        options["account_cache"] = AccountCache(
+            **dict(account_cache_options, compact_on_close=False)
+        )
+    options["rate_limiter"] = RateLimiter(share=options.pop("share"))
+    rcd = RecurlyData(**options)
+    rcd.make_csv()
+    return rcd.filename, rcd.metrics
+
+
+def read_records(
+        csv_file_name: str,
+        record_class: Type[Record] = Record,
+        **fields,
+) -> Iterator[Record]:
+    """Read the records of a csv export, setting extra fields on each."""
+    if not os.path.exists(csv_file_name):
+        return
+    with open(csv_file_name, newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield record_class.from_csv(dict(row, **fields))
+
+
+def merge_shards(
+        files: List[str],
+        filename: str,
+        fieldnames: List[str],
+        limit: Optional[int] = None,
+        output_format: str = "csv",
+) -> int:
+    """Merge csv shard files into filename in order, renumbering the rows."""
+    idx = 0
+    with make_sink(output_format, filename, fieldnames) as sink:
+        for shard_file in files:
+            for record in read_records(shard_file):
+                if limit and idx == limit:
+                    break
+                idx += 1
+                record.row = idx
+                sink.write(record)
+    return idx
+
+
+def extract_sharded(
+        shards: int,
+        stripe_cache_options: Optional[Dict[str, Union[str, int]]] = None,
+        account_cache_options: Optional[Dict[str, Union[str, int]]] = None,
+        **options,
+) -> int:
+    """Extract the account range in parallel windows and merge the results."""
+    from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+
+    if options.get("resume") or options.get("since_last_run"):
+        raise Exception("Sharded runs cannot be resumed or synced since the last run.")
+    planner = RecurlyData(**dict(options, silence=True))
+    windows = shard_windows(planner, shards)
+    filename = planner.filename
+
+    jobs = []
+    for number, (begin, end) in enumerate(windows):
+        shard_file = f"{filename}.shard{number}"
+        for stale in (shard_file, f"{shard_file}.pickle"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        jobs.append(dict(
+            options,
+            filename=shard_file,
+            begin_time=begin.isoformat(),
+            end_time=end.isoformat() if end else None,
+            silence=True,
+            resume=False,
+            output_format="csv",
+            share=1 / len(windows),
+            stripe_cache_options=stripe_cache_options,
+            account_cache_options=account_cache_options,
+            metrics_file=None,
+            prometheus_file=None,
+        ))
+
+    with ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = [executor.submit(extract_shard, job) for job in jobs]
+        silence = options.get("silence", False)
+        with tqdm(total=len(futures), ncols=100, disable=silence) as pbar:
+            for future in as_completed(futures):
+                _, metrics = future.result()
+                planner.metrics.merge(metrics)
+                pbar.update()
+    if account_cache_options:
+        AccountCache(**account_cache_options).close()
+    files = [job["filename"] for job in jobs]
+
+    if planner.order == "desc":
+        files.reverse()
+    total = merge_shards(
+        files,
+        filename,
+        planner.columns,
+        limit=planner.limit,
+        output_format=planner.output_format,
+    )
+
+    for shard_file in files:
+        for done in (shard_file, f"{shard_file}.pickle"):
+            if os.path.exists(done):
+                os.remove(done)
+
+    planner.metrics.finish(total)
+    planner.silence = options.get("silence", False)
+    planner.write_metrics()
+    return total
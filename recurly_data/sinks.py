@@ -0,0 +1,315 @@
+"""Output sinks."""
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence, TextIO, Union
+from recurly_data.files import atomic_write
+from recurly_data.record import INT_COLUMNS, Record, Value
+
+
+class Sink:
+    """Base class of the output sinks, appending to an existing output."""
+
+    def __init__(
+            self,
+            filename: str,
+            fieldnames: Sequence[str] = Record.columns,
+            flush_every: int = 1000,
+            flush_interval: float = 5.0,
+            fsync: bool = False,
+    ):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.rows_written = 0
+        self.__unflushed = 0
+        self.__flushed_at = 0.0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        """Open the output."""
+        self.__flushed_at = time.monotonic()
+
+    def write(self, row: Record):
+        """Write a row, flushing if enough rows or time have gone by."""
+        self.write_row(row)
+        self.rows_written += 1
+        self.__unflushed += 1
+        if (
+                self.__unflushed >= self.flush_every or
+                time.monotonic() - self.__flushed_at >= self.flush_interval
+        ):
+            self.flush()
+
+    def write_row(self, row: Record):
+        """Write a single row to the output."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Flush buffered rows to the output."""
+        self.__unflushed = 0
+        self.__flushed_at = time.monotonic()
+
+    def close(self):
+        """Flush and close the output."""
+        raise NotImplementedError
+
+
+class TextSink(Sink):
+    """Sink writing to a text file, optionally gzip or zstd compressed."""
+
+    def __init__(self, *args, compression: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if compression not in (None, "gzip", "zstd"):
+            raise Exception("Compression must be gzip or zstd.")
+        self.__zstandard = None
+        if compression == "zstd":
+            try:
+                import zstandard  # pylint: disable=import-outside-toplevel
+            except ImportError:
+                raise Exception(
+                    "Writing zstd requires the zstandard package, "
+                    "install it with 'pip install zstandard'."
+                )
+            self.__zstandard = zstandard
+        self.compression = compression
+        self.file: Optional[TextIO] = None
+        self.new_file = False
+        self.__raw = None
+        self.__compressor = None
+
+    def open(self):
+        """Open the file for appending."""
+        super().open()
+        self.new_file = (
+            not os.path.exists(self.filename) or
+            not os.path.getsize(self.filename)
+        )
+        # Every compressed append starts a new gzip member or zstd frame,
+        # which readers decompress as one continuous stream.
+        self.__raw = open(self.filename, mode="ab")
+        if self.compression == "gzip":
+            self.__compressor = gzip.GzipFile(fileobj=self.__raw, mode="ab")
+            binary = self.__compressor
+        elif self.compression == "zstd":
+            self.__compressor = self.__zstandard.ZstdCompressor().stream_writer(
+                self.__raw, closefd=False
+            )
+            binary = self.__compressor
+        else:
+            binary = self.__raw
+        self.file = io.TextIOWrapper(
+            binary, encoding="utf-8", newline="", write_through=True
+        )
+
+    def flush(self):
+        """Flush buffered rows to the file."""
+        super().flush()
+        self.file.flush()
+        if self.compression == "gzip":
+            self.__compressor.flush()
+        elif self.compression == "zstd":
+            self.__compressor.flush(self.__zstandard.FLUSH_BLOCK)
+        self.__raw.flush()
+        if self.fsync:
+            os.fsync(self.__raw.fileno())
+
+    def close(self):
+        """Flush and close the file."""
+        if self.file and not self.file.closed:
+            self.flush()
+            self.file.close()
+            if self.__compressor is not None and not self.__raw.closed:
+                self.__raw.close()
+
+
+def csv_value(value: Value) -> Union[str, int]:
+    """Serialize nested values as json instead of a python repr."""
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+class CsvSink(TextSink):
+    """Streams rows to a csv file, writing the header to new files only."""
+
+    def open(self):
+        super().open()
+        self.__writer = csv.writer(self.file)
+        if self.new_file:
+            self.__writer.writerow(self.fieldnames)
+
+    def write_row(self, row: Record):
+        self.__writer.writerow(map(csv_value, row))
+
+
+class JsonLinesSink(TextSink):
+    """Streams rows to a JSON Lines file."""
+
+    def write_row(self, row: Record):
+        self.file.write(json.dumps(dict(zip(
+            self.fieldnames, (None if value == "" else value for value in row)
+        ))))
+        self.file.write("\n")
+
+
+class SqliteSink(Sink):
+    """Writes rows to a recurly_data table in a sqlite database."""
+
+    table = "recurly_data"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__conn: Optional[sqlite3.Connection] = None
+        self.__rows: List[tuple] = []
+        self.__insert = (
+            f"INSERT INTO {self.table} ({', '.join(self.fieldnames)}) "
+            f"VALUES ({', '.join('?' for _ in self.fieldnames)})"
+        )
+
+    def open(self):
+        """Open the database, creating the table if needed."""
+        super().open()
+        self.__conn = sqlite3.connect(self.filename)
+        self.__conn.execute(
+            "PRAGMA synchronous=FULL" if self.fsync else "PRAGMA synchronous=NORMAL"
+        )
+        columns = ", ".join(
+            f"{name} INTEGER" if name in INT_COLUMNS else f"{name} TEXT"
+            for name in self.fieldnames
+        )
+        self.__conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({columns})")
+        self.__conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_email "
+            f"ON {self.table} (email)"
+        )
+        self.__conn.commit()
+
+    def write_row(self, row: Record):
+        self.__rows.append(tuple(
+            None if value == "" else csv_value(value) for value in row
+        ))
+
+    def flush(self):
+        """Insert the buffered rows in one transaction."""
+        super().flush()
+        if self.__rows:
+            with self.__conn:
+                self.__conn.executemany(self.__insert, self.__rows)
+            self.__rows = []
+
+    def close(self):
+        """Insert the remaining rows and close the database."""
+        if self.__conn is not None:
+            self.flush()
+            self.__conn.close()
+            self.__conn = None
+
+
+formats = {
+    "csv": (CsvSink, None),
+    "csv.gz": (CsvSink, "gzip"),
+    "csv.zst": (CsvSink, "zstd"),
+    "jsonl": (JsonLinesSink, None),
+    "jsonl.gz": (JsonLinesSink, "gzip"),
+    "jsonl.zst": (JsonLinesSink, "zstd"),
+    "sqlite": (SqliteSink, None),
+}
+
+
+def make_sink(
+        output_format: str,
+        filename: str,
+        fieldnames: Sequence[str] = Record.columns,
+        **options,
+) -> Sink:
+    """Make the sink for an output format."""
+    if output_format not in formats:
+        raise Exception(f"Output formats are {', '.join(formats)}.")
+    sink_class, compression = formats[output_format]
+    if compression:
+        options["compression"] = compression
+    return sink_class(filename, fieldnames, **options)
+
+
+class UpsertCsvSink:
+    """Upserts rows into a csv file, keyed by a column."""
+
+    def __init__(
+            self,
+            filename: str,
+            fieldnames: Sequence[str] = Record.columns,
+            key: str = "email",
+    ):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.key = key
+        self.rows_written = 0
+        self.__rows: Dict[str, Optional[Record]] = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        """Start collecting rows."""
+        self.__rows = {}
+
+    def write(self, row: Record):
+        """Collect a row, replacing an earlier one with the same key."""
+        self.__rows[row[self.key]] = row
+        self.rows_written += 1
+
+    def delete(self, key: str):
+        """Drop the row with a key from the file."""
+        self.__rows[key] = None
+
+    def flush(self):
+        """Rows are only written on close."""
+
+    def close(self):
+        """Merge the collected rows into the file."""
+        written = set()
+        idx = 0
+        with atomic_write(self.filename, fsync=True) as tmp_file, \
+                open(tmp_file, mode="w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(self.fieldnames)
+            if os.path.exists(self.filename):
+                with open(self.filename, newline="") as old_file:
+                    for old_row in csv.DictReader(old_file):
+                        key = old_row[self.key]
+                        if key in written:
+                            continue
+                        written.add(key)
+                        if key in self.__rows:
+                            row = self.__rows.pop(key)
+                            if row is None:
+                                continue
+                        else:
+                            row = Record.from_dict(old_row)
+                        idx += 1
+                        row["row"] = idx
+                        writer.writerow(map(csv_value, row))
+            for row in self.__rows.values():
+                if row is None:
+                    continue
+                idx += 1
+                row["row"] = idx
+                writer.writerow(map(csv_value, row))
+        self.__rows = {}
@@ -0,0 +1,159 @@
+"""Multi-site extraction."""
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+from colorama import Fore
+from recurly_data import config
+from recurly_data.cache import AccountCache, StripeCache
+from recurly_data.metrics import Metrics
+from recurly_data.record import SiteRecord
+from recurly_data.recurly_data import RecurlyData
+from recurly_data.session import make_session
+from recurly_data.shards import read_records
+from recurly_data.sinks import make_sink
+
+
+def site_names(apis: Sequence[str]) -> List[str]:
+    """Name sites after the subdomains of their v2 api urls."""
+    names: List[str] = []
+    for api in apis:
+        name = (urlsplit(api).hostname or api).split(".")[0]
+        if name in names:
+            name = f"{name}{len(names) + 1}"
+        names.append(name)
+    return names
+
+
+def site_filename(filename: str, site: str) -> str:
+    """The output file of a site, e.g. recurly_data.dropout.csv.gz."""
+    directory, base = os.path.split(filename)
+    stem, dot, extension = base.partition(".")
+    return os.path.join(directory, f"{stem}.{site}{dot}{extension}")
+
+
+def extract_sites(
+        sites: Sequence[Tuple[str, str]],
+        combined: bool = False,
+        stripe_cache: Optional[StripeCache] = None,
+        account_cache: Optional[AccountCache] = None,
+        **options,
+) -> Dict[str, int]:
+    """
+    Extract several recurly sites concurrently in one process.
+
+    ``sites`` are (v2 api url, api key) pairs.
+    """
+    if combined and options.get("since_last_run"):
+        raise Exception("Syncing since the last run needs a file per site.")
+
+    silence = options.get("silence", False)
+    filename = os.path.abspath(options.pop("filename", "recurly_data.csv"))
+    output_format = options.pop("output_format", "csv")
+    metrics_file = options.pop("metrics_file", None)
+    prometheus_file = options.pop("prometheus_file", None)
+    workers = max(1, int(options.get("workers") or 1))
+    pool_size = options.pop("pool_size", None)
+    if pool_size is None:
+        pool_size = config.HTTP_POOL_SIZE
+    keep_alive = options.pop("keep_alive", None)
+    if keep_alive is None:
+        keep_alive = config.HTTP_KEEP_ALIVE
+    session = make_session(
+        pool_size=max(pool_size, workers * len(sites)), keep_alive=keep_alive
+    )
+
+    names = site_names([api for api, _ in sites])
+    extractions: Dict[str, RecurlyData] = {}
+    for name, (api, api_key) in zip(names, sites):
+        site_file = site_filename(filename, name)
+        if combined:
+            for stale in (site_file, f"{site_file}.pickle"):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        extractions[name] = RecurlyData(**dict(
+            options,
+            api=api,
+            api_key=api_key,
+            filename=site_file,
+            output_format="csv" if combined else output_format,
+            resume=False if combined else options.get("resume", False),
+            session=session,
+            stripe_cache=stripe_cache,
+            close_stripe_cache=False,
+            account_cache=account_cache,
+            close_account_cache=False,
+            silence=True,
+            metrics_file=None,
+            prometheus_file=None,
+        ))
+
+    if options.get("stripe_prefetch"):
+        stripe_index = next(iter(extractions.values())).load_stripe_index()
+        for rcd in extractions.values():
+            rcd.stripe_index = stripe_index
+
+    def extract(name: str) -> int:
+        rcd = extractions[name]
+        rcd.make_csv()
+        if not silence:
+            print(
+                f"{Fore.CYAN}{name}{Fore.RESET}: {rcd.metrics.rows} rows "
+                f"in {rcd.metrics.duration:.1f}s"
+            )
+        return rcd.metrics.rows
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(extractions)) as executor:
+            rows = dict(zip(extractions, executor.map(extract, extractions)))
+    finally:
+        for cache in (stripe_cache, account_cache):
+            if cache is not None:
+                if not silence:
+                    print(cache.report())
+                cache.close()
+
+    total = sum(rows.values())
+    if combined:
+        total = merge_sites(
+            {name: rcd.filename for name, rcd in extractions.items()},
+            filename,
+            limit=options.get("limit"),
+            output_format=output_format,
+        )
+        for rcd in extractions.values():
+            for done in (rcd.filename, f"{rcd.filename}.pickle"):
+                if os.path.exists(done):
+                    os.remove(done)
+
+    metrics = Metrics()
+    for rcd in extractions.values():
+        metrics.merge(rcd.metrics)
+    metrics.started_at = min(rcd.metrics.started_at for rcd in extractions.values())
+    metrics.finish(total)
+    if metrics_file:
+        metrics.write_json(metrics_file)
+    if prometheus_file:
+        metrics.write_prometheus(prometheus_file)
+    if not silence:
+        print(metrics.report())
+    return rows
+
+
+def merge_sites(
+        files: Dict[str, str],
+        filename: str,
+        limit: Optional[int] = None,
+        output_format: str = "csv",
+) -> int:
+    """Merge csv site files into filename with a site column, renumbering the rows."""
+    idx = 0
+    with make_sink(output_format, filename, SiteRecord.columns) as sink:
+        for site, site_file in files.items():
+            for record in read_records(site_file, SiteRecord, site=site):
+                if limit and idx == limit:
+                    break
+                idx += 1
+                record.row = idx
+                sink.write(record)
+    return idx
@@ -0,0 +1,70 @@
+"""Subscription index."""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, List, Union
+
+
+class SubscriptionIndex:
+    """Subscription fields of every account, keyed by account id."""
+
+    def __init__(self, spill: bool = False):
+        self.spill = spill
+        self.__lock = threading.Lock()
+        self.__index: Dict[str, List[Dict[str, Union[str, int]]]] = {}
+        self.__conn = None
+        self.__path = None
+        if spill:
+            handle, self.__path = tempfile.mkstemp(suffix=".sqlite3")
+            os.close(handle)
+            self.__conn = sqlite3.connect(self.__path, check_same_thread=False)
+            self.__conn.execute("PRAGMA journal_mode=OFF")
+            self.__conn.execute("PRAGMA synchronous=OFF")
+            self.__conn.execute(
+                "CREATE TABLE subscriptions (account_id TEXT, fields TEXT)"
+            )
+
+    def add(self, account_id: str, fields: Dict[str, Union[str, int]]):
+        """Add the fields of one subscription to an account."""
+        with self.__lock:
+            if self.__conn:
+                self.__conn.execute(
+                    "INSERT INTO subscriptions VALUES (?, ?)",
+                    (account_id, json.dumps(fields))
+                )
+            else:
+                self.__index.setdefault(account_id, []).append(fields)
+
+    def finish(self):
+        """Index the spilled subscriptions once they are all added."""
+        if self.__conn:
+            with self.__lock:
+                self.__conn.execute(
+                    "CREATE INDEX subscriptions_account_id "
+                    "ON subscriptions (account_id)"
+                )
+                self.__conn.commit()
+
+    def get(self, account_id: str) -> List[Dict[str, Union[str, int]]]:
+        """Get the subscription fields of an account, in listing order."""
+        with self.__lock:
+            if self.__conn:
+                return [
+                    json.loads(fields) for (fields,) in self.__conn.execute(
+                        "SELECT fields FROM subscriptions "
+                        "WHERE account_id = ? ORDER BY rowid",
+                        (account_id,)
+                    )
+                ]
+            return self.__index.get(account_id, [])
+
+    def close(self):
+        """Drop the index and remove its spill file."""
+        with self.__lock:
+            self.__index = {}
+            if self.__conn:
+                self.__conn.close()
+                self.__conn = None
+                os.remove(self.__path)
@@ -0,0 +1,463 @@
+"""Local stand-in for the Recurly v2/v3 and Stripe apis."""
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+DT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+EPOCH = datetime(2019, 1, 1, tzinfo=timezone.utc)
+
+PLANS = [
+    {"object": "plan", "id": "plan1", "code": "monthly", "name": "Monthly Plan",
+     "currencies": [{"currency": "USD", "unit_amount": 5.99}]},
+    {"object": "plan", "id": "plan2", "code": "annual", "name": "Annual Plan",
+     "currencies": [{"currency": "USD", "unit_amount": 59.99}]},
+]
+
+COUPONS = [
+    {"object": "coupon", "id": "coupon1", "code": "TENOFF", "name": "10% off",
+     "discount": {"type": "percent", "percent": 10}},
+    {"object": "coupon", "id": "coupon2", "code": "ONEOFF", "name": "$1 off",
+     "discount": {"type": "fixed",
+                  "currencies": [{"currency": "USD", "amount": 1.0}]}},
+]
+
+
+# Recurly error types of the statuses failures are scheduled with.
+ERROR_TYPES = {
+    401: "unauthorized",
+    403: "forbidden",
+    404: "not_found",
+    429: "rate_limited",
+}
+
+
+def parse_time(value: str) -> datetime:
+    """Parse an ISO 8601 query parameter."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def plan_mini(plan: Dict) -> Dict:
+    return {
+        "object": "plan_mini", "id": plan["id"], "code": plan["code"],
+        "name": plan["name"],
+    }
+
+
+class FakeApi:
+    """Fake recurly and stripe http server."""
+
+    max_page_size = 200
+    default_page_size = 20
+    max_stripe_page_size = 100
+
+    def __init__(
+            self,
+            accounts: int = 100,
+            seed: int = 0,
+            latency: float = 0.0,
+            rate_limit: int = 2000,
+            rate_limit_window: int = 300,
+            enforce_rate_limit: bool = False,
+            stripe_ratio: float = 0.8,
+            redemption_ratio: float = 0.3,
+            pending_change_ratio: float = 0.1,
+    ):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.enforce_rate_limit = enforce_rate_limit
+        self.requests: Counter = Counter()
+        self.failures: Dict = {}
+        self.retry_after: Optional[int] = None
+        self.__lock = threading.Lock()
+        self.__window_started = time.time()
+        self.__window_requests = 0
+        self.__server: Optional[ThreadingHTTPServer] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.generate(accounts, seed, stripe_ratio, redemption_ratio, pending_change_ratio)
+
+    # pylint: disable=too-many-locals
+    def generate(
+            self,
+            accounts: int,
+            seed: int,
+            stripe_ratio: float,
+            redemption_ratio: float,
+            pending_change_ratio: float,
+    ):
+        """Generate the synthetic data set."""
+        rnd = random.Random(seed)
+        self.accounts: List[Dict] = []
+        self.subscriptions: Dict[str, List[Dict]] = {}
+        self.redemptions: Dict[str, List[Dict]] = {}
+        self.customers: List[Dict] = []
+        created_at = EPOCH
+        for idx in range(accounts):
+            # A few accounts share a creation second, like real signups do.
+            created_at += timedelta(seconds=rnd.choice([0, 1, 60, 3600]))
+            updated_at = created_at + timedelta(days=rnd.randint(0, 365))
+            account_id = f"acct{idx:07d}"
+            email = f"customer{idx}@example.com"
+            account = {
+                "object": "account", "id": account_id, "code": account_id,
+                "email": email, "first_name": f"First{idx}",
+                "last_name": f"Last{idx}" if rnd.random() < 0.9 else None,
+                "state": "active",
+                "created_at": created_at.strftime(DT_FORMAT),
+                "updated_at": updated_at.strftime(DT_FORMAT),
+            }
+            self.accounts.append(account)
+
+            plan = rnd.choice(PLANS)
+            canceled = rnd.random() < 0.1
+            subscription = {
+                "object": "subscription", "id": f"sub{idx:07d}",
+                "account": {"object": "account_mini", "id": account_id,
+                            "email": email},
+                "plan": plan_mini(plan),
+                "state": "canceled" if canceled else "active",
+                "unit_amount": plan["currencies"][0]["unit_amount"],
+                "created_at": created_at.strftime(DT_FORMAT),
+                "current_term_ends_at": (
+                    created_at + timedelta(days=400)
+                ).strftime(DT_FORMAT),
+                "canceled_at": (
+                    updated_at.strftime(DT_FORMAT) if canceled else None
+                ),
+                "pending_change": None,
+            }
+            if rnd.random() < pending_change_ratio:
+                new_plan = PLANS[1] if plan is PLANS[0] else PLANS[0]
+                subscription["pending_change"] = {
+                    "object": "subscription_change", "id": f"chg{idx:07d}",
+                    "plan": plan_mini(new_plan),
+                    "unit_amount": new_plan["currencies"][0]["unit_amount"],
+                    "activate_at": subscription["current_term_ends_at"],
+                    "activated": False,
+                }
+            self.subscriptions[account_id] = [subscription]
+            account["has_active_subscription"] = not canceled
+            account["has_canceled_subscription"] = canceled
+            account["has_future_subscription"] = False
+
+            self.redemptions[account_id] = []
+            if rnd.random() < redemption_ratio:
+                self.redemptions[account_id].append({
+                    "object": "coupon_redemption", "id": f"red{idx:07d}",
+                    "account": {"object": "account_mini", "id": account_id},
+                    "state": "active",
+                    "coupon": rnd.choice(COUPONS),
+                    "created_at": created_at.strftime(DT_FORMAT),
+                })
+
+            if rnd.random() < stripe_ratio:
+                self.customers.append({
+                    "object": "customer", "id": f"cus_{idx:07d}",
+                    "email": email, "created": int(created_at.timestamp()),
+                })
+        # Stripe lists customers newest first.
+        self.customers.reverse()
+        self.customers_by_email = {
+            customer["email"]: customer for customer in self.customers
+        }
+
+    @property
+    def url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api(self) -> str:
+        """Base url of the recurly v2 api."""
+        return f"{self.url}/v2"
+
+    @property
+    def v3_api(self) -> str:
+        """Base url of the recurly v3 api."""
+        return self.url
+
+    @property
+    def stripe_api(self) -> str:
+        """Base url of the stripe api."""
+        return f"{self.url}/stripe/v1"
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    def start(self) -> "FakeApi":
+        """Start serving on a free local port."""
+        handler = type("Handler", (FakeApiHandler,), {"fake": self})
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, daemon=True
+        )
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self.__server:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def rate_limit_headers(self) -> Dict[str, str]:
+        """Count a recurly request and return its rate limit headers."""
+        with self.__lock:
+            now = time.time()
+            if now - self.__window_started >= self.rate_limit_window:
+                self.__window_started = now
+                self.__window_requests = 0
+            self.__window_requests += 1
+            remaining = self.rate_limit - self.__window_requests
+            reset = int(self.__window_started + self.rate_limit_window)
+        return {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(max(remaining, 0)),
+            "X-RateLimit-Reset": str(reset),
+            "_exceeded": "1" if remaining < 0 else "",
+        }
+
+    def count(self, endpoint: str) -> Optional[int]:
+        """Count a request and pop the failure scheduled for it, if any."""
+        with self.__lock:
+            self.requests[endpoint] += 1
+            return self.failures.pop((endpoint, self.requests[endpoint]), 0)
+
+    def fail(
+            self,
+            endpoint: str,
+            *statuses: Optional[int],
+            after: int = 0,
+            retry_after: Optional[int] = None,
+    ):
+        """Fail the next requests to an endpoint, None dropping the connection."""
+        with self.__lock:
+            first = self.requests[endpoint] + after + 1
+            for idx, status in enumerate(statuses):
+                self.failures[(endpoint, first + idx)] = status
+            self.retry_after = retry_after
+
+    def lapse(self, account: Dict, updated_at: datetime):
+        """Expire the subscriptions of an account."""
+        for subscription in self.subscriptions[account["id"]]:
+            subscription["state"] = "expired"
+        account["has_active_subscription"] = False
+        account["has_canceled_subscription"] = False
+        account["updated_at"] = updated_at.strftime(DT_FORMAT)
+
+    def filter_accounts(self, params: Dict[str, str]) -> List[Dict]:
+        """Accounts matching the v2/v3 listing filters, in listing order."""
+        sort = params.get("sort", "created_at")
+        begin = parse_time(params["begin_time"]) if "begin_time" in params else None
+        end = parse_time(params["end_time"]) if "end_time" in params else None
+        subscriber = params.get("subscriber") == "true" or params.get("state") == "subscriber"
+        accounts = []
+        for account in self.accounts:
+            if subscriber and not (
+                    account["has_active_subscription"] or
+                    account["has_canceled_subscription"] or
+                    account["has_future_subscription"]
+            ):
+                continue
+            when = parse_time(account[sort])
+            if begin and when < begin:
+                continue
+            if end and when > end:
+                continue
+            accounts.append(account)
+        accounts.sort(key=lambda account: (account[sort], account["id"]))
+        if params.get("order", "desc") == "desc":
+            accounts.reverse()
+        return accounts
+
+
+def filter_state(subscriptions: List[Dict], state: Optional[str]) -> List[Dict]:
+    if not state or state == "live":
+        return subscriptions
+    return [sub for sub in subscriptions if sub["state"] == state]
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """Request handler of FakeApi."""
+
+    fake: FakeApi
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, which Nagle's algorithm
+    # would otherwise hold back for a delayed ack on kept alive connections.
+    disable_nagle_algorithm = True
+
+    # pylint: disable=invalid-name
+    def do_HEAD(self):
+        self.route(head=True)
+
+    def do_GET(self):
+        self.route(head=False)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def send(
+            self,
+            status: int,
+            body: Optional[Dict] = None,
+            headers: Optional[Dict[str, str]] = None,
+            head: bool = False,
+    ):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", "0" if head else str(len(payload)))
+        self.send_header("X-Request-Id", "fake")
+        for key, value in (headers or {}).items():
+            if not key.startswith("_"):
+                self.send_header(key, value)
+        self.end_headers()
+        if not head:
+            self.wfile.write(payload)
+
+    def hit(self, endpoint: str, head: bool) -> bool:
+        """Count a request to an endpoint, failing it if scheduled to."""
+        status = self.fake.count(endpoint)
+        if status == 0:
+            return False
+        if status is None:
+            self.close_connection = True
+            return True
+        headers = {}
+        if self.fake.retry_after is not None:
+            headers["Retry-After"] = str(self.fake.retry_after)
+        self.send(status, {"error": {
+            "type": "service_unavailable" if status >= 500 else ERROR_TYPES[status],
+            "message": "Fake failure",
+        }}, headers, head)
+        return True
+
+    def route(self, head: bool):
+        fake = self.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+
+        if parts[:2] == ["stripe", "v1"]:
+            if self.hit("stripe_customers", head):
+                return None
+            return self.send(200, self.stripe_customers(params))
+
+        limits = fake.rate_limit_headers()
+        if fake.enforce_rate_limit and limits["_exceeded"]:
+            fake.count("rate_limited")
+            return self.send(429, {"error": {
+                "type": "rate_limited", "message": "Rate limit exceeded",
+            }}, limits, head)
+
+        if parts[:1] == ["v2"]:
+            if self.hit("headers", head):
+                return None
+            state = params.get("state")
+            accounts = fake.filter_accounts(params) if state in (
+                None, "subscriber", "active"
+            ) else []
+            limits["X-Records"] = str(len(accounts))
+            return self.send(200, None, limits, head=True)
+
+        if parts == ["accounts"]:
+            if self.hit("accounts", head):
+                return None
+            return self.send_page("/accounts", params, fake.filter_accounts(params), limits)
+        if len(parts) == 3 and parts[0] == "accounts" and parts[2] == "subscriptions":
+            if self.hit("subscriptions", head):
+                return None
+            subscriptions = filter_state(
+                fake.subscriptions.get(parts[1], []), params.get("state")
+            )
+            return self.send_page(self.path.split("?")[0], params, subscriptions, limits)
+        if len(parts) == 3 and parts[0] == "accounts" and parts[2] == "coupon_redemptions":
+            if self.hit("redemptions", head):
+                return None
+            redemptions = fake.redemptions.get(parts[1], [])
+            return self.send_page(self.path.split("?")[0], params, redemptions, limits)
+        if parts == ["subscriptions"]:
+            if self.hit("site_subscriptions", head):
+                return None
+            subscriptions = [
+                subscription
+                for account in fake.accounts
+                for subscription in filter_state(
+                    fake.subscriptions[account["id"]], params.get("state")
+                )
+            ]
+            return self.send_page("/subscriptions", params, subscriptions, limits)
+        if parts == ["plans"]:
+            if self.hit("plans", head):
+                return None
+            return self.send_page("/plans", params, PLANS, limits)
+        if parts == ["coupons"]:
+            if self.hit("coupons", head):
+                return None
+            return self.send_page("/coupons", params, COUPONS, limits)
+
+        fake.count("not_found")
+        return self.send(404, {"error": {
+            "type": "not_found", "message": f"Couldn't find {url.path}",
+        }}, limits, head)
+
+    def send_page(
+            self,
+            path: str,
+            params: Dict[str, str],
+            items: List[Dict],
+            limits: Dict[str, str],
+    ):
+        """Send a v3 list page with the total count of its items."""
+        headers = dict(limits, **{"Recurly-Total-Records": str(len(items))})
+        return self.send(200, self.page(path, params, items), headers)
+
+    @staticmethod
+    def page(path: str, params: Dict[str, str], items: List[Dict]) -> Dict:
+        """A v3 list page with cursor pagination."""
+        limit = min(int(params.get("limit", FakeApi.default_page_size)), FakeApi.max_page_size)
+        offset = int(params.get("cursor", 0))
+        data = items[offset:offset + limit]
+        has_more = offset + limit < len(items)
+        next_url = None
+        if has_more:
+            next_params = dict(params, cursor=offset + limit)
+            next_url = f"{path}?{urlencode(next_params)}"
+        return {"object": "list", "has_more": has_more, "next": next_url, "data": data}
+
+    def stripe_customers(self, params: Dict[str, str]) -> Dict:
+        """A stripe customers list page."""
+        fake = self.fake
+        if "email" in params:
+            customer = fake.customers_by_email.get(params["email"])
+            return {"object": "list", "has_more": False,
+                    "data": [customer] if customer else []}
+
+        limit = min(int(params.get("limit", 10)), FakeApi.max_stripe_page_size)
+        offset = 0
+        if "starting_after" in params:
+            ids = [customer["id"] for customer in fake.customers]
+            offset = ids.index(params["starting_after"]) + 1
+        data = fake.customers[offset:offset + limit]
+        return {"object": "list", "data": data,
+                "has_more": offset + limit < len(fake.customers)}
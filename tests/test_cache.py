@@ -0,0 +1,111 @@
+import time
+
+from recurly_data.cache import AccountCache, StripeCache
+
+
+def test_stripe_cache_hits_and_misses(tmp_path):
+    cache = StripeCache(path=str(tmp_path / "cache.sqlite3"))
+    assert cache.get("a@example.com") is None
+    cache.set("a@example.com", "cus_a")
+    cache.set("b@example.com", "")
+    assert cache.get("a@example.com") == "cus_a"
+    assert cache.get("b@example.com") == ""
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.close()
+
+    cache = StripeCache(path=str(tmp_path / "cache.sqlite3"))
+    assert cache.get("a@example.com") == "cus_a"
+    cache.close()
+
+
+def test_stripe_cache_expiry(tmp_path):
+    cache = StripeCache(
+        path=str(tmp_path / "cache.sqlite3"), ttl=60, negative_ttl=0
+    )
+    cache.set("a@example.com", "cus_a")
+    cache.set("b@example.com", "")
+    assert cache.get("a@example.com") == "cus_a"
+    assert cache.get("b@example.com") is None
+    cache.close()
+
+
+def test_stripe_cache_evicts_least_recently_used(tmp_path):
+    cache = StripeCache(path=str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.set("a@example.com", "cus_a")
+    cache.set("b@example.com", "cus_b")
+    cache.get("a@example.com")
+    cache.set("c@example.com", "cus_c")
+    assert len(cache) == 2
+    assert cache.get("b@example.com") is None
+    assert cache.get("a@example.com") == "cus_a"
+    cache.close()
+
+
+def test_account_cache_checks_updated_at_and_state(tmp_path):
+    cache = AccountCache(path=str(tmp_path / "accounts.sqlite3"))
+    fields = {"subscriptions": {"pricing_amount": 599}, "redemptions": {}}
+    cache.set("acct1", "2020-01-01", "live", fields)
+    assert cache.get("acct1", "2020-01-01", "live") == fields
+    assert cache.get("acct1", "2020-01-02", "live") is None
+    assert cache.get("acct1", "2020-01-01", "active") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+    cache = AccountCache(path=str(tmp_path / "accounts.sqlite3"))
+    assert cache.get("acct1", "2020-01-01", "live") == fields
+    cache.close()
+
+
+def test_account_cache_expires_and_compacts(tmp_path):
+    cache = AccountCache(path=str(tmp_path / "accounts.sqlite3"), max_entries=2)
+    cache.set("acct1", "u", "live", {}, expires_at=time.time() - 1)
+    cache.set("acct2", "u", "live", {})
+    cache.set("acct3", "u", "live", {})
+    assert cache.get("acct1", "u", "live") is None
+    assert len(cache) == 2
+
+    assert cache.compact() == 0
+    cache.set("acct4", "u", "live", {}, expires_at=time.time() - 1)
+    assert cache.compact() == 1
+    assert len(cache) == 1
+    assert cache.get("acct2", "u", "live") is None
+    assert cache.get("acct3", "u", "live") == {}
+    cache.close()
+
+
+def test_caches_sharing_a_file_count_each_others_entries(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = StripeCache(path=path, max_entries=3)
+    second = StripeCache(path=path, max_entries=3)
+    first.set("a@example.com", "cus_a")
+    second.set("b@example.com", "cus_b")
+    first.set("c@example.com", "cus_c")
+    second.set("d@example.com", "cus_d")
+    assert len(first) == len(second) == 3
+    assert first.get("a@example.com") is None
+    first.close()
+    second.close()
+
+
+def test_shared_account_cache_is_not_compacted_on_close(tmp_path):
+    path = str(tmp_path / "accounts.sqlite3")
+    cache = AccountCache(path=path, compact_on_close=False)
+    cache.set("acct1", "u", "live", {}, expires_at=time.time() - 1)
+    cache.close()
+
+    cache = AccountCache(path=path)
+    assert len(cache) == 1
+    cache.close()
+    cache = AccountCache(path=path)
+    assert len(cache) == 0
+    cache.close()
+
+
+def test_cache_report(tmp_path):
+    cache = StripeCache(path=str(tmp_path / "stripe.sqlite3"))
+    cache.set("a@example.com", "cus_1")
+    cache.get("a@example.com")
+    cache.get("b@example.com")
+    assert "Stripe cache" in cache.report()
+    assert "1 hits" in cache.report() and "1 misses" in cache.report()
+    cache.close()
@@ -0,0 +1,562 @@
+import csv
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import pstats
+
+import pytest
+import recurly
+
+from recurly_data.__main__ import main
+from recurly_data.cache import AccountCache, StripeCache
+from recurly_data.planner import plan_extraction
+from recurly_data.recurly_data import RecurlyData
+from recurly_data.shards import extract_sharded, shard_windows
+from recurly_data.sites import extract_sites
+from tests.fake_api import DT_FORMAT, FakeApi
+
+
+@pytest.fixture(scope="module")
+def fake():
+    # A generous rate limit, so the client's pacing doesn't slow the tests.
+    with FakeApi(accounts=60, seed=1, rate_limit=10 ** 6) as fake_api:
+        yield fake_api
+
+
+def extract(fake, filename, **options):
+    # Small pages, so 60 accounts span a few of them.
+    options.setdefault("page_size", 20)
+    rcd = RecurlyData(
+        api=fake.api,
+        v3_api=fake.v3_api,
+        stripe_api=fake.stripe_api,
+        api_key="test",
+        stripe_key="test",
+        filename=str(filename),
+        silence=True,
+        progress="none",
+        **options,
+    )
+    rcd.make_csv()
+    with open(filename, newline="") as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def extract_shards(fake, filename, shards, **options):
+    total = extract_sharded(
+        shards,
+        api=fake.api,
+        v3_api=fake.v3_api,
+        stripe_api=fake.stripe_api,
+        api_key="test",
+        stripe_key="test",
+        filename=str(filename),
+        silence=True,
+        page_size=20,
+        **options,
+    )
+    with open(filename, newline="") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert len(rows) == total
+    return rows
+
+
+def test_extracts_every_account(fake, tmp_path):
+    rows = extract(fake, tmp_path / "out.csv")
+
+    assert len(rows) == len(fake.accounts)
+    assert [row["row"] for row in rows] == [str(idx) for idx in range(1, 61)]
+    assert rows[0]["email"] == fake.accounts[0]["email"]
+    stripe_ids = {row["email"]: row["stripe_id"] for row in rows}
+    for email, customer in fake.customers_by_email.items():
+        assert stripe_ids[email] == customer["id"]
+
+
+@pytest.mark.parametrize("options", [
+    {"workers": 4},
+    {"subscription_join": True},
+    {"stripe_prefetch": True},
+    {"order": "desc", "workers": 2},
+    {"prefetch_pages": 0},
+    {"page_size": 7, "prefetch_pages": 1, "workers": 3},
+])
+def test_options_produce_the_same_rows(fake, tmp_path, options):
+    expected = extract(fake, tmp_path / "expected.csv")
+    rows = extract(fake, tmp_path / "out.csv", **options)
+
+    if options.get("order") == "desc":
+        rows = sorted(rows, key=lambda row: row["email"])
+        expected = sorted(expected, key=lambda row: row["email"])
+        for row in rows + expected:
+            row.pop("row")
+    assert rows == expected
+
+
+def test_prices_and_frequencies_come_from_the_catalog(fake, tmp_path):
+    plans, coupons = fake.requests["plans"], fake.requests["coupons"]
+    rows = {row["email"]: row for row in extract(fake, tmp_path / "out.csv", workers=3)}
+
+    assert fake.requests["plans"] - plans == 1
+    assert fake.requests["coupons"] - coupons == 1
+    for account in fake.accounts:
+        row = rows[account["email"]]
+        subscription = fake.subscriptions[account["id"]][0]
+        price = int(subscription["unit_amount"] * 100)
+        assert row["frequency"] == subscription["plan"]["name"].split(" ")[0].replace(
+            "Annual", "Yearly"
+        )
+        redemptions = fake.redemptions[account["id"]]
+        if not redemptions:
+            assert row["discounted_pricing_amount"] == ""
+            continue
+        discount = redemptions[0]["coupon"]["discount"]
+        if discount["type"] == "percent":
+            expected = int(price - price * discount["percent"] / 100)
+        else:
+            expected = int(price - discount["currencies"][0]["amount"] * 100)
+        assert row["active_promo_code"] == redemptions[0]["coupon"]["code"]
+        assert row["discounted_pricing_amount"] == str(expected)
+
+
+def test_falls_back_on_embedded_plans_without_the_catalog(fake, tmp_path):
+    expected = extract(fake, tmp_path / "full.csv")
+    fake.fail("plans", 403)
+    fake.fail("coupons", 403)
+
+    assert extract(fake, tmp_path / "out.csv") == expected
+
+
+def test_sync_upserts_changed_accounts_and_drops_lapsed_ones(tmp_path):
+    with FakeApi(accounts=30, seed=4, rate_limit=10 ** 6) as fake_api:
+        filename = tmp_path / "sync.csv"
+        extract(fake_api, filename, since_last_run=True)
+
+        later = datetime.now(timezone.utc) + timedelta(minutes=1)
+        changed, lapsed = fake_api.accounts[5], fake_api.accounts[10]
+        changed["first_name"] = "Changed"
+        changed["updated_at"] = later.strftime(DT_FORMAT)
+        fake_api.lapse(lapsed, later)
+        subscriptions = fake_api.requests["subscriptions"]
+        synced = extract(fake_api, filename, since_last_run=True)
+
+        # Only the changed account is listed and enriched again.
+        assert fake_api.requests["subscriptions"] - subscriptions == 1
+        full = extract(fake_api, tmp_path / "full.csv")
+        assert len(full) == len(fake_api.accounts) - 1
+        assert {row.pop("email"): dict(row, row=None) for row in synced} == {
+            row.pop("email"): dict(row, row=None) for row in full
+        }
+
+
+def test_total_accounts_come_from_the_accounts_count(fake, tmp_path):
+    rcd = RecurlyData(
+        api=fake.api,
+        v3_api=fake.v3_api,
+        stripe_api=fake.stripe_api,
+        api_key="test",
+        stripe_key="test",
+        filename=str(tmp_path / "out.csv"),
+        silence=True,
+        progress="none",
+        page_size=20,
+    )
+    rcd.make_csv()
+
+    # Subscription and redemption listings count other things.
+    assert rcd.api_total_accounts == len(fake.accounts)
+
+
+def test_empty_stripe_cache_is_filled(fake, tmp_path):
+    cache_file = str(tmp_path / "stripe.sqlite3")
+    first = extract(fake, tmp_path / "first.csv", stripe_cache=StripeCache(cache_file))
+
+    cache = StripeCache(cache_file)
+    assert cache
+    assert len(cache) == len(fake.accounts)
+    cache.close()
+
+    stripe_requests = fake.requests["stripe_customers"]
+    second = extract(fake, tmp_path / "second.csv", stripe_cache=StripeCache(cache_file))
+    assert fake.requests["stripe_customers"] == stripe_requests
+    assert [row["stripe_id"] for row in second] == [row["stripe_id"] for row in first]
+
+
+def test_shard_windows_split_the_accounts_evenly(fake, tmp_path):
+    rcd = RecurlyData(
+        api=fake.api,
+        v3_api=fake.v3_api,
+        stripe_api=fake.stripe_api,
+        api_key="test",
+        stripe_key="test",
+        filename=str(tmp_path / "out.csv"),
+        silence=True,
+    )
+    windows = shard_windows(rcd, 3)
+
+    assert len(windows) == 3
+    assert windows[0][0].isoformat() == fake.accounts[0]["created_at"].replace(
+        "Z", "+00:00"
+    )
+    assert windows[-1][1] is None
+    for (_, end), (begin, _) in zip(windows, windows[1:]):
+        assert (begin - end).total_seconds() == 1
+    counts = [
+        rcd.count_accounts(begin.isoformat(), end.isoformat() if end else None)
+        for begin, end in windows
+    ]
+    assert sum(counts) == len(fake.accounts)
+    assert max(counts) - min(counts) <= 4
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_shards_are_merged_in_order(fake, tmp_path, order):
+    expected = extract(fake, tmp_path / "expected.csv", order=order)
+    rows = extract_shards(fake, tmp_path / "out.csv", 3, order=order, workers=2)
+
+    assert [row["row"] for row in rows] == [str(idx) for idx in range(1, 61)]
+    assert rows == expected
+    assert not [name for name in os.listdir(tmp_path) if ".shard" in name]
+
+
+def test_shards_write_the_same_jsonl_as_a_single_run(fake, tmp_path):
+    rcd = RecurlyData(
+        api=fake.api,
+        v3_api=fake.v3_api,
+        stripe_api=fake.stripe_api,
+        api_key="test",
+        stripe_key="test",
+        filename=str(tmp_path / "expected.jsonl"),
+        silence=True,
+        output_format="jsonl",
+    )
+    rcd.make_csv()
+    extract_sharded(
+        2,
+        api=fake.api,
+        v3_api=fake.v3_api,
+        stripe_api=fake.stripe_api,
+        api_key="test",
+        stripe_key="test",
+        filename=str(tmp_path / "out.jsonl"),
+        silence=True,
+        output_format="jsonl",
+    )
+
+    with open(tmp_path / "expected.jsonl") as expected, open(tmp_path / "out.jsonl") as out:
+        rows = [json.loads(line) for line in out]
+        assert rows == [json.loads(line) for line in expected]
+    assert isinstance(rows[0]["row"], int)
+    assert isinstance(rows[0]["pricing_amount"], int)
+
+
+def test_shards_share_the_caches(tmp_path):
+    # Slow enough responses that the shards write to the caches at once.
+    with FakeApi(accounts=90, seed=3, latency=0.01, rate_limit=10 ** 6) as fake_api:
+        cache_options = {
+            "stripe_cache_options": {
+                "path": str(tmp_path / "stripe.sqlite3"), "busy_timeout": 1.0
+            },
+            "account_cache_options": {
+                "path": str(tmp_path / "accounts.sqlite3"), "busy_timeout": 1.0
+            },
+        }
+        expected = extract_shards(
+            fake_api, tmp_path / "first.csv", 3, workers=2, **cache_options
+        )
+        subscriptions = fake_api.requests["subscriptions"]
+        rows = extract_shards(
+            fake_api, tmp_path / "second.csv", 3, workers=2, **cache_options
+        )
+
+    assert len(expected) == len(fake_api.accounts)
+    assert rows == expected
+    assert fake_api.requests["subscriptions"] == subscriptions
+    for cache_class, options in (
+            (StripeCache, cache_options["stripe_cache_options"]),
+            (AccountCache, cache_options["account_cache_options"]),
+    ):
+        cache = cache_class(options["path"])
+        assert len(cache) == len(fake_api.accounts)
+        cache.close()
+
+
+@pytest.mark.parametrize("options", [{}, {"subscription_join": True}])
+def test_account_cache_skips_unchanged_accounts(tmp_path, options):
+    with FakeApi(accounts=30, seed=2, rate_limit=10 ** 6) as fake_api:
+        cache_file = str(tmp_path / "accounts.sqlite3")
+        expected = extract(
+            fake_api, tmp_path / "first.csv",
+            account_cache=AccountCache(cache_file), **options
+        )
+        fake_api.accounts[3]["updated_at"] = "2030-01-01T00:00:00Z"
+        fake_api.subscriptions[fake_api.accounts[3]["id"]][0]["unit_amount"] = 1.0
+        subscriptions = fake_api.requests["subscriptions"]
+        redemptions = fake_api.requests["redemptions"]
+
+        rows = extract(
+            fake_api, tmp_path / "second.csv",
+            account_cache=AccountCache(cache_file), **options
+        )
+
+        assert fake_api.requests["redemptions"] - redemptions == 1
+        if not options:
+            assert fake_api.requests["subscriptions"] - subscriptions == 1
+        assert rows[3]["pricing_amount"] == "100"
+        assert rows[:3] + rows[4:] == expected[:3] + expected[4:]
+
+
+def test_limit_stops_early(fake, tmp_path):
+    rows = extract(fake, tmp_path / "out.csv", limit=7, workers=3)
+
+    assert [row["email"] for row in rows] == [
+        account["email"] for account in fake.accounts[:7]
+    ]
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_resumes_from_the_checkpoint(fake, tmp_path, order):
+    expected = extract(fake, tmp_path / "expected.csv", order=order)
+    filename = tmp_path / "out.csv"
+    # The interrupted run is in the given order, the resumed run picks it
+    # up from the checkpoint.
+    extract(fake, filename, order=order, limit=25, checkpoint_every=10)
+    rows = extract(fake, filename, resume=True)
+
+    assert [row["row"] for row in rows] == [str(idx) for idx in range(1, 61)]
+    assert [row["email"] for row in rows] == [row["email"] for row in expected]
+
+
+def test_resumes_from_the_last_row_without_a_checkpoint(fake, tmp_path):
+    expected = extract(fake, tmp_path / "expected.csv")
+    filename = tmp_path / "out.csv"
+    first = extract(fake, filename, limit=25)
+    os.remove(f"{filename}.pickle")
+    rows = extract(fake, filename, resume=True)
+
+    # Only the last row is known to be on the boundary, accounts created in
+    # the same second before it are extracted again.
+    repeated = [
+        row["email"] for row in first[:-1]
+        if row["created_at"] == first[-1]["created_at"]
+    ]
+    assert [row["row"] for row in rows] == [
+        str(idx) for idx in range(1, 61 + len(repeated))
+    ]
+    assert [row["email"] for row in rows] == (
+        [row["email"] for row in expected[:25]] + repeated +
+        [row["email"] for row in expected[25:]]
+    )
+
+
+def test_writes_metrics_summary(fake, tmp_path):
+    metrics_file = tmp_path / "out.csv.metrics.json"
+    extract(
+        fake,
+        tmp_path / "out.csv",
+        metrics_file=str(metrics_file),
+        prometheus_file=str(tmp_path / "out.prom"),
+    )
+
+    with open(metrics_file) as json_file:
+        summary = json.load(json_file)
+    assert summary["rows"] == len(fake.accounts)
+    endpoints = summary["endpoints"]
+    assert endpoints["headers"]["requests"] == 1
+    assert endpoints["subscriptions"]["requests"] == len(fake.accounts)
+    assert endpoints["redemptions"]["requests"] == len(fake.accounts)
+    assert endpoints["stripe_customers"]["requests"] == len(fake.accounts)
+    assert endpoints["accounts"]["statuses"] == {"200": 3}
+    assert (tmp_path / "out.prom").exists()
+
+
+def test_retries_failed_pages_from_their_cursor(fake, tmp_path):
+    expected = extract(fake, tmp_path / "expected.csv")
+    # The second accounts page fails twice, one subscriptions listing
+    # loses its connection and a stripe lookup is rate limited.
+    fake.fail("accounts", 503, 503, after=1)
+    fake.fail("subscriptions", None, after=5)
+    fake.fail("stripe_customers", 429, after=3)
+    metrics_file = tmp_path / "metrics.json"
+    rows = extract(
+        fake,
+        tmp_path / "out.csv",
+        retry_backoff=0.01,
+        metrics_file=str(metrics_file),
+    )
+
+    assert rows == expected
+    with open(metrics_file) as json_file:
+        endpoints = json.load(json_file)["endpoints"]
+    assert endpoints["accounts"]["retries"] == 2
+    assert endpoints["accounts"]["requests"] == 5
+    assert endpoints["subscriptions"]["network_errors"] == 1
+    assert endpoints["stripe_customers"]["rate_limited"] == 1
+
+
+def test_gives_up_after_retries(fake, tmp_path):
+    fake.fail("accounts", *[503] * 3)
+    with pytest.raises(recurly.errors.ServiceUnavailableError):
+        extract(fake, tmp_path / "out.csv", retries=2, retry_backoff=0.01)
+
+
+def test_main_runs_an_extraction(fake, tmp_path):
+    filename = tmp_path / "out.csv"
+    exit_code = main([
+        "--quiet",
+        "--file", str(filename),
+        "--recurly-key", "test",
+        "--stripe-key", "test",
+        "--recurly-api", fake.api,
+        "--recurly-v3-api", fake.v3_api,
+        "--stripe-api", fake.stripe_api,
+        "--page-size", "25",
+    ])
+
+    assert exit_code == 0
+    with open(filename, newline="") as csv_file:
+        assert len(list(csv.DictReader(csv_file))) == len(fake.accounts)
+    assert (tmp_path / "out.csv.metrics.json").exists()
+
+
+def test_main_refuses_to_shard_a_sync(fake, tmp_path, capsys):
+    filename = tmp_path / "out.csv"
+    exit_code = main([
+        "--file", str(filename),
+        "--recurly-key", "test",
+        "--recurly-api", fake.api,
+        "--since-last-run",
+        "--shards", "3",
+    ])
+
+    assert exit_code == 1
+    assert "--since-last-run" in capsys.readouterr().out
+    assert not filename.exists()
+
+
+def test_main_refuses_to_shard_a_resumed_run(fake, tmp_path, capsys):
+    filename = tmp_path / "out.csv"
+    exit_code = main([
+        "--file", str(filename),
+        "--recurly-key", "test",
+        "--recurly-api", fake.api,
+        "--resume",
+        "--shards", "3",
+    ])
+
+    assert exit_code == 1
+    assert "--resume" in capsys.readouterr().out
+    assert not filename.exists()
+    with pytest.raises(Exception, match="cannot be resumed"):
+        extract_sharded(3, filename=str(filename), api=fake.api, api_key="test", resume=True)
+
+
+def test_main_profiles_the_run(fake, tmp_path, capsys):
+    filename = tmp_path / "out.csv"
+    profile_file = tmp_path / "out.prof"
+    exit_code = main([
+        "--file", str(filename),
+        "--progress", "none",
+        "--recurly-key", "test",
+        "--stripe-key", "test",
+        "--recurly-api", fake.api,
+        "--recurly-v3-api", fake.v3_api,
+        "--stripe-api", fake.stripe_api,
+        "--profile-file", str(profile_file),
+    ])
+
+    assert exit_code == 0
+    report = capsys.readouterr().out
+    for stage in ("accounts", "account", "stripe", "subscriptions", "redemptions", "write"):
+        assert f"\n{stage} " in report
+    assert "Slowest accounts:" in report
+    stats = pstats.Stats(str(profile_file))
+    assert any(func[2] == "build_row" for func in stats.stats)
+
+
+def test_plan_estimates_requests_from_a_sample(fake, tmp_path):
+    rcd = RecurlyData(
+        api=fake.api,
+        v3_api=fake.v3_api,
+        stripe_api=fake.stripe_api,
+        api_key="test",
+        stripe_key="test",
+        filename=str(tmp_path / "out.csv"),
+        silence=True,
+        progress="none",
+    )
+    plan = plan_extraction(rcd, sample=5)
+
+    assert plan["accounts"] == len(fake.accounts)
+    assert plan["sampled"] == 5
+    assert plan["per_account"]["recurly_requests"] == 2.0
+    assert plan["per_account"]["stripe_requests"] == 1.0
+    # Headers, catalog, one page of accounts and two requests per account.
+    assert plan["current"]["recurly_requests"] == 3 + 1 + 2 * len(fake.accounts)
+    assert plan["current"]["shards"] == 1
+    # Every shard gets the headers and catalog and lists the subscriptions.
+    shards = plan["recommended"]["shards"]
+    assert plan["recommended"]["subscription_join"]
+    assert plan["recommended"]["recurly_requests"] == (
+        3 * shards + 1 + len(fake.accounts) + shards
+    )
+    assert not (tmp_path / "out.csv").exists()
+    assert shards > 1
+    assert plan_extraction(rcd, sample=5, resume=True)["recommended"]["shards"] == 1
+
+
+def test_main_auto_tunes_the_extraction(fake, tmp_path, capsys):
+    filename = tmp_path / "out.csv"
+    args = [
+        "--file", str(filename),
+        "--progress", "none",
+        "--recurly-key", "test",
+        "--stripe-key", "test",
+        "--recurly-api", fake.api,
+        "--recurly-v3-api", fake.v3_api,
+        "--stripe-api", fake.stripe_api,
+    ]
+
+    assert main(args + ["--plan"]) == 0
+    assert "recommended" in capsys.readouterr().out
+    assert not filename.exists()
+
+    assert main(args + ["--quiet", "--auto-tune", "--plan-sample", "3"]) == 0
+    with open(filename, newline="") as csv_file:
+        assert len(list(csv.DictReader(csv_file))) == len(fake.accounts)
+
+
+def test_extracts_several_sites_with_a_site_column(fake, tmp_path):
+    # Two sites on the same stand-in, told apart by the host of their url.
+    sites = [(fake.api, "first"), (fake.api.replace("127.0.0.1", "localhost"), "second")]
+    stripe_requests = fake.requests["stripe_customers"]
+    filename = tmp_path / "out.csv"
+    rows = extract_sites(
+        sites,
+        combined=True,
+        filename=str(filename),
+        v3_api=fake.v3_api,
+        stripe_api=fake.stripe_api,
+        api_key="test",
+        stripe_key="test",
+        stripe_prefetch=True,
+        silence=True,
+        page_size=20,
+        # Unset settings are read from the config, as RecurlyData does.
+        pool_size=None,
+        keep_alive=None,
+    )
+
+    assert rows == {"127": len(fake.accounts), "localhost": len(fake.accounts)}
+    with open(filename, newline="") as csv_file:
+        records = list(csv.DictReader(csv_file))
+    assert [record["site"] for record in records] == (
+        ["127"] * len(fake.accounts) + ["localhost"] * len(fake.accounts)
+    )
+    assert [record["row"] for record in records] == [
+        str(idx) for idx in range(1, 2 * len(fake.accounts) + 1)
+    ]
+    # The stripe index is loaded once and shared by both sites, only the
+    # emails missing from it are looked up by each site.
+    missing = len(fake.accounts) - len(fake.customers)
+    assert fake.requests["stripe_customers"] - stripe_requests == 1 + 2 * missing
+    assert sorted(os.listdir(tmp_path)) == ["out.csv"]
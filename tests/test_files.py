@@ -0,0 +1,28 @@
+import pytest
+
+from recurly_data.files import atomic_write
+
+
+def test_atomic_write_swaps_the_file_in(tmp_path):
+    filename = tmp_path / "out.txt"
+    filename.write_text("old")
+    with atomic_write(str(filename), fsync=True) as tmp_file:
+        with open(tmp_file, "w") as out_file:
+            out_file.write("new")
+        assert filename.read_text() == "old"
+
+    assert filename.read_text() == "new"
+    assert [path.name for path in tmp_path.iterdir()] == ["out.txt"]
+
+
+def test_atomic_write_keeps_the_old_file_on_failure(tmp_path):
+    filename = tmp_path / "out.txt"
+    filename.write_text("old")
+    with pytest.raises(ValueError):
+        with atomic_write(str(filename)) as tmp_file:
+            with open(tmp_file, "w") as out_file:
+                out_file.write("half")
+            raise ValueError
+
+    assert filename.read_text() == "old"
+    assert [path.name for path in tmp_path.iterdir()] == ["out.txt"]
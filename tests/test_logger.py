@@ -0,0 +1,60 @@
+import logging
+import queue
+import socket
+
+from recurly_data.logger import BatchQueueListener, DroppingQueueHandler, Logger
+
+
+class BatchRecorder(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def emit_batch(self, records):
+        self.batches.append([record.getMessage() for record in records])
+
+
+def make_record(msg):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, msg, None, None)
+
+
+def test_listener_sends_queued_records_in_batches():
+    log_queue = queue.Queue()
+    for idx in range(250):
+        log_queue.put(make_record(f"message {idx}"))
+    recorder = BatchRecorder()
+    listener = BatchQueueListener(log_queue, recorder, batch_size=100)
+
+    listener.start()
+    listener.stop()
+
+    assert [len(batch) for batch in recorder.batches] == [100, 100, 50]
+    assert recorder.batches[-1][-1] == "message 249"
+
+
+def test_full_queue_drops_and_counts_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+    for idx in range(5):
+        handler.handle(make_record(f"message {idx}"))
+
+    assert handler.dropped == 3
+    assert handler.queue.qsize() == 2
+
+
+def test_logger_sends_every_record_before_closing():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    log = Logger("127.0.0.1", server.getsockname()[1])
+    try:
+        for idx in range(20):
+            log.info(f"message {idx}")
+    finally:
+        log.close()
+        log.close()
+
+    messages = [server.recv(4096).decode() for _ in range(20)]
+    server.close()
+    assert messages[0].startswith("<14>")
+    assert messages[-1].rstrip("\0").endswith("[INFO] message 19")
+    assert log.dropped == 0
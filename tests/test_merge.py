@@ -0,0 +1,135 @@
+import csv
+import gzip
+import json
+
+from recurly_data.__main__ import main
+from recurly_data.merge import external_sort, merge_exports
+from recurly_data.record import Record, SiteRecord
+from recurly_data.sinks import make_sink
+
+
+def write_export(filename, rows, output_format="csv", record_class=Record):
+    with make_sink(output_format, filename, record_class.columns) as sink:
+        for idx, fields in enumerate(rows, 1):
+            sink.write(record_class(row=idx, **fields))
+
+
+def read_csv(filename):
+    with open(filename, newline="") as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def test_external_sort_merges_chunked_runs(tmp_path):
+    items = [((key,), (key,)) for key in (5, 3, 9, 1, 7, 2, 8, 6, 4, 0)]
+    assert [key for (key,), _ in external_sort(items, str(tmp_path), chunk_size=3)] == list(range(10))
+    assert not list(tmp_path.iterdir())
+
+
+def test_merge_keeps_the_newest_row_of_every_email(tmp_path):
+    old = str(tmp_path / "old.csv")
+    new = str(tmp_path / "new.csv")
+    out = str(tmp_path / "merged.csv")
+    write_export(old, [
+        {"email": "a@example.com", "name": "A"},
+        {"email": "b@example.com", "name": "B", "pending_change": {"new_plan_code": "yearly"}},
+        {"email": "", "name": "No email"},
+        {"email": "c@example.com", "name": "C"},
+        {"email": "", "name": "No email"},
+    ])
+    write_export(new, [
+        {"email": "d@example.com", "name": "D"},
+        {"email": "a@example.com", "name": "Aye"},
+        {"email": "d@example.com", "name": "Dee"},
+    ])
+
+    assert merge_exports([old, new], out, chunk_size=2) == 6
+
+    rows = read_csv(out)
+    assert [(row["row"], row["email"], row["name"]) for row in rows] == [
+        ("1", "b@example.com", "B"),
+        ("2", "", "No email"),
+        ("3", "c@example.com", "C"),
+        ("4", "", "No email"),
+        ("5", "a@example.com", "Aye"),
+        ("6", "d@example.com", "Dee"),
+    ]
+    assert json.loads(rows[0]["pending_change"]) == {"new_plan_code": "yearly"}
+    assert not (tmp_path / "merged.csv.tmp").exists()
+
+
+def test_merge_reads_and_writes_other_formats(tmp_path):
+    old = str(tmp_path / "old.jsonl.gz")
+    new = str(tmp_path / "new.csv")
+    out = str(tmp_path / "merged.jsonl.gz")
+    write_export(old, [
+        {"email": "a@example.com", "pending_change": {"new_plan_code": "yearly"}},
+        {"email": "b@example.com"},
+    ], output_format="jsonl.gz")
+    write_export(new, [{"email": "a@example.com", "name": "A"}])
+
+    merge_exports([old, new], out, output_format="jsonl.gz")
+
+    with gzip.open(out, "rt") as jsonl_file:
+        rows = [json.loads(line) for line in jsonl_file]
+    assert [(row["row"], row["email"], row["name"]) for row in rows] == [
+        (1, "b@example.com", None), (2, "a@example.com", "A"),
+    ]
+
+
+def test_merge_deduplicates_per_site(tmp_path):
+    export = str(tmp_path / "sites.csv")
+    write_export(export, [
+        {"site": "one", "email": "a@example.com", "name": "A1"},
+        {"site": "two", "email": "a@example.com", "name": "A2"},
+        {"site": "one", "email": "a@example.com", "name": "Aye1"},
+    ], record_class=SiteRecord)
+
+    assert main(["merge", "-q", "--file", export, export]) == 0
+
+    rows = read_csv(export)
+    assert [(row["row"], row["site"], row["name"]) for row in rows] == [
+        ("1", "two", "A2"), ("2", "one", "Aye1"),
+    ]
+
+
+def test_merge_reads_pending_changes_of_older_exports(tmp_path):
+    # Older exports wrote the pending change as the repr of a dict.
+    export = str(tmp_path / "old.csv")
+    with open(export, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(Record.columns)
+        writer.writerow([
+            1, "a@example.com", "A", "", "2019-01-01 00:00:00+00:00", "Monthly",
+            599, "", "", "", "",
+            "{'subject': 'pending_change', 'new_plan_activated': False}",
+        ])
+        writer.writerow([
+            2, "b@example.com", "B", "", "2019-01-01 00:00:01+00:00", "Monthly",
+            599, "", "", "", "", "not a dict",
+        ])
+    out = str(tmp_path / "merged.jsonl")
+
+    merge_exports([export], out, output_format="jsonl")
+
+    with open(out) as jsonl_file:
+        rows = [json.loads(line) for line in jsonl_file]
+    assert rows[0]["pending_change"] == {
+        "subject": "pending_change", "new_plan_activated": False
+    }
+    assert rows[0]["pricing_amount"] == 599
+    assert rows[1]["pending_change"] == "not a dict"
+
+
+def test_merge_deduplicates_jsonl_per_site(tmp_path):
+    export = str(tmp_path / "sites.jsonl")
+    write_export(export, [
+        {"site": "a", "email": "a@example.com", "name": "A"},
+        {"site": "b", "email": "a@example.com", "name": "B"},
+    ], output_format="jsonl", record_class=SiteRecord)
+    out = str(tmp_path / "merged.jsonl")
+
+    assert merge_exports([export], out, output_format="jsonl") == 2
+
+    with open(out) as jsonl_file:
+        rows = [json.loads(line) for line in jsonl_file]
+    assert [(row["site"], row["name"]) for row in rows] == [("a", "A"), ("b", "B")]
@@ -0,0 +1,67 @@
+import json
+import pickle
+
+from recurly_data.client import Client
+from recurly_data.metrics import Metrics
+
+
+def test_metrics_summary_counts_statuses_and_waits():
+    metrics = Metrics()
+    for seconds in (0.01, 0.02, 0.03, 0.2):
+        metrics.observe("accounts", seconds, 200, 100)
+    metrics.observe("accounts", 0.01, 429)
+    metrics.observe("stripe_customers", 1.0, 503)
+    metrics.observe("stripe_customers", 0.5, None)
+    metrics.observe_wait("accounts", 2.5)
+    metrics.finish(rows=5)
+
+    summary = metrics.summary()
+    accounts = summary["endpoints"]["accounts"]
+    assert accounts["requests"] == 5
+    assert accounts["statuses"] == {"200": 4, "429": 1}
+    assert accounts["bytes"] == 400
+    assert accounts["rate_limit_wait_seconds"] == 2.5
+    assert 0.01 <= accounts["latency"]["p50"] <= 0.025
+    assert accounts["latency"]["max"] == 0.2
+    assert summary["requests"] == 7
+    assert summary["rate_limited"] == 1
+    assert summary["server_errors"] == 1
+    assert summary["network_errors"] == 1
+    json.dumps(summary)
+
+
+def test_metrics_merge_after_pickling():
+    shard = Metrics()
+    shard.observe("subscriptions", 0.1, 200, 10)
+    shard = pickle.loads(pickle.dumps(shard))
+
+    metrics = Metrics()
+    metrics.observe("subscriptions", 0.3, 200, 10)
+    metrics.merge(shard)
+    stats = metrics.summary()["endpoints"]["subscriptions"]
+    assert stats["requests"] == 2
+    assert stats["bytes"] == 20
+
+
+def test_metrics_prometheus_textfile(tmp_path):
+    metrics = Metrics()
+    metrics.observe("accounts", 0.02, 200, 10)
+    metrics.observe("accounts", 0.07, 429)
+    metrics.finish(rows=1)
+    path = str(tmp_path / "recurly_data.prom")
+    metrics.write_prometheus(path)
+
+    with open(path) as prom_file:
+        text = prom_file.read()
+    assert 'recurly_data_http_requests_total{endpoint="accounts",status="429"} 1' in text
+    assert 'recurly_data_http_request_duration_seconds_bucket{endpoint="accounts",le="0.025"} 1' in text
+    assert 'recurly_data_http_request_duration_seconds_bucket{endpoint="accounts",le="+Inf"} 2' in text
+    assert "recurly_data_rows 1" in text
+
+
+def test_client_endpoint_names():
+    assert Client.endpoint("/accounts?limit=200&cursor=abc") == "accounts"
+    assert Client.endpoint("/accounts/abc/subscriptions") == "subscriptions"
+    assert Client.endpoint("/accounts/abc/coupon_redemptions") == "redemptions"
+    assert Client.endpoint("/subscriptions") == "site_subscriptions"
+    assert Client.endpoint("/plans") == "plans"
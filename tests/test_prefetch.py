@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from recurly_data.prefetch import prefetch
+
+
+def test_prefetch_yields_in_order_from_another_thread():
+    threads = set()
+
+    def make_iterable():
+        threads.add(threading.current_thread())
+        return iter(range(100))
+
+    assert list(prefetch(make_iterable, 10)) == list(range(100))
+    assert threading.current_thread() not in threads
+
+
+def test_prefetch_raises_errors_after_the_items_before_them():
+    def make_iterable():
+        yield 1
+        yield 2
+        raise ValueError("page failed")
+
+    items = prefetch(make_iterable, 1)
+    assert next(items) == 1
+    assert next(items) == 2
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_prefetch_stops_the_thread_when_closed():
+    produced = []
+    stopped = threading.Event()
+
+    def make_iterable():
+        try:
+            for idx in range(1000):
+                produced.append(idx)
+                yield idx
+        finally:
+            stopped.set()
+
+    items = prefetch(make_iterable, 5)
+    assert next(items) == 0
+    items.close()
+    assert stopped.wait(5)
+    assert len(produced) < 20
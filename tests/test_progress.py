@@ -0,0 +1,75 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from recurly_data import progress
+from recurly_data.progress import Progress
+from recurly_data.record import Record
+
+
+class FakeStream(io.StringIO):
+    def __init__(self, tty):
+        super().__init__()
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(progress, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def row(idx):
+    return Record(row=idx, email=f"customer{idx}@example.com", frequency="Monthly")
+
+
+def test_bar_is_skipped_when_not_a_terminal(clock):
+    stream = FakeStream(tty=False)
+    with Progress(total=3, stream=stream) as pbar:
+        assert pbar.mode == "none"
+        for idx in range(1, 4):
+            pbar.update(row(idx))
+    assert pbar.count == 3
+    assert stream.getvalue() == ""
+
+
+def test_bar_shows_the_latest_row_at_most_every_interval(clock):
+    stream = FakeStream(tty=True)
+    with Progress(total=6, interval=1.0, stream=stream) as pbar:
+        for idx in range(1, 4):
+            pbar.update(row(idx))
+        clock.now += 1.0
+        for idx in range(4, 7):
+            pbar.update(row(idx))
+
+    output = stream.getvalue()
+    assert "customer4@example.com" in output
+    for idx in (1, 2, 3, 5, 6):
+        assert f"customer{idx}@example.com" not in output
+
+
+def test_log_prints_a_line_every_log_interval(clock):
+    stream = FakeStream(tty=False)
+    with Progress(total=10, mode="log", log_interval=30.0, stream=stream) as pbar:
+        for idx in range(1, 4):
+            pbar.update(row(idx))
+        assert stream.getvalue() == ""
+        clock.now += 30.0
+        pbar.update(row(4))
+        pbar.update(row(5))
+
+    lines = stream.getvalue().splitlines()
+    assert lines == [
+        "Extracted 4/10 rows, 0.1 rows/s, last: 4 customer4@example.com Monthly",
+        "Extracted 5/10 rows, 0.2 rows/s",
+    ]
+
+
+def test_unknown_mode_is_refused():
+    with pytest.raises(Exception, match="Progress modes"):
+        Progress(mode="fancy", stream=FakeStream(tty=False))
@@ -0,0 +1,57 @@
+from recurly_data.retry import Retry, parse_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_retry_backoff_is_jittered_capped_and_honors_retry_after():
+    retry = Retry(backoff=1.0, max_backoff=5.0, jitter=lambda: 1.0)
+    assert [retry.delay(attempt) for attempt in range(1, 5)] == [1.0, 2.0, 4.0, 5.0]
+    assert retry.delay(1, retry_after=30.0) == 30.0
+
+    retry = Retry(backoff=1.0, jitter=lambda: 0.25)
+    assert retry.delay(3) == 1.0
+    assert retry.should_retry(5) and not retry.should_retry(6)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    clock = FakeClock()
+    retry = Retry(
+        breaker_threshold=3, breaker_cooldown=30.0,
+        clock=clock, sleep=clock.sleep,
+    )
+    retry.failure()
+    retry.failure()
+    retry.success()
+    retry.failure()
+    retry.failure()
+    assert retry.before_request() == 0.0
+
+    retry.failure()
+    assert retry.is_open
+    assert retry.before_request() == 30.0
+    assert not retry.is_open
+
+    # A failure right after the cooldown opens the breaker again.
+    retry.failure()
+    assert retry.before_request() == 30.0
+    retry.success()
+    retry.failure()
+    assert retry.before_request() == 0.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
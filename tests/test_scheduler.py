@@ -0,0 +1,40 @@
+from recurly_data.scheduler import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limiter_runs_freely_without_headers():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+    for _ in range(100):
+        limiter.acquire()
+    assert clock.slept == []
+
+
+def test_rate_limiter_spreads_budget_over_window():
+    clock = FakeClock()
+    limiter = RateLimiter(burst=1, clock=clock, sleep=clock.sleep)
+    limiter.update(1000, 10, clock.now + 100)
+    for _ in range(5):
+        limiter.acquire()
+    assert clock.slept == [10.0, 10.0, 10.0, 10.0]
+    assert limiter.remaining == 5
+
+
+def test_rate_limiter_sleeps_until_reset_when_exhausted():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+    limiter.update(1000, 0, clock.now + 30)
+    assert limiter.acquire() == 30
+    assert limiter.acquire() == 0
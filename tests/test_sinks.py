@@ -0,0 +1,81 @@
+import csv
+import gzip
+import json
+import sqlite3
+
+from recurly_data.record import Record
+from recurly_data.sinks import CsvSink, UpsertCsvSink, make_sink
+
+
+def read_csv(filename):
+    with open(filename, newline="") as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def test_csv_sink_appends_without_repeating_header(tmp_path):
+    filename = str(tmp_path / "out.csv")
+    for email in ("a@example.com", "b@example.com"):
+        with CsvSink(filename, flush_every=1) as sink:
+            sink.write(Record(row=1, email=email))
+
+    rows = read_csv(filename)
+    assert [row["email"] for row in rows] == ["a@example.com", "b@example.com"]
+
+
+def test_upsert_csv_sink_replaces_rows_by_key(tmp_path):
+    filename = str(tmp_path / "out.csv")
+    with CsvSink(filename) as sink:
+        sink.write(Record(row=1, email="a@example.com", name="A"))
+        sink.write(Record(row=2, email="b@example.com", name="B"))
+        sink.write(Record(row=3, email="a@example.com", name="A"))
+
+    with UpsertCsvSink(filename) as sink:
+        sink.write(Record(row=1, email="c@example.com", name="C"))
+        sink.write(Record(row=2, email="b@example.com", name="Bee"))
+
+    rows = [(row["row"], row["email"], row["name"]) for row in read_csv(filename)]
+    assert rows == [
+        ("1", "a@example.com", "A"),
+        ("2", "b@example.com", "Bee"),
+        ("3", "c@example.com", "C"),
+    ]
+
+
+def test_upsert_csv_sink_deletes_rows_by_key(tmp_path):
+    filename = str(tmp_path / "out.csv")
+    with CsvSink(filename) as sink:
+        sink.write(Record(row=1, email="a@example.com"))
+        sink.write(Record(row=2, email="b@example.com"))
+        sink.write(Record(row=3, email="a@example.com"))
+
+    with UpsertCsvSink(filename) as sink:
+        sink.delete("a@example.com")
+        sink.delete("c@example.com")
+
+    assert [(row["row"], row["email"]) for row in read_csv(filename)] == [
+        ("1", "b@example.com"),
+    ]
+
+
+def test_jsonl_sink_keeps_pending_change_nested(tmp_path):
+    filename = str(tmp_path / "out.jsonl.gz")
+    with make_sink("jsonl.gz", filename) as sink:
+        sink.write(Record(row=1, pending_change={"new_plan_code": "yearly"}))
+        sink.write(Record(row=2))
+
+    with gzip.open(filename, "rt") as jsonl_file:
+        rows = [json.loads(line) for line in jsonl_file]
+    assert rows[0]["pending_change"] == {"new_plan_code": "yearly"}
+    assert rows[1]["pending_change"] is None
+    assert list(rows[1]) == list(Record.columns)
+
+
+def test_sqlite_sink_inserts_in_batches(tmp_path):
+    filename = str(tmp_path / "out.sqlite3")
+    with make_sink("sqlite", filename, flush_every=2) as sink:
+        for idx in range(1, 6):
+            sink.write(Record(row=idx, email=f"{idx}@example.com"))
+
+    conn = sqlite3.connect(filename)
+    assert conn.execute("SELECT COUNT(*) FROM recurly_data").fetchone() == (5,)
+    conn.close()
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+import recurly_data
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(recurly_data.__file__)))
+HEAVY_MODULES = ["recurly", "requests", "tqdm", "sentry_sdk", "dotenv", "zstandard"]
+# Generous, the cli itself imports in a few milliseconds.
+IMPORT_BUDGET_SECONDS = 0.1
+
+
+def run_python(code, *args):
+    return subprocess.run(
+        [sys.executable, *args, "-c", code],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+
+def test_cli_import_loads_no_heavy_modules():
+    result = run_python(
+        "import sys\n"
+        "from recurly_data.__main__ import build_parser, main\n"
+        "build_parser().parse_args([])\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_extractor_import_loads_no_heavy_modules():
+    result = run_python(
+        "import sys\n"
+        "import recurly_data.recurly_data\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_cli_import_time_budget():
+    result = run_python("import recurly_data.__main__", "-X", "importtime")
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total) / 1e6
+    assert cumulative["recurly_data.__main__"] < IMPORT_BUDGET_SECONDS
+
+
+def test_version():
+    result = subprocess.run(
+        [sys.executable, "-m", "recurly_data", "--version"],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    assert result.stdout.strip() == recurly_data.__version__
@@ -0,0 +1,18 @@
+import pytest
+
+from recurly_data.subscriptions import SubscriptionIndex
+
+
+@pytest.mark.parametrize("spill", [False, True])
+def test_subscription_index_keeps_listing_order(spill):
+    index = SubscriptionIndex(spill=spill)
+    index.add("a", {"frequency": "Monthly", "pricing_amount": 500})
+    index.add("b", {"frequency": "Yearly", "pricing_amount": 5000})
+    index.add("a", {"pending_change": {"new_plan_code": "yearly"}})
+    index.finish()
+    assert index.get("a") == [
+        {"frequency": "Monthly", "pricing_amount": 500},
+        {"pending_change": {"new_plan_code": "yearly"}},
+    ]
+    assert index.get("c") == []
+    index.close()